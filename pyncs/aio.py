@@ -0,0 +1,124 @@
+""" asyncio client for driving many simulations from one event loop.
+
+This module requires Python 3.7+. The blocking work is done by a regular
+Simulator on a bounded thread pool, so both clients share the same pooled
+Transport, serialization code and error handling. A request already handed
+to a thread can't be interrupted: cancelling a coroutine, or its timeout
+running out, stops it waiting for the result, but the request itself runs
+to the end in the background. wait_for_completion stops between polls.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .polling import Backoff
+from .pyncs import Simulator
+from .transport import Transport
+
+
+class AsyncSimulator(object):
+
+    STATUS_RUNNING = Simulator.STATUS_RUNNING
+    STATUS_IDLE = Simulator.STATUS_IDLE
+
+    def __init__(self, host, port, username, password, transport=None,
+                 max_concurrency=10, timeout=None, token_cache=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_concurrency = max_concurrency
+        # default per-request deadline in seconds, None waits forever
+        self.timeout = timeout
+        # size the pool so every in-flight request can keep its connection
+        if transport is None:
+            transport = Transport(pool_maxsize=max_concurrency)
+        self.transport = transport
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._semaphore = None
+        # the blocking client logs in on its first request
+        self._simulator = Simulator(host, port, username, password,
+                                    transport=transport,
+                                    token_cache=token_cache)
+
+    @property
+    def is_authenticated(self):
+        return self._simulator.is_authenticated
+
+    async def authenticate(self, timeout=None, refresh=False):
+        await self._call(self._simulator.authenticate, refresh=refresh,
+                         timeout=timeout)
+
+    async def get_status(self, timeout=None, wait=None):
+        return await self._call(self._simulator.get_status, wait=wait,
+                                timeout=timeout)
+
+    async def run(self, simulation, timeout=None, **kwargs):
+        return await self._call(self._simulator.run, simulation,
+                                timeout=timeout, **kwargs)
+
+    async def run_many(self, simulations, return_exceptions=False, **kwargs):
+        # the semaphore in _call keeps at most max_concurrency in flight
+        return await asyncio.gather(
+            *[self.run(simulation, **kwargs) for simulation in simulations],
+            return_exceptions=return_exceptions
+        )
+
+    async def wait_for_completion(self, timeout=None, backoff=None):
+        """ Waits until the daemon is idle, long polling and backing off
+        like polling.wait_for_completion. Raises asyncio.TimeoutError after
+        timeout seconds. Cancelling it takes effect between polls, a long
+        poll in flight finishes in the background. """
+        backoff = backoff if backoff is not None else Backoff()
+        loop = asyncio.get_running_loop()
+
+        async def poll():
+            while True:
+                start = loop.time()
+                status = await self.get_status(wait=backoff.delay)
+                if status == Simulator.STATUS_IDLE:
+                    return status
+                # a long poll has already spent part of the interval
+                delay = backoff.next() - (loop.time() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        return await asyncio.wait_for(poll(), timeout)
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+        self.transport.close()
+
+    async def __aenter__(self):
+        if not self.is_authenticated:
+            await self.authenticate()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _call(self, func, *args, **kwargs):
+        timeout = kwargs.pop('timeout', None)
+        if timeout is None:
+            timeout = self.timeout
+        # created lazily so it binds to the loop that is actually running
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs)
+            )
+            # cancelling or timing out abandons the result of the blocking
+            # call rather than aborting it, the connection goes back to the
+            # pool once it finishes
+            return await asyncio.wait_for(future, timeout)
+
+
+async def wait_for_all(simulators, timeout=None, backoff=Backoff):
+    """ Waits for every AsyncSimulator to become idle. Each one polls on its
+    own backoff from this loop, no threads are parked on sleeping pollers.
+    Raises asyncio.TimeoutError if any is still running after timeout
+    seconds. """
+    await asyncio.wait_for(asyncio.gather(
+        *[x.wait_for_completion(backoff=backoff()) for x in simulators]
+    ), timeout)
@@ -0,0 +1,220 @@
+""" Binary attachments uploaded alongside the transfer format.
+
+Arrays such as explicit connectivity are far too large to embed in the JSON
+spec, so they travel as attachments of a multipart/related upload: the first
+part is the transfer format itself, in JSON or the wire module's binary
+format, and every other part holds the raw bytes of one attachment, named by
+its Content-ID. The spec refers to an attachment by that name and describes
+the arrays packed into it, little endian and each starting on an ALIGNMENT
+byte boundary:
+
+    {'attachment': name,
+     'arrays': {'indices': {'dtype': '<i4', 'offset': 0, 'count': 1000}}}
+
+Array buffers are handed to the socket as they are, without being copied
+into the request body, and decoded with numpy.frombuffer on the other side.
+"""
+import binascii
+import hashlib
+import os
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CONTENT_TYPE = 'multipart/related'
+
+# offsets of arrays within an attachment are multiples of this, so they can
+# be viewed in place once received
+ALIGNMENT = 8
+
+if sys.version_info[0] >= 3:
+    def _raw(array):
+        return memoryview(array).cast('B')
+else:
+    def _raw(array):
+        return buffer(array)  # noqa: F821
+
+
+class Attachment(object):
+    """ Named set of arrays sent as one part of the upload """
+
+    def __init__(self, name, arrays):
+        self.name = name
+        # (name, array) pairs, in the order they're packed
+        self.arrays = []
+        self.layout = {}
+        offset = 0
+        for key, array in arrays:
+            # little endian and contiguous, a no-op for most arrays
+            array = numpy.ascontiguousarray(
+                array, dtype=array.dtype.newbyteorder('<'))
+            self.arrays.append((key, array))
+            self.layout[key] = {
+                'dtype': array.dtype.str,
+                'offset': offset,
+                'count': len(array)
+            }
+            offset += _padded(array.nbytes)
+        self.size = offset
+
+    def describe(self):
+        """ Returns the reference to this attachment kept in the spec """
+        return {'attachment': self.name, 'arrays': self.layout}
+
+    def chunks(self):
+        for key, array in self.arrays:
+            if array.nbytes:
+                yield _raw(array)
+            padding = _padded(array.nbytes) - array.nbytes
+            if padding:
+                yield b'\0' * padding
+
+
+def _padded(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+class Body(object):
+    """ A request body made of byte chunks with a known total length, so
+    requests sends it with a Content-Length and each chunk as it is """
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.size = sum(len(x) for x in self.chunks)
+        self._chunks = None
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        # http clients send whatever each read returns, so hand out whole
+        # chunks whatever size is asked for, then start over for a resend
+        if self._chunks is None:
+            self._chunks = iter(self.chunks)
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._chunks = None
+            return b''
+        return chunk
+
+
+def new_boundary():
+    return binascii.hexlify(os.urandom(16)).decode('ascii')
+
+
+def derived_boundary(payload, attachments):
+    """ Returns a boundary hashed from the payload chunks and every
+    attachment, so the same upload always gets the same body. It's as
+    unlikely as a random one to turn up in the parts it's hashed from. """
+    digest = hashlib.sha256()
+    for chunk in payload:
+        digest.update(chunk)
+    for attachment in attachments:
+        digest.update(('\0%s\0%d\0' % (attachment.name, attachment.size))
+                      .encode('utf-8'))
+        for chunk in attachment.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def content_type(payload_type, boundary):
+    """ Returns the Content-Type of a body built by encode """
+    return '%s; type="%s"; boundary=%s' % (CONTENT_TYPE, payload_type,
+                                           boundary)
+
+
+def encode(payload, payload_type, attachments, boundary):
+    """ Yields the byte chunks of a multipart/related body holding the
+    payload chunks followed by every attachment """
+    delimiter = ('--%s\r\n' % boundary).encode('ascii')
+    yield delimiter
+    yield ('Content-Type: %s\r\n\r\n' % payload_type).encode('ascii')
+    for chunk in payload:
+        yield chunk
+    for attachment in attachments:
+        yield b'\r\n' + delimiter
+        # the length lets the receiver skip the part without scanning it
+        # for the boundary
+        yield ('Content-Type: application/octet-stream\r\n'
+               'Content-ID: <%s>\r\n'
+               'Content-Length: %d\r\n\r\n' %
+               (attachment.name, attachment.size)).encode('ascii')
+        for chunk in attachment.chunks():
+            yield chunk
+    yield ('\r\n--%s--\r\n' % boundary).encode('ascii')
+
+
+def decode(body, content_type):
+    """ Splits a multipart/related body into the payload's content type, the
+    payload and a dict of attachment name -> bytes """
+    params = _params(content_type)
+    if 'boundary' not in params:
+        raise ValueError("multipart body without a boundary")
+    delimiter = ('--%s' % params['boundary']).encode('ascii')
+    parts = []
+    pos = body.find(delimiter)
+    if pos < 0:
+        raise ValueError("multipart body without any parts")
+    while True:
+        pos += len(delimiter)
+        if body[pos:pos + 2] == b'--':
+            break
+        end = body.find(b'\r\n\r\n', pos)
+        if end < 0:
+            raise ValueError("truncated multipart headers")
+        headers = {}
+        for line in body[pos:end].decode('ascii').split('\r\n'):
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        start = end + 4
+        if 'content-length' in headers:
+            stop = start + int(headers['content-length'])
+            if body[stop:stop + 2 + len(delimiter)] != b'\r\n' + delimiter:
+                raise ValueError("multipart part overruns its length")
+        else:
+            stop = body.find(b'\r\n' + delimiter, start)
+            if stop < 0:
+                raise ValueError("truncated multipart body")
+        parts.append((headers, body[start:stop]))
+        pos = stop + 2
+    if not parts:
+        raise ValueError("multipart body without any parts")
+    headers, payload = parts[0]
+    attachments = {}
+    for part_headers, data in parts[1:]:
+        name = part_headers.get('content-id', '').strip('<>')
+        if not name:
+            raise ValueError("attachment without a Content-ID")
+        attachments[name] = data
+    payload_type = headers.get('content-type', params.get('type'))
+    return payload_type, payload, attachments
+
+
+def _params(content_type):
+    params = {}
+    for item in content_type.split(';')[1:]:
+        if '=' in item:
+            key, value = item.split('=', 1)
+            params[key.strip().lower()] = value.strip().strip('"')
+    return params
+
+
+def arrays(reference, data):
+    """ Views the arrays of an attachment, given its reference from the spec
+    and its bytes, without copying them """
+    result = {}
+    for key, layout in reference['arrays'].items():
+        dtype = numpy.dtype(str(layout['dtype']))
+        if layout['offset'] + layout['count'] * dtype.itemsize > len(data):
+            raise ValueError("array %s runs past the end of attachment %s" %
+                             (key, reference['attachment']))
+        result[key] = numpy.frombuffer(data, dtype, layout['count'],
+                                       layout['offset'])
+    return result
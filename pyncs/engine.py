@@ -0,0 +1,485 @@
+""" In-process reference backend for small Izhikevich networks.
+
+LocalSimulator has the same run(simulation) and run_transfer_format
+interface as Simulator but integrates the model with numpy instead of
+submitting it to a daemon. It covers IzhNeuron populations, FlatSynapse
+connections with delay buffers, RectCurrentStimulus inputs and neuron
+Reports, which is enough for quick, network-free smoke runs and for a
+performance baseline against the daemon.
+Normal and Uniform neuron and synapse parameters are drawn by the sampling
+module, so a run seeded with seed gives neurons the values
+sampling.materialize(simulation, seed) reports, and the i-th synapse of a
+connection the i-th value of its population. Which pairs a connection joins,
+and so how many synapses it has, is drawn by the engine's own generator.
+
+Units follow NCS: times and durations are in seconds, stimulus frequencies
+in Hz, stimulus widths and synaptic delays in time steps, and the
+Izhikevich state equations are integrated in milliseconds.
+"""
+import time
+
+import numpy
+
+from . import sampling
+from .labels import LabelIndex
+from .pyncs import Simulator, SimulationError, EntityError
+
+
+class LocalSimulator(object):
+
+    STATUS_RUNNING = Simulator.STATUS_RUNNING
+    STATUS_IDLE = Simulator.STATUS_IDLE
+
+    def __init__(self, dt=0.001, seed=None):
+        # length of a time step in seconds
+        self.dt = dt
+        self.seed = seed
+        # nothing to log into, but keep the attributes Simulator users check
+        self.is_authenticated = True
+        self.manifest = None
+        self.hooks = []
+        self.profile = False
+        self.trace_memory = False
+        self.status = Simulator.STATUS_IDLE
+
+    def authenticate(self, refresh=False):
+        pass
+
+    def get_status(self, wait=None):
+        return self.status
+
+    def wait_for_completion(self, timeout=None, backoff=None):
+        # runs finish before run returns
+        return self.status
+
+    def close(self):
+        pass
+
+    def run(self, simulation, duration=None):
+        """ Integrates the simulation locally and returns its reports """
+        entity_dicts = Simulator._generate_entity_dicts(
+            simulation.top_group, simulation.stimuli, simulation.reports)
+        entity_dicts = Simulator._refresh_content_ids(entity_dicts)
+        transfer_format = Simulator._process_entity_dicts(
+            simulation.top_group, entity_dicts)
+        return self.run_transfer_format(
+            transfer_format,
+            attachments=Simulator._collect_attachments(entity_dicts),
+            duration=duration)
+
+    def run_transfer_format(self, transfer_format, content_encoding=None,
+                            attachments=None, iterencode=None,
+                            duration=None):
+        """ Integrates a model given in the transfer format, as produced by
+        _process_entity_dicts or loaded back from its JSON. attachments are
+        the attachments.Attachment its explicit connections refer to.
+        Without a duration the run lasts until the last stimulus or report
+        ends. content_encoding and iterencode are accepted so the arguments
+        mean what they do to Simulator.run_transfer_format, and ignored,
+        there's nothing to encode. """
+        rng = numpy.random.RandomState(self.seed)
+        seed = self.seed
+        if seed is None:
+            seed = rng.randint(2 ** 31 - 1)
+        # explicit connectivity is read straight from its arrays
+        arrays = dict((x.name, dict(x.arrays)) for x in attachments or ())
+        self.status = Simulator.STATUS_RUNNING
+        try:
+            network = _Network(transfer_format, self.dt, rng, arrays, seed)
+            return network.run(duration)
+        finally:
+            self.status = Simulator.STATUS_IDLE
+
+
+def _sample(value, size, rng):
+    """ Expands a parameter from the transfer format into a per-instance
+    array, drawing from its distribution if it has one """
+    if isinstance(value, dict):
+        if value['type'] == 'normal':
+            return rng.normal(value['mean'], value['stdev'], size)
+        if value['type'] == 'uniform':
+            return rng.uniform(value['min'], value['max'], size)
+        raise SimulationError("unsupported distribution %s" % value['type'])
+    return numpy.full(size, float(value))
+
+
+def _bernoulli_positions(total, probability, rng):
+    """ Returns the sorted positions in range(total) that succeed a Bernoulli
+    trial, by drawing the gaps between successes rather than every trial """
+    if probability >= 1.0:
+        return numpy.arange(total)
+    positions = []
+    last = -1
+    while True:
+        # draw roughly enough gaps to cover what's left in one go
+        expected = int((total - last) * probability * 1.1) + 16
+        steps = numpy.cumsum(rng.geometric(probability, expected)) + last
+        positions.append(steps[steps < total])
+        if steps[-1] >= total:
+            break
+        last = steps[-1]
+    return numpy.concatenate(positions)
+
+
+class _Scope(object):
+    """ One instance of a group placed in the model, for resolving labels """
+
+    def __init__(self, group, path):
+        self.group = group
+        self.path = path
+
+
+class _Network(object):
+
+    def __init__(self, transfer_format, dt, rng, attachments=None, seed=0):
+        self.dt = dt
+        self.rng = rng
+        # neuron and synapse parameters are drawn by the sampling module
+        # from this
+        self.seed = seed
+        self.attachments = attachments or {}
+        self.neuron_specs = dict((x['_id'], x) for x in
+                                 transfer_format['neurons'])
+        self.synapse_specs = dict((x['_id'], x) for x in
+                                  transfer_format['synapses'])
+        self.group_specs = dict((x['_id'], x) for x in
+                                transfer_format['groups'])
+        self.labels = LabelIndex.from_transfer_format(transfer_format)
+        self.populations = []
+        self.scopes = []
+        # label path from the top group -> population index
+        self.paths = {}
+        self._build_populations(transfer_format['top_group'])
+        self._build_neurons()
+        self._build_synapses()
+        self.stimuli = [self._build_stimulus(x)
+                        for x in transfer_format['stimuli']]
+        self.reports = [self._build_report(x)
+                        for x in transfer_format['reports']]
+
+    def _build_populations(self, top_group_id):
+        top_group = self.group_specs[top_group_id]
+        top_path = ()
+        if top_group.get('entity_name'):
+            top_path = (top_group['entity_name'],)
+        # instantiate the hierarchy with a stack, a group used by several
+        # subgroups gets its own neurons for every placement
+        stack = [(top_group, top_path)]
+        start = 0
+        while stack:
+            group, path = stack.pop()
+            self.scopes.append(_Scope(group, path))
+            spec = group['specification']
+            for neuron_group in spec['neuron_groups']:
+                neuron_path = path + (neuron_group['label'],)
+                self.populations.append({
+                    'path': neuron_path,
+                    'neuron': neuron_group['neuron'],
+                    'start': start,
+                    'count': neuron_group['count']
+                })
+                start += neuron_group['count']
+            for subgroup in spec['subgroups']:
+                stack.append((self.group_specs[subgroup['group']],
+                              path + (subgroup['label'],)))
+        self.size = start
+        for idx, population in enumerate(self.populations):
+            self.paths[population['path']] = idx
+
+    def resolve(self, label, scope=None):
+        """ Returns the population indices a label refers to, relative to a
+        group instance or absolute from the top group """
+        top = self.scopes[0]
+        scope = scope if scope is not None else top
+        group_id = scope.group['_id']
+        try:
+            found = self.labels.resolve(
+                label, self.labels.scopes[group_id].group)
+        except EntityError as e:
+            raise SimulationError(e.value)
+        # paths are relative to the group the label was resolved in, or to
+        # the top group when it fell back to an absolute one
+        return sorted(self.paths[(scope.path if root == group_id
+                                  else top.path) + path]
+                      for root, path in found)
+
+    def _indices(self, populations):
+        if not populations:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return numpy.concatenate([
+            numpy.arange(self.populations[x]['start'],
+                         self.populations[x]['start'] +
+                         self.populations[x]['count'])
+            for x in populations
+        ])
+
+    def _build_neurons(self):
+        params = ['a', 'b', 'c', 'd', 'u', 'v', 'threshold']
+        state = dict((x, numpy.zeros(self.size)) for x in params)
+        for population in self.populations:
+            neuron = self.neuron_specs[population['neuron']]
+            if neuron['specification']['neuron_type'] != 'izh_neuron':
+                raise SimulationError(
+                    "the local engine only supports izh_neuron, not %s" %
+                    neuron['specification']['neuron_type']
+                )
+            window = slice(population['start'],
+                           population['start'] + population['count'])
+            for param in params:
+                value = neuron['specification'][param]
+                if isinstance(value, dict):
+                    # the same values sampling.materialize gives
+                    key = sampling._key(neuron['_id'], population['path'])
+                    state[param][window] = sampling.Parameter(
+                        param, value, population['count'], key, self.seed
+                    ).array()
+                else:
+                    state[param][window] = value
+        self.a = state['a']
+        self.b = state['b']
+        self.c = state['c']
+        self.d = state['d']
+        self.u = state['u']
+        self.v = state['v']
+        self.threshold = state['threshold']
+
+    def _build_synapses(self):
+        pre = []
+        post = []
+        delays = []
+        currents = []
+        for scope in self.scopes:
+            for index, connection in enumerate(
+                    scope.group['specification']['connections']):
+                synapse = self.synapse_specs[connection['synapse']]
+                spec = synapse['specification']
+                if spec['synapse_type'] != 'flat':
+                    raise SimulationError(
+                        "the local engine only supports flat synapses, "
+                        "not %s" % spec['synapse_type']
+                    )
+                if 'edges' in connection:
+                    edge_sets = [self._explicit(connection, scope)]
+                else:
+                    edge_sets = []
+                    for source in self.resolve(connection['presynaptic'],
+                                               scope):
+                        for target in self.resolve(connection['postsynaptic'],
+                                                   scope):
+                            edge_sets.append(self._connect(
+                                source, target, connection) + (None, None))
+                # the same values sampling.materialize gives
+                key = sampling._key(synapse['_id'], scope.path, index)
+                total = sum(len(x[0]) for x in edge_sets)
+                delay = self._parameter('delay', spec['delay'], total, key)
+                current = self._parameter('current', spec['current'], total,
+                                          key)
+                offset = 0
+                for edge_pre, edge_post, weights, edge_delays in edge_sets:
+                    count = len(edge_pre)
+                    pre.append(edge_pre)
+                    post.append(edge_post)
+                    # explicit edges may carry their own delays and weights
+                    if edge_delays is None:
+                        edge_delays = delay[offset:offset + count]
+                    delays.append(numpy.maximum(numpy.rint(edge_delays), 1)
+                                  .astype(numpy.int64))
+                    if weights is None:
+                        weights = current[offset:offset + count]
+                    currents.append(numpy.asarray(weights, dtype=float))
+                    offset += count
+        if pre:
+            pre = numpy.concatenate(pre)
+            order = numpy.argsort(pre, kind='mergesort')
+            self.post = numpy.concatenate(post)[order]
+            self.delays = numpy.concatenate(delays)[order]
+            self.currents = numpy.concatenate(currents)[order]
+            pre = pre[order]
+        else:
+            pre = numpy.zeros(0, dtype=numpy.int64)
+            self.post = pre
+            self.delays = pre
+            self.currents = numpy.zeros(0)
+        # outgoing edges of neuron i are indptr[i]:indptr[i + 1]
+        self.indptr = numpy.zeros(self.size + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(pre, minlength=self.size),
+                     out=self.indptr[1:])
+        # ring buffer of input current, one row per pending time step
+        self.buffer = numpy.zeros((int(self.delays.max(initial=0)) + 1,
+                                   self.size))
+
+    def _parameter(self, name, value, count, key):
+        """ Returns the count values of a parameter as something sliceable,
+        drawn as they're read if it has a distribution """
+        if isinstance(value, dict):
+            return sampling.Parameter(name, value, count, key, self.seed)
+        return numpy.full(count, float(value))
+
+    def _connect(self, source, target, connection):
+        source = self.populations[source]
+        target = self.populations[target]
+        total = source['count'] * target['count']
+        positions = _bernoulli_positions(total, connection['probability'],
+                                         self.rng)
+        pre = positions // target['count'] + source['start']
+        post = positions % target['count'] + target['start']
+        # without recurrence a population doesn't connect neurons to
+        # themselves
+        if source is target and not connection['recurrent']:
+            keep = pre != post
+            pre = pre[keep]
+            post = post[keep]
+        return pre, post
+
+    def _explicit(self, connection, scope):
+        """ Returns the edges of a connection given as arrays, with their
+        weights and delays, None when they weren't given """
+        reference = connection['edges']
+        try:
+            arrays = self.attachments[reference['attachment']]
+        except KeyError:
+            raise SimulationError("attachment %s is missing" %
+                                  reference['attachment'])
+        populations = []
+        for label in (connection['presynaptic'], connection['postsynaptic']):
+            resolved = self.resolve(label, scope)
+            if len(resolved) != 1:
+                raise SimulationError("explicit connections join two neuron "
+                                      "groups, %s doesn't name one" % label)
+            populations.append(self.populations[resolved[0]])
+        source, target = populations
+        indptr = arrays['indptr']
+        rows = numpy.repeat(numpy.arange(len(indptr) - 1), numpy.diff(indptr))
+        pre = rows + source['start']
+        post = arrays['indices'].astype(numpy.int64) + target['start']
+        return pre, post, arrays.get('weights'), arrays.get('delays')
+
+    def _step(self, seconds):
+        return int(round(seconds / self.dt))
+
+    def _build_stimulus(self, stimulus):
+        spec = stimulus['specification']
+        if spec['stimulus_type'] != 'rectangular_current':
+            raise SimulationError("the local engine only supports "
+                                  "rectangular_current stimuli, not %s" %
+                                  spec['stimulus_type'])
+        populations = set()
+        for destination in spec['destinations']:
+            populations.update(self.resolve(destination))
+        indices = self._indices(sorted(populations))
+        indices = indices[self.rng.uniform(size=len(indices)) <
+                          spec['probability']]
+        frequency = float(spec['frequency'])
+        return {
+            'indices': indices,
+            'amplitude': _sample(spec['amplitude'], len(indices), self.rng),
+            'start': self._step(spec['time_start']),
+            'end': self._step(spec['time_end']),
+            'period': max(int(round(1.0 / (frequency * self.dt))), 1),
+            'width': int(spec['width'])
+        }
+
+    def _build_report(self, report):
+        spec = report['specification']
+        if spec['report_type'] != 'neuron':
+            raise SimulationError("the local engine only supports neuron "
+                                  "reports, not %s" % spec['report_type'])
+        populations = set()
+        for target in spec['report_target']:
+            populations.update(self.resolve(target))
+        indices = self._indices(sorted(populations))
+        indices = indices[self.rng.uniform(size=len(indices)) <
+                          spec['probability']]
+        start = self._step(spec['time_start'])
+        end = self._step(spec['time_end'])
+        return {
+            '_id': report['_id'],
+            'indices': indices,
+            'start': start,
+            'end': end,
+            'voltages': numpy.zeros((max(end - start, 0), len(indices))),
+            'spike_steps': [],
+            'spike_neurons': []
+        }
+
+    def run(self, duration=None):
+        if duration is None:
+            ends = [x['end'] for x in self.stimuli + self.reports]
+            steps = max(ends) if ends else self._step(1.0)
+        else:
+            steps = self._step(duration)
+        started = time.time()
+        dt_ms = self.dt * 1000.0
+        slots = len(self.buffer)
+        spike_count = 0
+        for step in range(steps):
+            # input arriving now from delayed synapses
+            slot = step % slots
+            current = self.buffer[slot].copy()
+            self.buffer[slot] = 0.0
+            for stimulus in self.stimuli:
+                if (stimulus['start'] <= step < stimulus['end'] and
+                        (step - stimulus['start']) % stimulus['period'] <
+                        stimulus['width']):
+                    current[stimulus['indices']] += stimulus['amplitude']
+            # two half steps for v keep the integration stable
+            v = self.v
+            for _ in range(2):
+                v += 0.5 * dt_ms * (0.04 * v * v + 5.0 * v + 140.0 -
+                                    self.u + current)
+            self.u += dt_ms * self.a * (self.b * v - self.u)
+            fired = numpy.flatnonzero(v >= self.threshold)
+            for report in self.reports:
+                if report['start'] <= step < report['end']:
+                    report['voltages'][step - report['start']] = \
+                        v[report['indices']]
+                    hits = fired[numpy.isin(fired, report['indices'])]
+                    report['spike_steps'].append(numpy.full(len(hits), step))
+                    report['spike_neurons'].append(hits)
+            if len(fired):
+                spike_count += len(fired)
+                v[fired] = self.c[fired]
+                self.u[fired] += self.d[fired]
+                self._propagate(fired, step)
+        return {
+            'duration': steps * self.dt,
+            'steps': steps,
+            'neurons': self.size,
+            'synapses': len(self.post),
+            'spikes': spike_count,
+            'wall_time': time.time() - started,
+            'reports': dict((x['_id'], self._report_result(x, steps))
+                            for x in self.reports)
+        }
+
+    def _propagate(self, fired, step):
+        starts = self.indptr[fired]
+        lengths = self.indptr[fired + 1] - starts
+        total = lengths.sum()
+        if not total:
+            return
+        # positions of every outgoing edge of the neurons that fired
+        offsets = numpy.repeat(starts - numpy.cumsum(lengths) + lengths,
+                               lengths)
+        edges = offsets + numpy.arange(total)
+        slots = (step + self.delays[edges]) % len(self.buffer)
+        numpy.add.at(self.buffer, (slots, self.post[edges]),
+                     self.currents[edges])
+
+    def _report_result(self, report, steps_run):
+        def joined(parts, dtype):
+            if not parts:
+                return numpy.zeros(0, dtype=dtype)
+            return numpy.concatenate(parts).astype(dtype)
+        # a run shorter than the report's window only fills part of it
+        rows = max(min(report['end'], steps_run) - report['start'], 0)
+        rows = min(rows, len(report['voltages']))
+        steps = numpy.arange(report['start'], report['start'] + rows)
+        return {
+            'neurons': report['indices'],
+            'times': steps * self.dt,
+            'voltages': report['voltages'][:rows],
+            'spike_times': joined(report['spike_steps'],
+                                  numpy.int64) * self.dt,
+            'spike_neurons': joined(report['spike_neurons'], numpy.int64)
+        }
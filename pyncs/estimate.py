@@ -0,0 +1,227 @@
+""" Pre-flight cost estimates for simulations, computed locally from the
+entity graph before anything is sent to a daemon """
+
+# bytes the daemon keeps per state value and per neuron index
+VALUE_BYTES = 4
+INDEX_BYTES = 4
+
+
+class Estimate(object):
+    """ Expected size of a simulation once it is built by the daemon """
+
+    def __init__(self):
+        self.neurons = 0
+        self.synapses = 0.0
+        # neuron/synapse type -> expected count
+        self.neuron_types = {}
+        self.synapse_types = {}
+        # neuron/synapse type -> bytes of state per instance
+        self.neuron_bytes = {}
+        self.synapse_bytes = {}
+        # report _id -> expected bytes of output
+        self.reports = {}
+
+    @property
+    def state_bytes(self):
+        total = 0.0
+        for neuron_type, count in self.neuron_types.items():
+            total += count * self.neuron_bytes[neuron_type]
+        for synapse_type, count in self.synapse_types.items():
+            total += count * self.synapse_bytes[synapse_type]
+        return total
+
+    @property
+    def report_bytes(self):
+        return sum(self.reports.values())
+
+    def as_dict(self):
+        return {
+            'neurons': self.neurons,
+            'synapses': self.synapses,
+            'neuron_types': dict(self.neuron_types),
+            'synapse_types': dict(self.synapse_types),
+            'state_bytes': self.state_bytes,
+            'report_bytes': self.report_bytes,
+            'reports': dict(self.reports)
+        }
+
+    def check(self, limits):
+        """ Returns a description of every limit the estimate exceeds. limits
+        maps any of neurons, synapses, state_bytes and report_bytes to the
+        largest acceptable value. """
+        exceeded = []
+        for name in sorted(limits):
+            value = getattr(self, name)
+            if value > limits[name]:
+                exceeded.append("%s %.4g > %.4g" % (name, value,
+                                                    limits[name]))
+        return exceeded
+
+
+class _GroupInfo(object):
+    """ Totals for one group, shared by every place the group is used """
+
+    def __init__(self, group):
+        self.group = group
+        self.neurons = 0
+        self.synapses = 0.0
+        self.neuron_types = {}
+        self.synapse_types = {}
+
+
+def _state_bytes(entity):
+    # every numeric parameter becomes a state value on the daemon, the
+    # *_type field only selects the kernel
+    schema = entity.schema()
+    values = [x for x in schema.parameters if not x.endswith('_type')]
+    size = len(values) * VALUE_BYTES
+    for channel in getattr(entity, 'channels', []):
+        size += _state_bytes(channel)
+    return size
+
+
+def _add(counts, key, value):
+    counts[key] = counts.get(key, 0) + value
+
+
+class _Estimator(object):
+
+    def __init__(self, simulation, dt):
+        from .labels import LabelIndex
+        self.simulation = simulation
+        self.dt = dt
+        self.infos = {}
+        self.estimate = Estimate()
+        # connections size their labels the way they're checked and built
+        self.index = LabelIndex(simulation.top_group)
+
+    def run(self):
+        top = self._info(self.simulation.top_group)
+        estimate = self.estimate
+        estimate.neurons = top.neurons
+        estimate.synapses = top.synapses
+        estimate.neuron_types = top.neuron_types
+        estimate.synapse_types = top.synapse_types
+        index = self.index
+        for stimulus in self.simulation.stimuli:
+            for destination in stimulus.destinations:
+                index.resolve(destination)
+        for report in self.simulation.reports:
+            steps = max(report.time_end - report.time_start, 0) / self.dt
+            if report.report_type == 'synapse':
+                values = estimate.synapses
+            else:
+                found = set()
+                for target in report.report_target:
+                    found.update(index.target(target))
+                values = index.total(found)
+            estimate.reports[report._id] = \
+                values * report.probability * steps * VALUE_BYTES
+        return estimate
+
+    def _info(self, top_group):
+        # post-order walk so a group's subgroups are summed before it
+        stack = [(top_group, False)]
+        pending = set()
+        while stack:
+            group, expanded = stack.pop()
+            if id(group) in self.infos:
+                continue
+            if not expanded:
+                # a group that contains itself can't be sized
+                if id(group) in pending:
+                    raise ValueError("group %s contains itself" % group._id)
+                pending.add(id(group))
+                stack.append((group, True))
+                stack.extend((x.group, False) for x in group.subgroups
+                             if id(x.group) not in self.infos)
+                continue
+            self.infos[id(group)] = self._group_info(group)
+        return self.infos[id(top_group)]
+
+    def _group_info(self, group):
+        info = _GroupInfo(group)
+        estimate = self.estimate
+        for label, count, neuron in _neuron_groups(group):
+            neuron_type = neuron.neuron_type
+            info.neurons += count
+            _add(info.neuron_types, neuron_type, count)
+            estimate.neuron_bytes[neuron_type] = _state_bytes(neuron)
+        for subgroup in group.subgroups:
+            child = self.infos[id(subgroup.group)]
+            info.neurons += child.neurons
+            info.synapses += child.synapses
+            for key, value in child.neuron_types.items():
+                _add(info.neuron_types, key, value)
+            for key, value in child.synapse_types.items():
+                _add(info.synapse_types, key, value)
+        for pre, post, probability, synapse, recurrent, edges in \
+                _connections(group):
+            # explicit connectivity says exactly how many synapses there are
+            if edges is not None:
+                count = edges
+            else:
+                count = self.index.pairs(pre, post, group,
+                                         recurrent) * probability
+            synapse_type = synapse.synapse_type
+            info.synapses += count
+            _add(info.synapse_types, synapse_type, count)
+            estimate.synapse_bytes[synapse_type] = \
+                _state_bytes(synapse) + 2 * INDEX_BYTES
+        return info
+
+
+def _neuron_groups(group):
+    """ Yields (label, count, neuron) for every neuron group of a group """
+    for neuron_group in group.neuron_groups:
+        # column blocks carry their counts and neurons as arrays
+        if hasattr(neuron_group, 'counts'):
+            counts = [int(x) for x in neuron_group.counts]
+            neurons = neuron_group.neurons
+            index = neuron_group.neuron_index
+            rows = zip(neuron_group.labels, counts,
+                       [neurons[i] for i in index]
+                       if not isinstance(index, int)
+                       else [neurons[index]] * len(counts))
+        else:
+            rows = [(neuron_group.label, neuron_group.count,
+                     neuron_group.neuron)]
+        for row in rows:
+            yield row
+
+
+def _connections(group):
+    """ Yields (presynaptic, postsynaptic, probability, synapse, recurrent,
+    edges) for every connection of a group, edges being the number of
+    explicit edges or None """
+    for connection in group.connections:
+        if hasattr(connection, 'indptr'):
+            yield (connection.presynaptic, connection.postsynaptic, None,
+                   connection.synapse, None, connection.edges)
+            continue
+        if not hasattr(connection, 'probabilities'):
+            yield (connection.presynaptic, connection.postsynaptic,
+                   connection.probability, connection.synapse,
+                   connection.recurrent, None)
+            continue
+        # column blocks are read a column at a time
+        size = len(connection)
+        synapses = connection.synapses
+        index = connection.synapse_index
+        if isinstance(index, int):
+            index = [index] * size
+        recurrent = connection.recurrent
+        if isinstance(recurrent, bool):
+            recurrent = [recurrent] * size
+        for row in zip(connection.presynaptic, connection.postsynaptic,
+                       [float(x) for x in connection.probabilities],
+                       [synapses[i] for i in index], recurrent):
+            yield row + (None,)
+
+
+def estimate(simulation, dt=0.001):
+    """ Estimates the neurons, synapses, state memory and report output a
+    simulation will produce. dt is the daemon's time step in seconds.
+    Raises EntityError if a label doesn't resolve, the model can't be
+    sized without knowing what it refers to. """
+    return _Estimator(simulation, dt).run()
@@ -0,0 +1,127 @@
+""" Timing hooks for the phases of Simulator.run, authenticate and get_status.
+
+A hook is any callable registered with Simulator.add_hook. It's called with
+a Phase once each phase ends, whether it succeeded or not. With no hooks
+registered the Simulator skips the timing altogether.
+"""
+import time
+
+try:
+    import cProfile
+    import pstats
+except ImportError:
+    cProfile = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+class Phase(object):
+    """ One timed step of a Simulator call """
+
+    def __init__(self, hooks, operation, name, profile=False,
+                 trace_memory=False):
+        self.hooks = hooks
+        # the Simulator method, eg. 'run', and the step within it
+        self.operation = operation
+        self.name = name
+        self.seconds = None
+        # filled in by the phase where they apply
+        self.bytes = None
+        self.entities = None
+        # anything else a phase reports, eg. the daemon's response time
+        self.details = {}
+        # pstats.Stats and the peak bytes allocated, when captured
+        self.profile = None
+        self.memory_peak = None
+        self.error = None
+        self._profiler = None
+        self._trace_started = False
+        self._memory_base = None
+        if profile and cProfile is not None:
+            self._profiler = cProfile.Profile()
+        if trace_memory and tracemalloc is not None:
+            self._memory_base = 0
+
+    def __enter__(self):
+        if self._memory_base is not None:
+            # leave tracing as we found it if the caller runs it already
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._trace_started = True
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._memory_base = tracemalloc.get_traced_memory()[0]
+        if self._profiler is not None:
+            self._profiler.enable()
+        self._start = _timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = _timer() - self._start
+        if self._profiler is not None:
+            self._profiler.disable()
+            self.profile = pstats.Stats(self._profiler)
+            self._profiler = None
+        if self._memory_base is not None:
+            self.memory_peak = (tracemalloc.get_traced_memory()[1] -
+                                self._memory_base)
+            if self._trace_started:
+                tracemalloc.stop()
+        self.error = exc_value
+        for hook in self.hooks:
+            hook(self)
+
+    def as_dict(self):
+        d = {
+            'operation': self.operation,
+            'name': self.name,
+            'seconds': self.seconds,
+            'bytes': self.bytes,
+            'entities': self.entities,
+            'memory_peak': self.memory_peak,
+            'error': None if self.error is None else str(self.error)
+        }
+        d.update(self.details)
+        return d
+
+
+class _NullPhase(object):
+    """ Stands in for a Phase when nothing is listening """
+
+    def __init__(self):
+        self.details = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.details.clear()
+
+
+NULL_PHASE = _NullPhase()
+
+
+class Recorder(object):
+    """ Hook that keeps every phase it's given """
+
+    def __init__(self):
+        self.phases = []
+
+    def __call__(self, phase):
+        self.phases.append(phase)
+
+    def clear(self):
+        del self.phases[:]
+
+    def totals(self):
+        """ Returns 'operation.name' -> total seconds over every call """
+        totals = {}
+        for phase in self.phases:
+            key = phase.operation + '.' + phase.name
+            totals[key] = totals.get(key, 0.0) + phase.seconds
+        return totals
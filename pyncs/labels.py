@@ -0,0 +1,314 @@
+""" Client-side resolution of the labels entities refer to each other by.
+
+Connections name their neuron groups, stimuli their destinations and reports
+their targets by label path, eg. 'cortex:layer4:izh1': subgroup labels down
+from a group, ending in a neuron group label, a subgroup label (every neuron
+below it) or the name of one of the group's neuron aliases. A connection's
+labels are relative to its group, falling back to absolute paths from the
+top group, which may start with the top group's entity_name. Stimuli and
+reports use absolute paths.
+
+LabelIndex indexes every group once, after which a label resolves with one
+dict lookup per part, to the set of neuron groups it refers to. Each is
+given as the _id of a group and the path of labels down from it, so a group
+placed by several subgroups counts once per placement. Results are
+memoized per group and label, as are aliases, whose expansion fails on a
+cycle rather than looping, so checking a whole simulation costs time in
+proportion to the number of references. The local engine resolves the labels
+of a transfer format through it too, see LabelIndex.from_transfer_format.
+"""
+from .pyncs import EntityError
+
+
+class _Scope(object):
+    """ The labels defined by one group """
+
+    def __init__(self, group):
+        self.group = group
+        self.name = getattr(group, 'entity_name', None) or group._id
+        # neuron group label -> count
+        self.neuron_groups = {}
+        # subgroup label -> group
+        self.subgroups = {}
+        # alias name -> Alias
+        self.aliases = {}
+        self.synapse_aliases = {}
+        for neuron_group in group.neuron_groups:
+            # column blocks hold their labels and counts as columns
+            if hasattr(neuron_group, 'counts'):
+                self.neuron_groups.update(zip(
+                    neuron_group.labels,
+                    [int(x) for x in neuron_group.counts]))
+            else:
+                self.neuron_groups[neuron_group.label] = neuron_group.count
+        for subgroup in group.subgroups:
+            self.subgroups[subgroup.label] = subgroup.group
+        for alias in group.neuron_aliases:
+            self.aliases[alias.alias] = alias
+        for alias in group.synapse_aliases:
+            self.synapse_aliases[alias.alias] = alias
+
+
+class _Spec(object):
+    """ A dict of the transfer format, read through the attributes of the
+    entity it describes """
+
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+
+class LabelIndex(object):
+    """ Resolves labels to the neuron groups they refer to. groups, if
+    given, is every group reachable from top_group, eg. the groups of
+    _generate_entity_dicts. """
+
+    def __init__(self, top_group, groups=None):
+        self.top = top_group
+        if groups is None:
+            groups = _reachable(top_group)
+        self.scopes = {}
+        # id() of a NeuronGroup -> its key, for reports targeting one
+        self.objects = {}
+        for group in groups:
+            self.scopes[group._id] = _Scope(group)
+            for neuron_group in group.neuron_groups:
+                if not hasattr(neuron_group, 'counts'):
+                    self.objects[id(neuron_group)] = (
+                        group._id, (neuron_group.label,))
+        self._labels = {}
+        self._aliases = {}
+        # keys of the synapse aliases known to be valid
+        self._synapse_aliases = set()
+        self._below = {}
+
+    @classmethod
+    def from_transfer_format(cls, transfer_format):
+        """ Returns a LabelIndex of the groups of a transfer format, whose
+        results name groups by the _ids it gives them """
+        groups = {}
+        for group in transfer_format['groups']:
+            spec = group['specification']
+            groups[group['_id']] = _Spec({
+                '_id': group['_id'],
+                'entity_name': group.get('entity_name'),
+                'neuron_groups': [_Spec(x) for x in spec['neuron_groups']],
+                'neuron_aliases': [_Spec(x) for x in spec['neuron_aliases']],
+                'synapse_aliases': [_Spec(x)
+                                    for x in spec['synaptic_aliases']],
+                'connections': [_Spec(x) for x in spec['connections']]
+            })
+        for group in transfer_format['groups']:
+            groups[group['_id']].subgroups = [
+                _Spec({'label': x['label'], 'group': groups[x['group']]})
+                for x in group['specification']['subgroups']]
+        return cls(groups[transfer_format['top_group']],
+                   list(groups.values()))
+
+    def resolve(self, label, group=None):
+        """ Returns the neuron groups a label refers to, relative to group
+        or from the top group, as a frozenset of (group _id, label path)
+        pairs. Raises EntityError if it doesn't resolve. """
+        scope = self.scopes[(group or self.top)._id]
+        key = (scope.group._id, label)
+        try:
+            return self._labels[key]
+        except KeyError:
+            pass
+        result = self._resolve(scope, label, ())
+        self._labels[key] = result
+        return result
+
+    def count(self, label, group=None):
+        """ Returns the number of neurons a label refers to """
+        return self.total(self.resolve(label, group))
+
+    def total(self, found):
+        """ Returns the number of neurons in neuron groups given the way
+        resolve gives them """
+        total = 0
+        for group_id, path in found:
+            scope = self.scopes[group_id]
+            for part in path[:-1]:
+                scope = self.scopes[scope.subgroups[part]._id]
+            total += scope.neuron_groups[path[-1]]
+        return total
+
+    def pairs(self, presynaptic, postsynaptic, group=None, recurrent=False):
+        """ Returns the number of neuron pairs a connection of group between
+        two labels could join. Without recurrence a neuron group the labels
+        share doesn't connect its neurons to themselves. """
+        count = (self.count(presynaptic, group) *
+                 self.count(postsynaptic, group))
+        if not recurrent:
+            count -= self.total(self.resolve(presynaptic, group) &
+                                self.resolve(postsynaptic, group))
+        return count
+
+    def target(self, target):
+        """ Resolves a report target, a label or a NeuronGroup """
+        if id(target) in self.objects:
+            return frozenset([self.objects[id(target)]])
+        return self.resolve(getattr(target, 'label', target))
+
+    def check(self, stimuli=(), reports=()):
+        """ Resolves every label of every group, stimulus and report and
+        returns a description of each that fails """
+        problems = []
+
+        def attempt(resolve, *args):
+            try:
+                return resolve(*args)
+            except EntityError as e:
+                problems.append(e.value)
+        for scope in self.scopes.values():
+            group = scope.group
+            for connection in group.connections:
+                for labels in (connection.presynaptic,
+                               connection.postsynaptic):
+                    # column blocks hold a column of labels
+                    if not isinstance(labels, list):
+                        labels = [labels]
+                    for label in labels:
+                        # the common case, a label of the group itself, is
+                        # known to resolve without building the result
+                        if (label in scope.neuron_groups or
+                                label in scope.subgroups or
+                                label in scope.aliases):
+                            continue
+                        attempt(self.resolve, label, group)
+            for alias in group.neuron_aliases:
+                attempt(self._alias, scope, alias.alias, ())
+            for alias in group.synapse_aliases:
+                attempt(self._synapse_alias, scope, alias.alias, ())
+        for stimulus in stimuli:
+            for destination in stimulus.destinations:
+                attempt(self.resolve, destination)
+        for report in reports:
+            # synapses aren't labelled, only neuron targets can be checked
+            if report.report_type != 'synapse':
+                for target in report.report_target:
+                    attempt(self.target, target)
+        return problems
+
+    def _resolve(self, scope, label, seen):
+        parts = label.split(':')
+        result = self._path(scope, parts, seen)
+        top = self.scopes[self.top._id]
+        if result is None and scope is not top:
+            result = self._path(top, parts, seen)
+        if result is None and parts[0] == top.name:
+            if len(parts) > 1:
+                result = self._path(top, parts[1:], seen)
+            else:
+                result = self._everything(top)
+        if result is None:
+            raise EntityError("could not resolve label %s in group %s" %
+                              (label, scope.name))
+        return result
+
+    def _path(self, scope, parts, seen):
+        start = scope.group._id
+        for part in parts[:-1]:
+            if part not in scope.subgroups:
+                return None
+            scope = self.scopes[scope.subgroups[part]._id]
+        walked = tuple(parts[:-1])
+        last = parts[-1]
+        if last in scope.neuron_groups:
+            return frozenset([(start, walked + (last,))])
+        if last in scope.aliases:
+            found = self._alias(scope, last, seen)
+        elif last in scope.subgroups:
+            scope = self.scopes[scope.subgroups[last]._id]
+            found = self._everything(scope)
+            walked += (last,)
+        else:
+            return None
+        if not walked:
+            return found
+        # paths found below are made relative to where this one started,
+        # an alias may also have fallen back to absolute ones
+        here = scope.group._id
+        return frozenset((start, walked + path) if root == here
+                         else (root, path) for root, path in found)
+
+    def _alias(self, scope, name, seen):
+        key = (scope.group._id, name)
+        if key in self._aliases:
+            return self._aliases[key]
+        if key in seen:
+            raise EntityError("alias %s of group %s refers to itself" %
+                              (name, scope.name))
+        seen = seen + (key,)
+        alias = scope.aliases[name]
+        result = set()
+        for label in alias.labels:
+            memo = self._labels.get((scope.group._id, label))
+            if memo is None:
+                memo = self._resolve(scope, label, seen)
+            result.update(memo)
+        for other in alias.aliases:
+            if other not in scope.aliases:
+                raise EntityError("alias %s of group %s refers to unknown "
+                                  "alias %s" % (name, scope.name, other))
+            result.update(self._alias(scope, other, seen))
+        result = self._aliases[key] = frozenset(result)
+        return result
+
+    def _synapse_alias(self, scope, name, seen):
+        # their labels name synapses the client knows nothing about, but
+        # the aliases they include have to exist and not form a cycle
+        key = (scope.group._id, name)
+        if key in self._synapse_aliases:
+            return
+        if key in seen:
+            raise EntityError("synapse alias %s of group %s refers to "
+                              "itself" % (name, scope.name))
+        for other in scope.synapse_aliases[name].aliases:
+            if other not in scope.synapse_aliases:
+                raise EntityError("synapse alias %s of group %s refers to "
+                                  "unknown alias %s" %
+                                  (name, scope.name, other))
+            self._synapse_alias(scope, other, seen + (key,))
+        self._synapse_aliases.add(key)
+
+    def _everything(self, scope):
+        """ Returns every neuron group at or below a group """
+        if scope.group._id in self._below:
+            return self._below[scope.group._id]
+        # post-order with a stack, so deep hierarchies don't recurse
+        stack = [(scope, False)]
+        pending = set()
+        while stack:
+            current, expanded = stack.pop()
+            group_id = current.group._id
+            if group_id in self._below:
+                continue
+            children = [(label, self.scopes[x._id]) for label, x in
+                        current.subgroups.items()]
+            if not expanded:
+                if group_id in pending:
+                    raise EntityError("group %s contains itself" %
+                                      current.name)
+                pending.add(group_id)
+                stack.append((current, True))
+                stack.extend((x, False) for label, x in children
+                             if x.group._id not in self._below)
+                continue
+            result = set((group_id, (x,)) for x in current.neuron_groups)
+            for label, child in children:
+                result.update((group_id, (label,) + path) for root, path
+                              in self._below[child.group._id])
+            self._below[group_id] = frozenset(result)
+        return self._below[scope.group._id]
+
+
+def _reachable(top_group):
+    groups = {}
+    stack = [top_group]
+    while stack:
+        group = stack.pop()
+        if group._id not in groups:
+            groups[group._id] = group
+            stack.extend(x.group for x in group.subgroups)
+    return list(groups.values())
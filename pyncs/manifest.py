@@ -0,0 +1,51 @@
+import os
+
+# os.rename refuses to overwrite an existing file on Windows, os.replace
+# doesn't but is only there from python 3.3
+_replace = getattr(os, 'replace', os.rename)
+
+
+class Manifest(object):
+    """ Client side record of the content addressed entity ids a daemon has
+    already received, so unchanged entities can be left out of uploads """
+
+    def __init__(self, path=None):
+        # optional file the manifest is persisted to, one id per line
+        self.path = path
+        self._seen = set()
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __contains__(self, entity_id):
+        return entity_id in self._seen
+
+    def __len__(self):
+        return len(self._seen)
+
+    def __iter__(self):
+        return iter(self._seen)
+
+    def add(self, entity_id):
+        self._seen.add(entity_id)
+
+    def update(self, entity_ids):
+        self._seen.update(entity_ids)
+
+    def clear(self):
+        # call this when the daemon is known to have dropped its cache
+        self._seen.clear()
+
+    def load(self):
+        with open(self.path) as f:
+            self._seen.update(line.strip() for line in f if line.strip())
+
+    def save(self):
+        if self.path is None:
+            return
+        # write to a temporary file first so a crash never truncates the
+        # manifest we already had
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for entity_id in sorted(self._seen):
+                f.write(entity_id + '\n')
+        _replace(tmp_path, self.path)
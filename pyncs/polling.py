@@ -0,0 +1,103 @@
+""" Waiting for runs to finish without hammering the daemon.
+
+Polls start quick and back off exponentially with jitter, so short runs are
+noticed within tens of milliseconds while long runs settle at one request
+every few seconds. Every status request asks the daemon to hold it for as
+long as the client would otherwise sleep (the 'wait' query parameter); a
+daemon that supports long polling answers as soon as the run finishes and
+one that doesn't answers at once, in which case the client sleeps instead.
+"""
+import heapq
+import random
+import time
+
+from .pyncs import Simulator, SimulationError
+
+
+class Backoff(object):
+    """ Exponentially growing poll intervals with jitter """
+
+    def __init__(self, initial=0.05, maximum=5.0, factor=2.0, jitter=0.5,
+                 rng=None):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        # fraction of each interval that's randomized, spreads out clients
+        # that started together so they don't poll in lockstep
+        self.jitter = jitter
+        self.random = rng if rng is not None else random.Random()
+        self.delay = initial
+
+    def reset(self):
+        self.delay = self.initial
+
+    def next(self):
+        """ Returns the next interval to sleep and grows the one after it """
+        delay = self.delay
+        self.delay = min(delay * self.factor, self.maximum)
+        return delay * (1 - self.jitter * self.random.random())
+
+
+def wait_for_completion(simulator, timeout=None, backoff=None):
+    """ Blocks until the simulator reports it's idle, or raises
+    SimulationError once timeout seconds have passed """
+    backoff = backoff if backoff is not None else Backoff()
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        # long poll for as long as we'd sleep anyway
+        wait = backoff.delay
+        if deadline is not None:
+            wait = max(min(wait, deadline - time.time()), 0)
+        start = time.time()
+        status = simulator.get_status(wait=wait)
+        if status == Simulator.STATUS_IDLE:
+            return status
+        now = time.time()
+        if deadline is not None and now >= deadline:
+            raise SimulationError("simulation still %s after %ss" %
+                                  (status, timeout))
+        # a long poll has already spent part of the interval
+        delay = backoff.next() - (now - start)
+        if deadline is not None:
+            delay = min(delay, deadline - now)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def wait_for_all(simulators, timeout=None, backoff=Backoff, callback=None):
+    """ Waits for every simulator to become idle from a single loop.
+
+    Each simulator keeps its own backoff and the loop only polls the ones
+    that are due, so many daemons cost one thread and a request per daemon
+    every few seconds. backoff is called once per simulator to make its
+    Backoff and callback(simulator) is called as each one finishes.
+    Raises SimulationError naming the daemons still running at the
+    deadline. """
+    deadline = None if timeout is None else time.time() + timeout
+    # (time the next poll is due, position, backoff)
+    due = [(0, idx, backoff()) for idx in range(len(simulators))]
+    heapq.heapify(due)
+    while due:
+        when, idx, poll_backoff = heapq.heappop(due)
+        now = time.time()
+        if when > now:
+            time.sleep(when - now)
+        simulator = simulators[idx]
+        # no long polling here, one slow daemon must not hold up the rest
+        if simulator.get_status() == Simulator.STATUS_IDLE:
+            if callback is not None:
+                callback(simulator)
+            continue
+        now = time.time()
+        if deadline is not None and now >= deadline:
+            running = [simulator] + [simulators[x[1]] for x in due]
+            # several daemons can share a host, name each by its port too
+            raise SimulationError("simulations still running on %s after "
+                                  "%ss" % (", ".join(sorted(set(
+                                      '%s:%s' % (x.host, x.port)
+                                      for x in running))), timeout))
+        next_poll = now + poll_backoff.next()
+        if deadline is not None:
+            # always get one last look in at the deadline
+            next_poll = min(next_poll, deadline)
+        heapq.heappush(due, (next_poll, idx, poll_backoff))
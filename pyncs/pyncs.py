@@ -1,7 +1,25 @@
 import requests
+import binascii
+import hashlib
 import os
+import re
 import json
 import textwrap
+import weakref
+from collections import OrderedDict
+from json.encoder import encode_basestring_ascii
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import attachments
+from . import estimate
+from . import instrument
+from . import streaming
+from . import wire
+from .transport import Transport
 
 
 class AuthenticationError(Exception):
@@ -15,8 +33,10 @@ class AuthenticationError(Exception):
 
 class SimulationError(Exception):
 
-    def __init__(self, value):
+    def __init__(self, value, status=None):
         self.value = value
+        # HTTP status of the daemon response it came from, if any
+        self.status = status
 
     def __str__(self):
         return (self.value)
@@ -36,16 +56,75 @@ class Simulator(object):
     STATUS_RUNNING = 'running'
     STATUS_IDLE = 'idle'
 
-    def __init__(self, host, port, username, password):
+    # categories of entities sent to the daemon, ordered so that every
+    # category comes after the ones its entities refer to
+    ENTITY_TYPES = [
+        'channels',
+        'neurons',
+        'synapses',
+        'stimuli',
+        'reports',
+        'neuron_aliases',
+        'synapse_aliases',
+        'groups'
+    ]
+
+    # payload encodings run() can use, 'auto' offers the binary one and
+    # falls back to JSON for daemons that answer 415
+    WIRE_FORMATS = ('json', 'binary', 'auto')
+
+    def __init__(self, host, port, username, password, transport=None,
+                 manifest=None, limits=None, token_cache=None,
+                 wire_format='json', chunked_upload=None,
+                 content_addressed=()):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.is_authenticated = False
+        # every request goes through one pooled, keep-alive transport
+        self.transport = transport if transport is not None else Transport()
+        # what the daemon already holds, enables delta uploads of content
+        # addressed entities
+        self.manifest = manifest
+        # entity classes whose ids this simulator derives from their content
+        # when it sends them, eg. (IzhNeuron, FlatSynapse), so identical
+        # entities share an id and the manifest can leave them out
+        self.content_addressed = tuple(content_addressed)
+        # largest acceptable estimate.Estimate values, checked before a run
+        # is submitted, eg. {'synapses': 1e9, 'report_bytes': 2 ** 30}
+        self.limits = limits
+        # optional tokens.TokenCache so new processes can reuse a login
+        self.token_cache = token_cache
+        if wire_format not in Simulator.WIRE_FORMATS:
+            raise ValueError("unsupported wire format %s, acceptable formats "
+                             "include %s" % (wire_format,
+                                             list(Simulator.WIRE_FORMATS)))
+        self.wire_format = wire_format
+        # set once the daemon has turned the binary format down
+        self.binary_rejected = False
+        # optional upload.ChunkedUpload, sends large specs in resumable
+        # chunks rather than in one request
+        self.chunked_upload = chunked_upload
         self.url = 'http://' + self.host + ':' + str(port) + '/ncs/api'
-        self.authenticate()
-
-    def authenticate(self):
+        # callables given an instrument.Phase as each phase of a call ends
+        self.hooks = []
+        # capture cProfile stats and/or tracemalloc peaks while serializing,
+        # only while hooks are registered
+        self.profile = False
+        self.trace_memory = False
+        # logging in waits for the first request that needs it
+
+    def authenticate(self, refresh=False):
+        """ Logs in, reusing a cached token unless refresh is set """
+        key = None
+        if self.token_cache is not None:
+            key = self.token_cache.key(self.host, self.port, self.username)
+            token = None if refresh else self.token_cache.get(key)
+            if token is not None:
+                self.token = token
+                self.is_authenticated = True
+                return
         url = self.url + '/login'
         auth_payload = {
             'username': self.username,
@@ -53,7 +132,11 @@ class Simulator(object):
         }
         # attempt to connect to server
         try:
-            r = requests.post(url, data=json.dumps(auth_payload))
+            with self._phase('authenticate', 'login') as phase:
+                # logging in again is harmless, so allow it to be retried
+                r = self.transport.post(url, data=json.dumps(auth_payload),
+                                        idempotent=True)
+                phase.details['response_seconds'] = _elapsed(r)
         # if it doesn't work, alert the user
         except requests.exceptions.ConnectionError:
             raise AuthenticationError("Could not connect to authenticate")
@@ -64,123 +147,395 @@ class Simulator(object):
         else:
             self.token = res['token']
             self.is_authenticated = True
+            if key is not None:
+                self.token_cache.put(key, self.token, res.get('expires_in'))
 
-    def get_status(self):
-        if not self.is_authenticated:
-            return SimulationError("Not authenticated, authenticate by "
-                                   "calling the authenticate() function on "
-                                   "this object before attempting to run a "
-                                   "simulation")
+    def get_status(self, wait=None):
+        """ Returns STATUS_IDLE or STATUS_RUNNING. With wait, a daemon that
+        supports long polling holds the request for up to wait seconds until
+        the run finishes. """
         url = self.url + "/sim"
-        # add the auth token to the request headers
-        headers = {'token': self.token}
-        r = requests.get(url, headers=headers)
+        params = {'wait': wait} if wait else None
+        with self._phase('get_status', 'request') as phase:
+            r = self._request('GET', url, params=params)
+            phase.bytes = len(r.content)
+            phase.details['response_seconds'] = _elapsed(r)
         res = json.loads(r.text)
         if res['status'] == 'idle':
             return Simulator.STATUS_IDLE
         if res['status'] == 'running':
             return Simulator.STATUS_RUNNING
 
-    def run(self, simulation):
-        # if they haven't authenticated throw an error
-        if not self.is_authenticated:
-            return SimulationError("Not authenticated, authenticate by "
-                                   "calling the authenticate() function on "
-                                   "this object before attempting to run a "
-                                   "simulation")
+    def run(self, simulation, stream=False, content_encoding=None):
+        """ Submits a simulation, optionally streaming the JSON payload in
+        chunks and compressing it with 'gzip' or 'deflate'. The payload is
+        JSON or, depending on wire_format, the wire module's binary format,
+        which is always sent whole. """
+        # refuse anything that would swamp the daemon before building it
+        if self.limits:
+            with self._phase('run', 'estimate'):
+                exceeded = estimate.estimate(simulation).check(self.limits)
+            if exceeded:
+                raise SimulationError("simulation exceeds limits: %s" %
+                                      ", ".join(exceeded))
         # recurse through the top group and build the simulation json object
-        entity_dicts = self._generate_entity_dicts(simulation.top_group,
-                                                   simulation.stimuli,
-                                                   simulation.reports)
-        # generate the proper transfer format
-        transfer_format = self._process_entity_dicts(simulation.top_group,
-                                                     entity_dicts)
-        # dump the dictionary to a json string
-        sim_string = json.dumps(transfer_format)
+        with self._phase('run', 'generate_entity_dicts') as phase:
+            entity_dicts = self._generate_entity_dicts(simulation.top_group,
+                                                       simulation.stimuli,
+                                                       simulation.reports)
+            phase.entities = sum(len(x) for x in entity_dicts.values())
+        # content addressed ids have to reflect any edits made since the
+        # entities were created
+        with self._phase('run', 'refresh_content_ids'):
+            entity_dicts = self._refresh_content_ids(entity_dicts,
+                                                     self.content_addressed)
+        # leave out whatever the daemon already has
+        with self._phase('run', 'split_cached') as phase:
+            cached = self._split_cached(entity_dicts)
+            phase.entities = len(cached or ())
+        # explicit connectivity of the groups that are sent
+        attached = self._collect_attachments(entity_dicts)
+
+        def transfer_format():
+            return self._process_entity_dicts(simulation.top_group,
+                                              entity_dicts, cached=cached)
+
+        def iterencode():
+            # encode entity by entity so the payload is never held in memory
+            # as a whole, requests sends a generator body chunked
+            return streaming.iterencode(simulation.top_group, entity_dicts,
+                                        cached=cached)
+        r = self._submit('run', transfer_format,
+                         iterencode if stream else None, stream, attached,
+                         content_encoding,
+                         sum(len(x) for x in entity_dicts.values()))
+        if r is None:
+            return self.run(simulation, stream, content_encoding)
+        self._record_uploaded(entity_dicts)
+        # otherwise return info about the simulation from ncsdaemon
+        return r.json()
+
+    def run_transfer_format(self, transfer_format, content_encoding=None,
+                            attachments=None, iterencode=None):
+        """ Submits a simulation that's already in the transfer format, eg.
+        a variant built by the sweep module. attachments are the
+        attachments.Attachment its explicit connections refer to.
+        iterencode, if given, is a callable yielding the document's JSON in
+        byte chunks, sent instead of encoding the document again. """
+        r = self._submit('run_transfer_format', lambda: transfer_format,
+                         iterencode, False, attachments or [],
+                         content_encoding, None)
+        if r is None:
+            return self.run_transfer_format(transfer_format, content_encoding,
+                                            attachments, iterencode)
+        return r.json()
+
+    def wait_for_completion(self, timeout=None, backoff=None):
+        """ Blocks until the daemon is idle, polling with a growing, jittered
+        interval. Raises SimulationError after timeout seconds. """
+        from .polling import wait_for_completion
+        return wait_for_completion(self, timeout, backoff)
+
+    def open_reports(self, response, **kwargs):
+        """ Connects to the socket reports of a run, given the response
+        returned by run(). Keyword arguments are passed to each
+        reports.ReportReceiver. """
+        # numpy is only needed by clients that read socket reports
+        from .reports import open_reports
+        return open_reports(response, self.host, **kwargs)
+
+    def close(self):
+        # drop any pooled connections held open to the daemon
+        self.transport.close()
+
+    def add_hook(self, hook):
+        """ Registers a callable to be given an instrument.Phase at the end
+        of every phase of run, authenticate and get_status """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def _phase(self, operation, name, profiled=False):
+        # without hooks there's nobody to report to, skip the timing
+        if not self.hooks:
+            return instrument.NULL_PHASE
+        return instrument.Phase(self.hooks, operation, name,
+                                profiled and self.profile,
+                                profiled and self.trace_memory)
+
+    def _submit(self, operation, transfer_format, iterencode, stream,
+                attached, content_encoding, entities):
+        """ Encodes and uploads a simulation and returns the daemon's
+        response, or None if the daemon turned the binary format down and
+        the simulation should be sent again. transfer_format is a callable
+        returning the document, iterencode None or one yielding it as JSON
+        chunks, which are sent as they come when streaming. """
         # set the correct url path
         url = self.url + '/sim'
-        # add the auth token to the request headers
-        headers = {'token': self.token}
+        binary = (self.wire_format == 'binary' or
+                  (self.wire_format == 'auto' and not self.binary_rejected))
+        payload_type = wire.CONTENT_TYPE if binary else 'application/json'
+        headers = {'Content-Type': payload_type}
+        if content_encoding is not None:
+            headers['Content-Encoding'] = content_encoding
+        chunked = self.chunked_upload
+        # a chunked upload reads the payload twice, so it isn't streamed
+        streamed = stream and not binary and chunked is None
+        # the arrays follow the payload in parts of their own
+        boundary = None
+        if attached and chunked is None:
+            boundary = attachments.new_boundary()
+            headers['Content-Type'] = attachments.content_type(payload_type,
+                                                               boundary)
+
+        def build():
+            # the document, unless iterencode encodes without one
+            if binary or iterencode is None:
+                return transfer_format()
+            return None
+
+        def encode(document):
+            if binary:
+                # keys interned, floats and ids packed, see the wire module
+                sim_data = [wire.dumps(document)]
+            elif iterencode is not None:
+                sim_data = iterencode()
+            else:
+                # dump the dictionary to a json string
+                sim_data = [json.dumps(document).encode('utf-8')]
+            if attached:
+                part_boundary = boundary
+                if part_boundary is None:
+                    # a chunked upload is resumed by the hash of the body,
+                    # which has to come out the same for the same spec
+                    sim_data = list(sim_data)
+                    part_boundary = attachments.derived_boundary(sim_data,
+                                                                 attached)
+                    headers['Content-Type'] = attachments.content_type(
+                        payload_type, part_boundary)
+                sim_data = attachments.encode(sim_data, payload_type,
+                                              attached, part_boundary)
+            if content_encoding is not None:
+                sim_data = streaming.compress(sim_data, content_encoding)
+            if not streamed:
+                if attached and content_encoding is None:
+                    # the array buffers go to the socket as they are rather
+                    # than being copied into one string
+                    sim_data = attachments.Body(sim_data)
+                else:
+                    sim_data = b''.join(sim_data)
+            return sim_data
+        # a streamed payload is only encoded as it's sent, so its
+        # serialization is timed as part of the upload
+        sim_data = None
+        if not streamed:
+            # building the dicts and encoding them are timed apart, only
+            # the encoded payload has a size
+            with self._phase(operation, 'to_dict', profiled=True) as phase:
+                document = build()
+                phase.entities = entities
+            with self._phase(operation, 'encode', profiled=True) as phase:
+                sim_data = encode(document)
+                phase.entities = entities
+                phase.bytes = len(sim_data)
+            document = None
+
+        def body():
+            # called again if the upload has to be resent with a new token
+            return sim_data if sim_data is not None else encode(build())
         # send the sim request
-        r = requests.post(url, data=sim_string, headers=headers)
+        with self._phase(operation, 'upload', profiled=streamed) as phase:
+            if chunked is not None and len(sim_data) > chunked.min_size:
+                r = chunked.send(self, _pieces(sim_data), headers)
+            else:
+                r = self._request('POST', url, body=body, headers=headers)
+            phase.bytes = len(sim_data) if sim_data is not None else None
+            # time from sending the request to the daemon's response
+            # headers, roughly the daemon's share of the upload
+            phase.details['response_seconds'] = _elapsed(r)
+        if r.status_code == 415 and binary and self.wire_format == 'auto':
+            # the daemon only takes JSON, remember that
+            r.close()
+            self.binary_rejected = True
+            return None
         # if its not successful raise an exception
-        if r.status_code is not 200:
-            raise SimulationError(r.json()['message'])
-        # otherwise return info about the simulation from ncsdaemon
-        else:
-            return r.json()
-
-    # TODO Make this less complicated, CC is too high
-    def _generate_entity_dicts(self, model, stimuli, reports):
-        entity_dicts = {
-            'neurons': {},
-            'reports': {},
-            'stimuli': {},
-            'synapses': {},
-            'groups': {},
-            'neuron_aliases': {},
-            'synapse_aliases': {}
-        }
-        subgroup_result_list = []
-        # check the current
-        if model._id not in entity_dicts['groups']:
-            entity_dicts['groups'][model._id] = model
-        # check/add neuron types and channels
-        for neuron_group in model.neuron_groups:
-            # if the neuron isn't in the neuron list yet
-            if neuron_group.neuron._id not in entity_dicts['neurons']:
-                # add it to the list
-                entity_dicts['neurons'][neuron_group.neuron._id] = \
-                    neuron_group.neuron
-        # TODO Implement
-        for alias in model.neuron_aliases:
-            pass
-        # TODO Implement
-        for alias in model.synapse_aliases:
-            pass
+        if r.status_code != 200:
+            raise SimulationError(r.json()['message'], r.status_code)
+        return r
+
+    def _request(self, method, url, body=None, headers=None, **kwargs):
+        """ Sends a request with the auth token, logging in first if needed.
+        body is a callable returning the payload, so it can be produced again
+        if the daemon rejects the token and the request is resent. Raises
+        AuthenticationError if the daemon rejects a fresh token too. """
+        if not self.is_authenticated:
+            self.authenticate()
+        for attempt in range(2):
+            request_headers = dict(headers or {}, token=self.token)
+            data = body() if body is not None else None
+            r = self.transport.request(method, url, data=data,
+                                       headers=request_headers, **kwargs)
+            if r.status_code not in (401, 403):
+                return r
+            r.close()
+            if attempt:
+                raise AuthenticationError("the daemon rejected the token it "
+                                          "just gave out (%d)" %
+                                          r.status_code)
+            # the token expired or the daemon restarted, log in again
+            self.authenticate(refresh=True)
+
+    @staticmethod
+    def _generate_entity_dicts(model, stimuli, reports):
+        """ Collects every entity reachable from the model, keyed by _id """
+        entity_dicts = OrderedDict(
+            (entity_type, OrderedDict())
+            for entity_type in Simulator.ENTITY_TYPES
+        )
+        neurons = entity_dicts['neurons']
+        channels = entity_dicts['channels']
+        synapses = entity_dicts['synapses']
+        groups = entity_dicts['groups']
+        visited = set()
+        sparse = []
+        # walk the group hierarchy with an explicit stack so depth isn't
+        # limited by the recursion limit, a group is pushed a second time
+        # with expanded set so it is recorded after everything below it
+        stack = [(model, False)]
+        while stack:
+            group, expanded = stack.pop()
+            if expanded:
+                groups[group._id] = group
+                continue
+            # subgroups can be shared, only walk each group once
+            if group._id in visited:
+                continue
+            visited.add(group._id)
+            stack.append((group, True))
+            # check/add neuron types and their channels
+            for neuron_group in group.neuron_groups:
+                # column blocks list the distinct neurons they refer to
+                if isinstance(neuron_group, NeuronGroupColumns):
+                    group_neurons = neuron_group.neurons
+                else:
+                    group_neurons = [neuron_group.neuron]
+                for neuron in group_neurons:
+                    if neuron._id not in neurons:
+                        neurons[neuron._id] = neuron
+                        for channel in getattr(neuron, 'channels', []):
+                            channels[channel._id] = channel
+            # check/add synapse types
+            for connection in group.connections:
+                if isinstance(connection, ConnectionColumns):
+                    group_synapses = connection.synapses
+                else:
+                    if isinstance(connection, SparseConnection):
+                        sparse.append((group, connection))
+                    group_synapses = [connection.synapse]
+                for synapse in group_synapses:
+                    synapses[synapse._id] = synapse
+            for subgroup in group.subgroups:
+                if subgroup.group._id not in visited:
+                    stack.append((subgroup.group, False))
         # check/add stimulus types
         for stimulus in stimuli:
-            if stimulus._id not in entity_dicts['stimuli']:
-                entity_dicts['stimuli'][stimulus._id] = stimulus
+            entity_dicts['stimuli'][stimulus._id] = stimulus
         # add reports
         for report in reports:
-            if report._id not in entity_dicts['reports']:
-                entity_dicts['reports'][report._id] = report
-        # recursively traverse the subgroups of the model
-        for subgroup in model.subgroups:
-            # call this function on the current subgroup and get the dict back
-            res = subgroup_result_list.append(
-                self._generate_entity_dicts(subgroup)
-            )
-        # look at all the submodels resulting dictionaries
-        for res in subgroup_result_list:
-            # loop over the entity categories from the result (eg. neuron_dict)
-            for entity_category, entity_category_dict in res:
-                # loop over the entities created in that category
-                for entity_id, entity_value in entity_category_dict:
-                    # add the new entities to their corresponding dictionary
-                    entity_dicts[entity_category][entity_id] = entity_value
+            entity_dicts['reports'][report._id] = report
+        # every label and alias has to resolve before anything is sent
+        from .labels import LabelIndex
+        index = LabelIndex(model, groups.values())
+        problems = index.check(stimuli, reports)
+        if problems:
+            more = len(problems) - _MAX_PROBLEMS
+            raise EntityError("unresolved references: %s%s" % (
+                "; ".join(problems[:_MAX_PROBLEMS]),
+                " and %d more" % more if more > 0 else ""))
+        for group, connection in sparse:
+            _check_sparse(index, group, connection)
         # return the resulting entity dictionary
         return entity_dicts
 
-    def _process_entity_dicts(self, top_group, entity_dicts):
-        transfer_format = {
-            'top_group': top_group._id,
-            'neurons': [],
-            'reports': [],
-            'stimuli': [],
-            'synapses': [],
-            'groups': [],
-            'neuron_aliases': [],
-            'synapse_aliases': []
-        }
+    @staticmethod
+    def _refresh_content_ids(entity_dicts, addressed=()):
+        refreshed = OrderedDict(
+            (entity_type, OrderedDict()) for entity_type in entity_dicts
+        )
+        # entities embed the ids of what they refer to, so they have to be
+        # hashed after those, the entity dicts are already ordered that way
+        for entity_type, entities in entity_dicts.items():
+            for entity in entities.values():
+                if _addressed(entity, addressed):
+                    entity.refresh_id()
+                # identical entities collapse onto the same id here
+                refreshed[entity_type][entity._id] = entity
+        return refreshed
+
+    def _split_cached(self, entity_dicts):
+        if self.manifest is None:
+            return None
+        cached = []
+        for entities in entity_dicts.values():
+            for entity_id, entity in list(entities.items()):
+                # random ids say nothing about content, always send those
+                if (_addressed(entity, self.content_addressed) and
+                        entity_id in self.manifest):
+                    cached.append(entity_id)
+                    del entities[entity_id]
+        return cached
+
+    def _record_uploaded(self, entity_dicts):
+        if self.manifest is None:
+            return
+        for entities in entity_dicts.values():
+            self.manifest.update(entity_id for entity_id, entity
+                                 in entities.items()
+                                 if _addressed(entity,
+                                               self.content_addressed))
+        self.manifest.save()
+
+    @staticmethod
+    def _collect_attachments(entity_dicts):
+        """ Returns the attachments of the groups being sent """
+        collected = OrderedDict()
+        for group in entity_dicts['groups'].values():
+            for connection in group.connections:
+                if isinstance(connection, SparseConnection):
+                    collected[connection._id] = connection.attachment()
+        return list(collected.values())
+
+    @staticmethod
+    def _process_entity_dicts(top_group, entity_dicts, cached=None):
+        transfer_format = {'top_group': top_group._id}
         # add them to lists
-        for entity_type, entities in entity_dicts.iteritems():
-            for entity_id, entity in entities.iteritems():
-                transfer_format[entity_type].append(entity.to_dict())
+        for entity_type, entities in entity_dicts.items():
+            transfer_format[entity_type] = [entity.to_dict()
+                                            for entity in entities.values()]
+        # ids of entities left out because the daemon already holds them
+        if cached is not None:
+            transfer_format['cached'] = cached
         return transfer_format
 
 
+def _pieces(sim_data):
+    # the byte chunks of an encoded payload, bytes or an attachments.Body
+    return [sim_data] if isinstance(sim_data, bytes) else sim_data
+
+
+def _addressed(entity, classes):
+    # whether an entity's id is derived from its content, by its class or by
+    # the classes a simulator addresses
+    return entity.content_addressed or isinstance(entity, classes)
+
+
+def _elapsed(response):
+    # requests measures from sending the request to parsing the headers
+    elapsed = getattr(response, 'elapsed', None)
+    return None if elapsed is None else elapsed.total_seconds()
+
+
 class Simulation(object):
 
     def __init__(self, top_group, stimuli, reports):
@@ -188,9 +543,128 @@ class Simulation(object):
         self.stimuli = stimuli
         self.reports = reports
 
+    def save(self, path, compression='zlib'):
+        """ Saves the simulation as a snapshot, see the snapshot module """
+        from .snapshot import save
+        save(self, path, compression)
+
+    @staticmethod
+    def load(path):
+        """ Loads a Simulation or Group saved with save """
+        from .snapshot import load
+        return load(path)
+
+
+class _Schema(object):
+    """ Compiled description of the fields of an entity class, built once
+    per class and shared by all of its entities """
+
+    def __init__(self, cls):
+        parameters = []
+        seen = set()
+        # the most derived class declares its parameters first, followed by
+        # whatever its base classes add
+        for klass in cls.__mro__:
+            for field in klass.__dict__.get('PARAMETERS', ()):
+                if field[0] not in seen:
+                    seen.add(field[0])
+                    parameters.append(field)
+        metadata = _Entity.METADATA
+        self.metadata = tuple(x[0] for x in metadata)
+        self.parameters = tuple(x[0] for x in parameters)
+        # stable ordering of every field, metadata first
+        self.names = self.metadata + self.parameters
+        # name -> allowed types, metadata types aren't enforced
+        self.types = dict((x[0], None) for x in metadata)
+        self.types.update((x[0], frozenset(x[1])) for x in parameters)
+        # name -> extra value check, for the parameters that declare one
+        self.checks = dict((x[0], x[2]) for x in parameters if len(x) > 2)
+
+    def validate(self, key, value):
+        try:
+            types = self.types[key]
+        except KeyError:
+            # list acceptable parameters for this entity
+            raise TypeError(textwrap.dedent(
+                "cannot assign attribute %s, "
+                "acceptable attributes include %s" % (key, list(self.names)))
+            )
+        # if the specified type isn't allowed, throw an exception
+        if types is not None and type(value) not in types:
+            raise TypeError(textwrap.dedent(
+                "invalid type of attribute %s (%s), acceptable "
+                "types include %s" % (key, type(value), list(types)))
+            )
+        if key in self.checks:
+            self.checks[key](value)
+
+
+# compiled schemas, keyed by entity class
+_SCHEMAS = {}
+
+# stands in for parameters that haven't been set
+_MISSING = object()
+
+# explicit connectivity is only held as numpy arrays
+_ARRAY_TYPES = [numpy.ndarray] if numpy is not None else []
+
+# unresolved references listed in the error raised before a run
+_MAX_PROBLEMS = 10
+
+# ids that _CompactEntity can store as integers
+_HEX_ID = re.compile('[0-9a-f]{64}$')
+
+
+
+def _link(obj, name, dependent):
+    """ Records that the cached dict of dependent is built from obj, in the
+    attribute name of obj. A single dependent is held as it is, several in a
+    WeakSet so that obj doesn't keep them alive. """
+    current = getattr(obj, name, None)
+    if current is None or current is dependent:
+        _set(obj, name, dependent)
+    elif type(current) is weakref.WeakSet:
+        current.add(dependent)
+    else:
+        _set(obj, name, weakref.WeakSet([current, dependent]))
+
+
+def _linked(obj, name):
+    """ Returns the dependents _link recorded in the attribute name of obj """
+    current = getattr(obj, name, None)
+    if current is None:
+        return ()
+    if type(current) is weakref.WeakSet:
+        return list(current)
+    return (current,)
+
+
+def _changed(entity):
+    """ Drops the cached dict of an edited entity and those of the groups
+    holding it, only the entities above an edit are rebuilt """
+    _set(entity, '_cache', None)
+    for parent in _linked(entity, '_parents'):
+        _changed(parent)
+
+
+# attributes that tie entities and values to the dicts built from them,
+# they're never part of an entity's state
+_LINKS = frozenset(['_cache', '_parents', '_referrers', '__weakref__'])
+
 
 class _Entity(object):
 
+    # subclasses that don't declare __slots__ keep a per-instance __dict__
+    __slots__ = ()
+
+    # the groups whose dicts hold this entity's dict, and the groups whose
+    # dicts refer to this entity by _id, see _link
+    _parents = None
+    _referrers = None
+
+    # attributes holding entities the dict refers to by _id, at its top level
+    REFERENCES = ()
+
     STIMULUS = 'stimulus'
     GROUP = 'group'
     CHANNEL = 'channel'
@@ -198,165 +672,370 @@ class _Entity(object):
     SYNAPSE = 'synapse'
     NEURON = 'neuron'
 
+    METADATA = [
+        ('_id', [str]),
+        ('entity_type', [str]),
+        ('entity_name', [str]),
+        ('description', [str]),
+        ('author', [str]),
+        ('author_email', [str])
+    ]
+
+    # when set on a class, its entities derive _id from a hash of their
+    # parameters and metadata instead of using random bytes, in every
+    # process, Simulator(content_addressed=...) does it for one simulator
+    content_addressed = False
+
+    # entities keep the dict to_dict last built until they're edited, clear
+    # this on a class to trade re-serialization time for memory
+    cache_dicts = True
+
     def __init__(self, kwargs):
-        self.metadata = [
-            ('_id', [str]),
-            ('entity_type', [str]),
-            ('entity_name', [str]),
-            ('description', [str]),
-            ('author', [str]),
-            ('author_email', [str])
-        ]
-        for param, value in kwargs.iteritems():
-            setattr(self, param, kwargs[param])
-        if '_id' not in kwargs:
+        schema = _SCHEMAS.get(type(self)) or self.schema()
+        for param, value in kwargs.items():
+            # nothing holds a new entity, so there's no dict to drop yet
+            schema.validate(param, value)
+            self._store(param, value)
+        if self.content_addressed:
+            # identical entities end up with identical ids
+            self._id = self.content_id()
+        elif '_id' not in kwargs:
             # this should have significant enough entropy to not cause
             # collisions within the next 40 years or so
-            self._id = os.urandom(32).encode('hex')
-        # Lock the parameter and metadata lists from changing at runtime
-        self.locked = True
+            self._id = str(binascii.hexlify(os.urandom(32)).decode('ascii'))
+
+    @classmethod
+    def schema(cls):
+        """ Returns the schema shared by every entity of this class """
+        try:
+            return _SCHEMAS[cls]
+        except KeyError:
+            return _SCHEMAS.setdefault(cls, _Schema(cls))
 
     def __setattr__(self, key, value):
         """ This ensures that the correct parameters are being set on the
         entities to prevent bugs, etc. """
-        # if we're locking the entity, do it
-        if key is 'locked':
-            self.__dict__[key] = value
-            return
-        # if we're setting either of these lists, its okay if its not locked
-        if (key is 'parameter_list' or key is 'metadata'
-                and 'locked' not in self.__dict__):
-            # set the value
-            self.__dict__[key] = value
-            return
-        # strip the types out for name checking
-        params = map(lambda x: x[0], self.parameter_list)
-        meta = map(lambda x: x[0], self.metadata)
-        # if the key isn't in the parameter list/meta list, throw an error
-        if key not in params and key not in meta:
-            # Generate parameter list
-            l = params + meta
-            # list acceptable parameters for this entity
-            raise TypeError(textwrap.dedent(
-                "cannot assign attribute %s, "
-                "acceptable attributes include %s" % (key, l))
-            )
-        # TODO This is a dumb way of doing this, need to reconsider
-        # Check for type accuracy
-        for param in self.parameter_list:
-            # find the parameter in the list
-            if param[0] is key:
-                # if the specified type isn't allowed, throw an exception
-                if type(value) not in param[1]:
-                    raise TypeError(textwrap.dedent(
-                        "invalid type of attribute %s (%s), acceptable "
-                        "types include %s" % (key, type(value), param[1]))
-                    )
-                # otherwise we're done here
-                else:
-                    break
-        self.__dict__[key] = value
+        schema = _SCHEMAS.get(type(self)) or self.schema()
+        schema.validate(key, value)
+        if key == '_id' and getattr(self, '_id', value) != value:
+            # groups referring to this entity by id are out of date too
+            for referrer in _linked(self, '_referrers'):
+                _changed(referrer)
+        self._store(key, value)
+        object.__setattr__(self, '_cache', None)
+        if getattr(self, '_parents', None) is not None:
+            for parent in _linked(self, '_parents'):
+                _changed(parent)
+
+    def _store(self, key, value):
+        # sets a validated field, values nested in it rebuild this entity's
+        # dict when they're edited
+        object.__setattr__(self, key, value)
+        if isinstance(value, _Value):
+            _link(value, '_parents', self)
+
+    def __getstate__(self):
+        state = {}
+        for key, value in self.__dict__.items():
+            if key not in _LINKS:
+                state[key] = list(value) if type(value) is _Items else value
+        return state
+
+    def __setstate__(self, state):
+        # the values were validated when they were first set
+        for key, value in state.items():
+            self._store(key, value)
 
     def to_dict(self):
+        """ Returns the serialized form of the entity. The dict is cached and
+        shared between calls, so it mustn't be modified. An edit drops the
+        cached dicts of the edited entity and of the groups holding it, so
+        re-serializing a model only rebuilds what's above the edit. """
+        cache = getattr(self, '_cache', None)
+        if cache is not None and self._unchanged(cache):
+            return cache
+        dictionary = self._to_dict()
+        if self.cache_dicts:
+            object.__setattr__(self, '_cache', dictionary)
+        return dictionary
+
+    def _unchanged(self, dictionary):
+        # checks a cached dict against whatever can change without going
+        # through __setattr__, the ids of the entities it refers to
+        for attr in self.REFERENCES:
+            if dictionary[attr] != getattr(self, attr)._id:
+                return False
+        return True
+
+    def _to_dict(self):
+        schema = _SCHEMAS.get(type(self)) or self.schema()
         # create the dictionary object
         dictionary = {'specification': {}}
-        params = map(lambda x: x[0], self.parameter_list)
-        meta = map(lambda x: x[0], self.metadata)
+        spec = dictionary['specification']
         # create the metadata parameters
-        for param in meta:
-            try:
-                attr = getattr(self, param)
+        for param in schema.metadata:
+            attr = getattr(self, param, _MISSING)
+            if attr is not _MISSING:
                 dictionary[param] = attr
-            except AttributeError:
-                continue
         # add the entity-specific parameters to the parameters property
-        for param in params:
-            try:
-                attr = getattr(self, param)
-                # These types of attributes need special processing
-                if type(attr) in [Normal, Uniform, NeuronGroup, Alias,
-                                  Location, Geometry, Connection]:
-                    dictionary['specification'][param] = attr.to_dict()
-                else:
-                    dictionary['specification'][param] = attr
-            except AttributeError:
+        for param in schema.parameters:
+            attr = getattr(self, param, _MISSING)
+            if attr is _MISSING:
                 continue
+            # These types of attributes need special processing
+            if type(attr) in _NESTED_TYPES:
+                spec[param] = attr.to_dict()
+            else:
+                spec[param] = attr
         return dictionary
 
+    def content_id(self):
+        """ Returns a hash of the canonical serialized form of the entity,
+        which covers the ids of any entities it refers to """
+        dictionary = dict(self.to_dict())
+        dictionary.pop('_id', None)
+        canonical = json.dumps(dictionary, sort_keys=True,
+                               separators=(',', ':'),
+                               default=_canonical_default)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def refresh_id(self):
+        """ Re-derives the _id of a content addressed entity after edits """
+        self._id = self.content_id()
+
     def is_valid(self):
-        # iterate over the parameters
-        for param in self.parameter_list:
-            # if its not specified, we're invalid
-            if param not in self.__dict__:
+        # if any parameter isn't specified, we're invalid
+        for param in self.schema().parameters:
+            if not hasattr(self, param):
                 return False
         return True
 
 
-class Normal(object):
+class _CompactEntity(_Entity):
+    """ Base for high-cardinality entities, which keep their fields in
+    slots instead of a per-instance __dict__ and hold their _id as an integer
+    rather than a 64 character hex string """
+
+    __slots__ = ('_int_id', '_cache', '_parents', '__weakref__',
+                 'entity_type', 'entity_name', 'description', 'author',
+                 'author_email')
+
+    @property
+    def _id(self):
+        try:
+            return '%064x' % self._int_id
+        # ids that weren't hex to begin with are kept as they were given
+        except TypeError:
+            return self._int_id
+
+    @_id.setter
+    def _id(self, value):
+        if type(value) is str and _HEX_ID.match(value):
+            value = int(value, 16)
+        # _int_id is internal storage, not a field the schema knows about
+        object.__setattr__(self, '_int_id', value)
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for slot in cls.__dict__.get('__slots__', ()):
+                if slot not in _LINKS and hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+        return state
+
+
+def _canonical_default(obj):
+    # nested objects that json doesn't know about are hashed by their dicts
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError("%r is not serializable" % obj)
+
+
+def _check_indptr(value):
+    if value.ndim != 1 or not len(value) or value.dtype.kind not in 'iu':
+        raise EntityError("indptr must be a one dimensional array of ints "
+                          "with an entry per presynaptic neuron plus one")
+    if value[0] != 0 or (numpy.diff(value) < 0).any():
+        raise EntityError("indptr must start at 0 and never decrease")
+
+
+def _check_indices(value):
+    if value.ndim != 1 or (len(value) and value.dtype.kind not in 'iu'):
+        raise EntityError("indices must be a one dimensional array of ints")
+    if len(value) and value.min() < 0:
+        raise EntityError("indices must not be negative")
+
+
+def _check_edge_values(value):
+    if value is not None and (value.ndim != 1 or
+                              (len(value) and value.dtype.kind not in 'iuf')):
+        raise EntityError("weights and delays must be one dimensional "
+                          "arrays of numbers")
+
+
+class _Uncached(dict):
+    """ A dict to_dict mustn't hand out again """
+
+
+def _channels_unchanged(neuron, d):
+    # channels can be added to or removed from the list in place
+    channels = d['specification'].get('channels')
+    return (channels is None or
+            channels == [x._id for x in getattr(neuron, 'channels', ())])
+
+
+def _check_probability(value):
+    if value > 1 or not value > 0:
+        raise EntityError("probability must greater than 0 and less than "
+                          "or equal to one")
+
+
+def _check_channels(value):
+    for idx, channel in enumerate(value):
+        if not issubclass(type(channel), _Channel):
+            raise EntityError("Invalid channel at index %d" % idx)
+
+
+def _check_labels(value):
+    for idx, l in enumerate(value):
+        if type(l) is not str:
+            raise EntityError("invalid label at index %d" % idx)
+
+
+def _check_aliases(value):
+    for idx, a in enumerate(value):
+        if type(a) is not str:
+            raise EntityError("invalid alias at index %d" % idx)
+
+
+# sets a field without going through __setattr__
+_set = object.__setattr__
+
+
+class _Value(object):
+    """ Base for the plain values nested in entities. Editing one in place
+    drops the cached dicts of the entities holding it. Constructors set
+    their fields with _set, which doesn't count as an edit. """
+
+    # the entities holding the value, see _link
+    __slots__ = ('_parents',)
+
+    def __setattr__(self, key, value):
+        object.__setattr__(self, key, value)
+        for parent in _linked(self, '_parents'):
+            _changed(parent)
+
+    def __getstate__(self):
+        state = dict(getattr(self, '__dict__', ()))
+        for cls in type(self).__mro__:
+            for slot in cls.__dict__.get('__slots__', ()):
+                if slot not in _LINKS and hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+        return state
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            _set(self, key, value)
+
+
+class Normal(_Value):
     """ Class for a normal distribution of a parameter """
 
     def __init__(self, mean, stdev):
-        self.mean = mean
-        self.stdev = stdev
+        _set(self, 'mean', mean)
+        _set(self, 'stdev', stdev)
 
     def to_dict(self):
         return {'type': 'normal', 'mean': self.mean, 'stdev': self.stdev}
 
 
-class Uniform(object):
+class Uniform(_Value):
     """ Class for a uniform distribution of a parameter """
 
     def __init__(self, min, max):
-        self.min = min
-        self.max = max
+        _set(self, 'min', min)
+        _set(self, 'max', max)
 
     def to_dict(self):
         return {'type': 'uniform', 'min': self.min, 'max': self.max}
 
 
+class Geometry(_Value):
+
+    __slots__ = ('width', 'height', 'depth')
+
+    def __init__(self, width=0.0, height=0.0, depth=0.0):
+        _set(self, 'width', width)
+        _set(self, 'height', height)
+        _set(self, 'depth', depth)
+
+    def to_dict(self):
+        return {
+            'width': self.width,
+            'height': self.height,
+            'depth': self.depth
+        }
+
+
+class Location(_Value):
+
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        _set(self, 'x', x)
+        _set(self, 'y', y)
+        _set(self, 'z', z)
+
+    def to_dict(self):
+        return {'x': self.x, 'y': self.y, 'z': self.z}
+
+
 class _Channel(_Entity):
 
     LIF_VOLTAGE_GATED = 'lif_voltage_gated'
     LIF_CALCIUM_DEPENDENT = 'lif_calcium_dependent'
     HH_VOLTAGE_GATED = 'hh_voltage_gated'
 
+    PARAMETERS = [('channel_type', [str])]
+
     def __init__(self, kwargs):
-        self.parameter_list += [('channel_type', [str])]
         kwargs['entity_type'] = _Entity.CHANNEL
         _Entity.__init__(self, kwargs)
 
 
 class LIFVoltageGatedChannel(_Channel):
 
+    PARAMETERS = [
+        ('v_half', [int, float, Normal, Uniform]),
+        ('r', [int, float, Normal, Uniform]),
+        ('activation_slope', [int, float, Normal, Uniform]),
+        ('deactivation_slope', [int, float, Normal, Uniform]),
+        ('equilibrium_slope', [int, float, Normal, Uniform]),
+        ('conductance', [int, float, Normal, Uniform]),
+        ('reversal_potential', [int, float, Normal, Uniform]),
+        ('m_initial', [int, float, Normal, Uniform]),
+        ('m_power', [int, float, Normal, Uniform])
+    ]
+
     def __init__(self, **kwargs):
-        self.parameter_list = [
-            ('v_half', [int, float, Normal, Uniform]),
-            ('r', [int, float, Normal, Uniform]),
-            ('activation_slope', [int, float, Normal, Uniform]),
-            ('deactivation_slope', [int, float, Normal, Uniform]),
-            ('equilibrium_slope', [int, float, Normal, Uniform]),
-            ('conductance', [int, float, Normal, Uniform]),
-            ('reversal_potential', [int, float, Normal, Uniform]),
-            ('m_initial', [int, float, Normal, Uniform]),
-            ('m_power', [int, float, Normal, Uniform])
-        ]
         kwargs['channel_type'] = _Channel.LIF_VOLTAGE_GATED
         _Channel.__init__(self, kwargs)
 
 
 class LIFCalciumDependentChannel(_Channel):
 
+    PARAMETERS = [
+        ('m_initial', [int, float, Normal, Uniform]),
+        ('reversal_potential', [int, float, Normal, Uniform]),
+        ('conductance', [int, float, Normal, Uniform]),
+        ('backwards_rate', [int, float, Normal, Uniform]),
+        ('forward_scale', [int, float, Normal, Uniform]),
+        ('forward_exponent', [int, float, Normal, Uniform]),
+        ('backwards_rate', [int, float, Normal, Uniform]),
+        ('tau_scale', [int, float, Normal, Uniform])
+    ]
+
     def __init__(self, **kwargs):
-        self.parameter_list += [
-            ('m_initial', [int, float, Normal, Uniform]),
-            ('reversal_potential', [int, float, Normal, Uniform]),
-            ('conductance', [int, float, Normal, Uniform]),
-            ('backwards_rate', [int, float, Normal, Uniform]),
-            ('forward_scale', [int, float, Normal, Uniform]),
-            ('forward_exponent', [int, float, Normal, Uniform]),
-            ('backwards_rate', [int, float, Normal, Uniform]),
-            ('tau_scale', [int, float, Normal, Uniform])
-        ]
         kwargs['channel_type'] = _Channel.LIF_CALCIUM_DEPENDENT
         _Channel.__init__(self, kwargs)
 
@@ -373,43 +1052,46 @@ class _Synapse(_Entity):
     FLAT = 'flat'
     NCS = 'ncs'
 
+    PARAMETERS = [('synapse_type', [str])]
+
     def __init__(self, kwargs):
-        self.parameter_list += [('synapse_type', [str])]
         kwargs['entity_type'] = _Entity.SYNAPSE
         _Entity.__init__(self, kwargs)
 
 
 class FlatSynapse(_Synapse):
 
+    PARAMETERS = [
+        ('delay', [int, float, Normal, Uniform]),
+        ('current', [int, float, Normal, Uniform])
+    ]
+
     def __init__(self, **kwargs):
-        self.parameter_list = [
-            ('delay', [int, float, Normal, Uniform]),
-            ('current', [int, float, Normal, Uniform])
-        ]
         kwargs['synapse_type'] = _Synapse.FLAT
         _Synapse.__init__(self, kwargs)
 
 
 class NCSSynapse(_Synapse):
 
+    PARAMETERS = [
+        ('utilization', [int, float, Normal, Uniform]),
+        ('redistribution', [int, float, Normal, Uniform]),
+        ('last_prefire_time', [int, float, Normal, Uniform]),
+        ('last_postfire_time', [int, float, Normal, Uniform]),
+        ('tau_facilitation', [int, float, Normal, Uniform]),
+        ('tau_depression', [int, float, Normal, Uniform]),
+        ('tau_ltp', [int, float, Normal, Uniform]),
+        ('tau_ltd', [int, float, Normal, Uniform]),
+        ('a_ltp_minimum', [int, float, Normal, Uniform]),
+        ('a_ltd_minimum', [int, float, Normal, Uniform]),
+        ('max_conductance', [int, float, Normal, Uniform]),
+        ('reversal_potential', [int, float, Normal, Uniform]),
+        ('tau_postsynaptic_conductance', [int, float, Normal, Uniform]),
+        ('psg_waveform_duration', [int, float, Normal, Uniform]),
+        ('delay', [int, float, Normal, Uniform])
+    ]
+
     def __init__(self, **kwargs):
-        self.parameter_list = [
-            ('utilization', [int, float, Normal, Uniform]),
-            ('redistribution', [int, float, Normal, Uniform]),
-            ('last_prefire_time', [int, float, Normal, Uniform]),
-            ('last_postfire_time', [int, float, Normal, Uniform]),
-            ('tau_facilitation', [int, float, Normal, Uniform]),
-            ('tau_depression', [int, float, Normal, Uniform]),
-            ('tau_ltp', [int, float, Normal, Uniform]),
-            ('tau_ltd', [int, float, Normal, Uniform]),
-            ('a_ltp_minimum', [int, float, Normal, Uniform]),
-            ('a_ltd_minimum', [int, float, Normal, Uniform]),
-            ('max_conductance', [int, float, Normal, Uniform]),
-            ('reversal_potential', [int, float, Normal, Uniform]),
-            ('tau_postsynaptic_conductance', [int, float, Normal, Uniform]),
-            ('psg_waveform_duration', [int, float, Normal, Uniform]),
-            ('delay', [int, float, Normal, Uniform])
-        ]
         kwargs['synapse_type'] = _Synapse.NCS
         _Synapse.__init__(self, kwargs)
 
@@ -418,26 +1100,28 @@ class _Stimulus(_Entity):
 
     RECTANGULAR_CURRENT = 'rectangular_current'
 
+    PARAMETERS = [
+        ('stimulus_type', [str]),
+        ('time_start', [int, float, Normal, Uniform]),
+        ('time_end', [int, float, Normal, Uniform]),
+        ('probability', [int, float, Normal, Uniform]),
+        ('destinations', [list])
+    ]
+
     def __init__(self, kwargs):
-        self.parameter_list += [('stimulus_type', [str])]
-        self.parameter_list += [
-            ('time_start', [int, float, Normal, Uniform]),
-            ('time_end', [int, float, Normal, Uniform]),
-            ('probability', [int, float, Normal, Uniform]),
-            ('destinations', [list])
-        ]
         kwargs['entity_type'] = _Entity.STIMULUS
         _Entity.__init__(self, kwargs)
 
 
 class RectCurrentStimulus(_Stimulus):
 
+    PARAMETERS = [
+        ('amplitude', [int, float, Normal, Uniform]),
+        ('width', [int, float, Normal, Uniform]),
+        ('frequency', [int, float, Normal, Uniform])
+    ]
+
     def __init__(self, **kwargs):
-        self.parameter_list = [
-            ('amplitude', [int, float, Normal, Uniform]),
-            ('width', [int, float, Normal, Uniform]),
-            ('frequency', [int, float, Normal, Uniform]),
-        ]
         kwargs['stimulus_type'] = _Stimulus.RECTANGULAR_CURRENT
         _Stimulus.__init__(self, kwargs)
 
@@ -450,15 +1134,16 @@ class Report(_Entity):
     TYPE_NEURON = 'neuron'
     TYPE_SYNAPSE = 'synapse'
 
+    PARAMETERS = [
+        ('report_method', [str]),
+        ('report_type', [str]),
+        ('report_target', [list]),
+        ('probability', [float]),
+        ('time_start', [float]),
+        ('time_end', [float])
+    ]
+
     def __init__(self, **kwargs):
-        self.parameter_list = [
-            ('report_method', [str]),
-            ('report_type', [str]),
-            ('report_target', [list]),
-            ('probability', [float]),
-            ('time_start', [float]),
-            ('time_end', [float])
-        ]
         kwargs['entity_type'] = _Entity.REPORT
         _Entity.__init__(self, kwargs)
 
@@ -469,118 +1154,286 @@ class _Neuron(_Entity):
     NCS_NEURON = 'ncs_neuron'
     HH_NEURON = 'hh_neuron'
 
+    PARAMETERS = [('neuron_type', [str])]
+
     def __init__(self, kwargs):
-        self.parameter_list += [('neuron_type', [str])]
         kwargs['entity_type'] = _Entity.NEURON
         _Entity.__init__(self, kwargs)
 
 
 class IzhNeuron(_Neuron):
 
+    PARAMETERS = [
+        ('a', [int, float, Normal, Uniform]),
+        ('b', [int, float, Normal, Uniform]),
+        ('c', [int, float, Normal, Uniform]),
+        ('d', [int, float, Normal, Uniform]),
+        ('u', [int, float, Normal, Uniform]),
+        ('v', [int, float, Normal, Uniform]),
+        ('threshold', [int, float, Normal, Uniform])
+    ]
+
     def __init__(self, **kwargs):
-        self.parameter_list = [
-            ('a', [int, float, Normal, Uniform]),
-            ('b', [int, float, Normal, Uniform]),
-            ('c', [int, float, Normal, Uniform]),
-            ('d', [int, float, Normal, Uniform]),
-            ('u', [int, float, Normal, Uniform]),
-            ('v', [int, float, Normal, Uniform]),
-            ('threshold', [int, float, Normal, Uniform])
-        ]
         kwargs['neuron_type'] = _Neuron.IZH_NEURON
         _Neuron.__init__(self, kwargs)
 
 
 class NCSNeuron(_Neuron):
 
+    PARAMETERS = [
+        ('threshold', [int, float, Normal, Uniform]),
+        ('spikeshape', [int, float, Normal, Uniform]),
+        ('resting_potential', [int, float, Normal, Uniform]),
+        ('calcium', [int, float, Normal, Uniform]),
+        ('calcium_spike_increment', [int, float, Normal, Uniform]),
+        ('tau_calcium', [int, float, Normal, Uniform]),
+        ('leak_reversal_potential', [int, float, Normal, Uniform]),
+        ('leak_conductance', [int, float, Normal, Uniform]),
+        ('tau_membrane', [int, float, Normal, Uniform]),
+        ('r_membrane', [int, float, Normal, Uniform]),
+        ('channels', [list], _check_channels)
+    ]
+
     def __init__(self, **kwargs):
-        self.parameter_list += [
-            ('threshold', [int, float, Normal, Uniform]),
-            ('spikeshape', [int, float, Normal, Uniform]),
-            ('resting_potential', [int, float, Normal, Uniform]),
-            ('calcium', [int, float, Normal, Uniform]),
-            ('calcium_spike_increment', [int, float, Normal, Uniform]),
-            ('tau_calcium', [int, float, Normal, Uniform]),
-            ('leak_reversal_potential', [int, float, Normal, Uniform]),
-            ('leak_conductance', [int, float, Normal, Uniform]),
-            ('tau_membrane', [int, float, Normal, Uniform]),
-            ('r_membrane', [int, float, Normal, Uniform]),
-            ('channels', [list])
-        ]
         kwargs['neuron_type'] = _Neuron.NCS_NEURON
         _Neuron.__init__(self, kwargs)
 
-    def __setattr__(self, key, value):
-        _Entity.__setattr__(self, key, value)
-        if key is 'channels':
-            for idx, channel in enumerate(value):
-                if not issubclass(type(channel), _Channel):
-                    raise EntityError("Invalid channel at index %d" % idx)
+    def _to_dict(self):
+        d = _Entity._to_dict(self)
+        # channels are sent on their own and referenced by id
+        if 'channels' in d['specification']:
+            d['specification']['channels'] = [x._id for x in self.channels]
+        return d
+
+    def _unchanged(self, d):
+        return _channels_unchanged(self, d)
 
 
 class HHNeuron(_Neuron):
 
+    PARAMETERS = [
+        ('resting_potential', [int, float, Normal, Uniform]),
+        ('threshold', [int, float, Normal, Uniform]),
+        ('capacitance', [int, float, Normal, Uniform]),
+        ('channels', [list], _check_channels)
+    ]
+
     def __init__(self, **kwargs):
-        self.parameter_list += [
-            ('resting_potential', [int, float, Normal, Uniform]),
-            ('threshold', [int, float, Normal, Uniform]),
-            ('capacitance', [int, float, Normal, Uniform]),
-            ('channels', [list])
-        ]
         kwargs['neuron_type'] = _Neuron.HH_NEURON
         _Neuron.__init__(self, kwargs)
 
-    def __setattr__(self, key, value):
-        _Entity.__setattr__(self, key, value)
-        if key is 'channels':
-            for idx, channel in enumerate(value):
-                if not issubclass(type(channel), _Channel):
-                    raise EntityError("Invalid channel at index %d" % idx)
+    def _to_dict(self):
+        d = _Entity._to_dict(self)
+        # channels are sent on their own and referenced by id
+        if 'channels' in d['specification']:
+            d['specification']['channels'] = [x._id for x in self.channels]
+        return d
+
+    def _unchanged(self, d):
+        return _channels_unchanged(self, d)
+
+
+class _Items(list):
+    """ The list a group holds its subgroups, neuron groups etc. in. Edits
+    made to it in place drop the group's cached dict like setting an
+    attribute does. """
+
+    __slots__ = ('group',)
+
+    def __init__(self, group, items):
+        list.__init__(self, items)
+        _set(self, 'group', group)
+        self._added(self)
+
+    def _added(self, items):
+        for x in items:
+            if isinstance(x, _Entity):
+                _link(x, '_parents', self.group)
+        _changed(self.group)
+
+    def append(self, item):
+        list.append(self, item)
+        self._added((item,))
+
+    def extend(self, items):
+        items = list(items)
+        list.extend(self, items)
+        self._added(items)
+
+    def insert(self, index, item):
+        list.insert(self, index, item)
+        self._added((item,))
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = list(value)
+            list.__setitem__(self, index, value)
+            self._added(value)
+        else:
+            list.__setitem__(self, index, value)
+            self._added((value,))
+
+    def __setslice__(self, i, j, value):
+        # python 2 sets slices without going through __setitem__
+        self.__setitem__(slice(i, j), value)
+
+    def __delslice__(self, i, j):
+        self.__delitem__(slice(i, j))
+
+    def __reduce__(self):
+        # copies and pickles of the list alone don't belong to the group
+        return list, (list(self),)
+
+
+def _removing(name):
+    method = getattr(list, name)
+
+    def remove(self, *args):
+        result = method(self, *args)
+        _changed(self.group)
+        return result
+    remove.__name__ = name
+    return remove
+
+
+# edits that only take items out of the list or reorder it
+for _name in ('remove', 'pop', 'clear', 'sort', 'reverse', '__delitem__',
+              '__imul__'):
+    if hasattr(list, _name):
+        setattr(_Items, _name, _removing(_name))
+del _name
 
 
 class Group(_Entity):
 
+    # specification keys and the attributes holding their nested entities
+    SPECIFICATION_LISTS = [
+        ('subgroups', 'subgroups'),
+        ('neuron_groups', 'neuron_groups'),
+        ('neuron_aliases', 'neuron_aliases'),
+        ('synaptic_aliases', 'synapse_aliases'),
+        ('connections', 'connections')
+    ]
+
+    PARAMETERS = [
+        ('geometry', [Geometry]),
+        ('subgroups', [list]),
+        ('neuron_groups', [list]),
+        ('neuron_aliases', [list]),
+        ('synapse_aliases', [list]),
+        ('connections', [list])
+    ]
+
     def __init__(self, **kwargs):
-        self.parameter_list = [
-            ('geometry', [Geometry]),
-            ('subgroups', [list]),
-            ('neuron_groups', [list]),
-            ('neuron_aliases', [list]),
-            ('synapse_aliases', [list]),
-            ('connections', [list])
-        ]
         kwargs['entity_type'] = _Entity.GROUP
         if 'geometry' not in kwargs:
             kwargs['geometry'] = Geometry()
+        for key in _GROUP_LISTS:
+            if type(kwargs.get(key)) is _Items:
+                kwargs[key] = list(kwargs[key])
         _Entity.__init__(self, kwargs)
 
-    def to_dict(self):
-        d = _Entity.to_dict(self)
-        spec = {
-            'geometry': self.geometry.to_dict(),
-            'subgroups': [x.to_dict() for x in self.subgroups],
-            'neuron_groups': [x.to_dict() for x in self.neuron_groups],
-            'neuron_aliases': [x.to_dict() for x in self.neuron_aliases],
-            'synaptic_aliases': [x.to_dict() for x in self.synapse_aliases],
-            'connections': [x.to_dict() for x in self.connections]
-        }
+    def __getattr__(self, key):
+        # only called for missing attributes, which a group loaded from a
+        # snapshot has until its contents are decoded
+        if not self._load():
+            raise AttributeError(key)
+        return getattr(self, key)
+
+    def __setattr__(self, key, value):
+        self._load()
+        if type(value) is _Items:
+            # another group's list, this group gets a list of its own
+            value = list(value)
+        _Entity.__setattr__(self, key, value)
+
+    def _store(self, key, value):
+        if key in _GROUP_LISTS:
+            value = _Items(self, value)
+        _Entity._store(self, key, value)
+
+    def __getstate__(self):
+        self._load()
+        return _Entity.__getstate__(self)
+
+    def _load(self):
+        """ Decodes the contents of a group loaded from a snapshot, returns
+        whether there was anything left to decode """
+        pending = self.__dict__.pop('_pending', None)
+        if pending is None:
+            return False
+        reader, offset, size = pending
+        reader.load_group(self, offset, size)
+        return True
+
+    def save(self, path, compression='zlib'):
+        """ Saves the group as a snapshot, see the snapshot module """
+        from .snapshot import save
+        save(self, path, compression)
+
+    @staticmethod
+    def load(path):
+        """ Loads a Simulation or Group saved with save """
+        from .snapshot import load
+        return load(path)
+
+    def _to_dict(self):
+        d = _Entity._to_dict(self)
+        spec = {'geometry': self.geometry.to_dict()}
+        columns = False
+        # the entities the items refer to by id, this dict is rebuilt when
+        # one of them gets a new one
+        referred = {}
+        for key, attr in Group.SPECIFICATION_LISTS:
+            items = spec[key] = []
+            for x in getattr(self, attr):
+                # column blocks expand into one dict per row
+                if isinstance(x, _Columns):
+                    items.extend(x.iter_dicts())
+                    columns = True
+                else:
+                    items.append(x.to_dict())
+                    for name in x.REFERENCES:
+                        entity = getattr(x, name)
+                        referred[id(entity)] = entity
+        for entity in referred.values():
+            _link(entity, '_referrers', self)
         d['specification'] = spec
+        if columns:
+            # arrays can change under the block, never reuse its rows
+            d = _Uncached(d)
         return d
 
+    def _unchanged(self, d):
+        # edits to the items, their values and the lists holding them drop
+        # this dict, see _changed
+        return type(d) is not _Uncached
+
+
+# the lists of a group that hold its subgroups, neuron groups etc.
+_GROUP_LISTS = frozenset(attr for key, attr in Group.SPECIFICATION_LISTS)
+
 
 class SubGroup(_Entity):
 
+    REFERENCES = ('group',)
+
+    PARAMETERS = [
+        ('group', [Group]),
+        ('label', [str]),
+        ('location', [Location])
+    ]
+
     def __init__(self, **kwargs):
-        self.parameter_list = [
-            ('group', [Group]),
-            ('label', [str]),
-            ('location', [Location])
-        ]
         if 'location' not in kwargs:
             kwargs['location'] = Location()
         _Entity.__init__(self, kwargs)
 
-    def to_dict(self):
+    def _to_dict(self):
         d = {
             'group': self.group._id,
             'label': self.label,
@@ -589,49 +1442,28 @@ class SubGroup(_Entity):
         return d
 
 
-class Geometry(object):
-
-    def __init__(self, width=0.0, height=0.0, depth=0.0):
-        self.width = width
-        self.height = height
-        self.depth = depth
-
-    def to_dict(self):
-        return {
-            'width': self.width,
-            'height': self.height,
-            'depth': self.depth
-        }
-
-
-class Location(object):
-
-    def __init__(self, x=0.0, y=0.0, z=0.0):
-        self.x = x
-        self.y = y
-        self.z = z
+class NeuronGroup(_CompactEntity):
 
-    def to_dict(self):
-        return {'x': self.x, 'y': self.y, 'z': self.z}
+    REFERENCES = ('neuron',)
 
+    PARAMETERS = [
+        ('neuron', [IzhNeuron, NCSNeuron, HHNeuron]),
+        ('count', [int]),
+        ('label', [str]),
+        ('geometry', [Geometry]),
+        ('location', [Location])
+    ]
 
-class NeuronGroup(_Entity):
+    __slots__ = tuple(x[0] for x in PARAMETERS)
 
     def __init__(self, **kwargs):
-        self.parameter_list = [
-            ('neuron', [IzhNeuron, NCSNeuron, HHNeuron]),
-            ('count', [int]),
-            ('label', [str]),
-            ('geometry', [Geometry]),
-            ('location', [Location])
-        ]
         if 'geometry' not in kwargs:
             kwargs['geometry'] = Geometry()
         if 'location' not in kwargs:
             kwargs['location'] = Location()
         _Entity.__init__(self, kwargs)
 
-    def to_dict(self):
+    def _to_dict(self):
         return {
             'neuron': self.neuron._id,
             'count': self.count,
@@ -640,29 +1472,29 @@ class NeuronGroup(_Entity):
             'location': self.location.to_dict()
         }
 
+    @classmethod
+    def from_arrays(cls, neuron, counts, labels, geometries=None,
+                    locations=None):
+        """ Builds a column-wise block of neuron groups from sequences or
+        numpy arrays. neuron is a single neuron shared by every row or one
+        per row, geometries and locations are (n, 3) arrays. The block can be
+        placed in Group.neuron_groups like any other neuron group. """
+        return NeuronGroupColumns(neuron, counts, labels, geometries,
+                                  locations)
+
 
 class Alias(_Entity):
 
+    PARAMETERS = [
+        ('alias', [str]),
+        ('labels', [list], _check_labels),
+        ('aliases', [list], _check_aliases)
+    ]
+
     def __init__(self, **kwargs):
-        self.parameter_list = [
-            ('alias', [str]),
-            ('labels', [list]),
-            ('aliases', [list])
-        ]
         _Entity.__init__(self, kwargs)
 
-    def __setattr__(self, key, value):
-        _Entity.__setattr__(self, key, value)
-        if key is 'labels':
-            for idx, l in value:
-                if type(l) is not str:
-                    raise EntityError("invalid label at index %d" % idx)
-        if key is 'aliases':
-            for idx, a in value:
-                if type(a) is not str:
-                    raise EntityError("invalid alias at index %d" % idx)
-
-    def to_dict(self):
+    def _to_dict(self):
         d = {
             'alias': self.alias,
             'labels': self.labels,
@@ -671,27 +1503,26 @@ class Alias(_Entity):
         return d
 
 
-class Connection(_Entity):
+class Connection(_CompactEntity):
+
+    REFERENCES = ('synapse',)
+
+    PARAMETERS = [
+        ('presynaptic', [str]),
+        ('postsynaptic', [str]),
+        ('probability', [float], _check_probability),
+        ('synapse', [FlatSynapse, NCSSynapse]),
+        ('recurrent', [bool])
+    ]
+
+    __slots__ = tuple(x[0] for x in PARAMETERS)
 
     def __init__(self, **kwargs):
-        self.parameter_list = [
-            ('presynaptic', [str]),
-            ('postsynaptic', [str]),
-            ('probability', [float]),
-            ('synapse', [FlatSynapse, NCSSynapse]),
-            ('recurrent', [bool])
-        ]
         if 'recurrent' not in kwargs:
             kwargs['recurrent'] = False
         _Entity.__init__(self, kwargs)
 
-    def __setattr__(self, key, value):
-        _Entity.__setattr__(self, key, value)
-        if key is 'probability' and (value > 1 or not value > 0):
-            raise EntityError("probability must greater than 0 and less than "
-                              "or equal to one")
-
-    def to_dict(self):
+    def _to_dict(self):
         d = {
             'presynaptic': self.presynaptic,
             'postsynaptic': self.postsynaptic,
@@ -700,3 +1531,465 @@ class Connection(_Entity):
             'recurrent': self.recurrent
         }
         return d
+
+    @classmethod
+    def from_arrays(cls, presynaptic, postsynaptic, probabilities, synapse,
+                    recurrent=False):
+        """ Builds a column-wise block of connections from sequences or
+        numpy arrays. synapse and recurrent are either shared by every row or
+        given per row. The block can be placed in Group.connections like any
+        other connection. """
+        return ConnectionColumns(presynaptic, postsynaptic, probabilities,
+                                 synapse, recurrent)
+
+    @classmethod
+    def from_csr(cls, presynaptic, postsynaptic, synapse, indptr, indices,
+                 weights=None, delays=None):
+        """ Builds a connection with explicit edges in compressed sparse row
+        form, see SparseConnection """
+        return SparseConnection(presynaptic=presynaptic,
+                                postsynaptic=postsynaptic, synapse=synapse,
+                                indptr=indptr, indices=indices,
+                                weights=weights, delays=delays)
+
+    @classmethod
+    def from_edges(cls, presynaptic, postsynaptic, synapse, pre, post,
+                   weights=None, delays=None):
+        """ Builds a connection with explicit edges from parallel arrays of
+        presynaptic and postsynaptic neuron indices, in any order """
+        if numpy is None:
+            raise EntityError("explicit connectivity needs numpy")
+        pre = _edge_array('pre', pre, 'iu')
+        post = _edge_array('post', post, 'iu')
+        if len(pre) != len(post):
+            raise EntityError("pre has %d edges, post has %d" %
+                              (len(pre), len(post)))
+        if len(pre) and pre.min() < 0:
+            raise EntityError("pre must not be negative")
+        # sort the edges by presynaptic neuron, keeping their order otherwise
+        order = numpy.argsort(pre, kind='mergesort')
+        rows = int(pre.max()) + 1 if len(pre) else 0
+        indptr = numpy.zeros(rows + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(pre, minlength=rows), out=indptr[1:])
+        values = []
+        for name, value in (('weights', weights), ('delays', delays)):
+            if value is not None:
+                value = _edge_array(name, value, 'iuf')
+                _check_size(name, len(value), len(pre))
+                value = value[order]
+            values.append(value)
+        return SparseConnection(presynaptic=presynaptic,
+                                postsynaptic=postsynaptic, synapse=synapse,
+                                indptr=indptr, indices=post[order],
+                                weights=values[0], delays=values[1])
+
+
+class SparseConnection(_Entity):
+    """ Connection with explicit edges between two neuron groups, in
+    compressed sparse row form: presynaptic neuron i connects to the
+    postsynaptic neurons indices[indptr[i]:indptr[i + 1]], both numbered
+    within their neuron group. weights and delays, when given, replace the
+    synapse's strength and delay edge by edge. The arrays are uploaded as a
+    binary attachment rather than in the spec, see the attachments module.
+    Needs numpy. """
+
+    REFERENCES = ('synapse',)
+
+    PARAMETERS = [
+        ('presynaptic', [str]),
+        ('postsynaptic', [str]),
+        ('synapse', [FlatSynapse, NCSSynapse]),
+        ('indptr', _ARRAY_TYPES, _check_indptr),
+        ('indices', _ARRAY_TYPES, _check_indices),
+        ('weights', _ARRAY_TYPES + [type(None)], _check_edge_values),
+        ('delays', _ARRAY_TYPES + [type(None)], _check_edge_values)
+    ]
+
+    # arrays that may be left out, in the order they're attached
+    OPTIONAL_ARRAYS = ['weights', 'delays']
+
+    def __init__(self, **kwargs):
+        if numpy is None:
+            raise EntityError("explicit connectivity needs numpy")
+        for name, kinds in (('indptr', 'iu'), ('indices', 'iu'),
+                            ('weights', 'iuf'), ('delays', 'iuf')):
+            if kwargs.get(name) is not None:
+                kwargs[name] = _edge_array(name, kwargs[name], kinds)
+            elif name in SparseConnection.OPTIONAL_ARRAYS:
+                kwargs[name] = None
+        _Entity.__init__(self, kwargs)
+        self._check_sizes()
+
+    @property
+    def edges(self):
+        return len(self.indices)
+
+    def validate(self, presynaptic_count, postsynaptic_count):
+        """ Checks the edges against the counts of the neuron groups they
+        connect """
+        self._check_sizes()
+        if len(self.indptr) - 1 > presynaptic_count:
+            raise EntityError("indptr covers %d presynaptic neurons, %s has "
+                              "%d" % (len(self.indptr) - 1, self.presynaptic,
+                                      presynaptic_count))
+        if self.edges and self.indices.max() >= postsynaptic_count:
+            raise EntityError("indices refer to postsynaptic neuron %d, %s "
+                              "has %d" % (self.indices.max(),
+                                          self.postsynaptic,
+                                          postsynaptic_count))
+
+    def attachment(self):
+        """ Returns the attachment the arrays are uploaded in """
+        arrays = [('indptr', self.indptr), ('indices', self.indices)]
+        for name in SparseConnection.OPTIONAL_ARRAYS:
+            if getattr(self, name) is not None:
+                arrays.append((name, getattr(self, name)))
+        return attachments.Attachment(self._id, arrays)
+
+    def _check_sizes(self):
+        if self.indptr[-1] != self.edges:
+            raise EntityError("indptr ends at %d, indices has %d edges" %
+                              (self.indptr[-1], self.edges))
+        for name in SparseConnection.OPTIONAL_ARRAYS:
+            value = getattr(self, name)
+            if value is not None:
+                _check_size(name, len(value), self.edges)
+
+    def _to_dict(self):
+        edges = self.attachment().describe()
+        edges['format'] = 'csr'
+        edges['count'] = self.edges
+        return {
+            'presynaptic': self.presynaptic,
+            'postsynaptic': self.postsynaptic,
+            'synapse': self.synapse._id,
+            'edges': edges
+        }
+
+
+def _edge_array(name, values, kinds):
+    array = numpy.asarray(values)
+    # an empty list comes back as floats
+    if not array.size and 'f' not in kinds:
+        array = array.astype(numpy.int64)
+    if array.ndim != 1 or (array.size and array.dtype.kind not in kinds):
+        raise TypeError("%s must be a one dimensional array of %s" %
+                        (name, 'ints' if 'f' not in kinds else 'numbers'))
+    return array
+
+
+def _check_sparse(index, group, connection):
+    counts = []
+    for label in (connection.presynaptic, connection.postsynaptic):
+        if len(index.resolve(label, group)) != 1:
+            raise EntityError("explicit connections join two neuron groups, "
+                              "%s doesn't name one" % label)
+        counts.append(index.count(label, group))
+    connection.validate(*counts)
+
+
+class _Columns(object):
+    """ Base for column-wise blocks of high-cardinality entities, which are
+    validated a whole column at a time and serialized without building an
+    entity per row """
+
+    # rows converted to python values at once while serializing
+    BLOCK_SIZE = 4096
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for idx in range(self.size):
+            yield self.row(idx)
+
+    def to_dicts(self):
+        return list(self.iter_dicts())
+
+    def _blocks(self):
+        for start in range(0, self.size, self.BLOCK_SIZE):
+            yield start, min(start + self.BLOCK_SIZE, self.size)
+
+
+class NeuronGroupColumns(_Columns):
+    """ Column-wise block of neuron groups, see NeuronGroup.from_arrays """
+
+    def __init__(self, neuron, counts, labels, geometries=None,
+                 locations=None):
+        self.labels = _str_column('labels', labels)
+        self.size = len(self.labels)
+        self.counts = _int_column('counts', counts, self.size)
+        self.neurons, self.neuron_index = _ref_column(
+            'neuron', neuron, NeuronGroup.schema().types['neuron'], self.size
+        )
+        self.geometries = _xyz_column('geometries', geometries, self.size)
+        self.locations = _xyz_column('locations', locations, self.size)
+
+    def row(self, idx):
+        """ Builds a regular NeuronGroup for a single row """
+        neuron = self.neurons[_block(self.neuron_index, idx, idx + 1)[0]]
+        return NeuronGroup(
+            neuron=neuron,
+            count=_block(self.counts, idx, idx + 1)[0],
+            label=self.labels[idx],
+            geometry=Geometry(*_block(self.geometries, idx, idx + 1)[0]),
+            location=Location(*_block(self.locations, idx, idx + 1)[0])
+        )
+
+    def iter_dicts(self):
+        neuron_ids = [x._id for x in self.neurons]
+        for start, stop in self._blocks():
+            rows = zip(_block(self.neuron_index, start, stop),
+                       _block(self.counts, start, stop),
+                       self.labels[start:stop],
+                       _block(self.geometries, start, stop),
+                       _block(self.locations, start, stop))
+            for neuron, count, label, geometry, location in rows:
+                yield {
+                    'neuron': neuron_ids[neuron],
+                    'count': count,
+                    'label': label,
+                    'geometry': {'width': geometry[0],
+                                 'height': geometry[1],
+                                 'depth': geometry[2]},
+                    'location': {'x': location[0],
+                                 'y': location[1],
+                                 'z': location[2]}
+                }
+
+    def iterencode(self):
+        """ Yields the JSON encoding of every row, formatted straight from
+        the columns """
+        neuron_ids = [_encode_str(x._id) for x in self.neurons]
+        for start, stop in self._blocks():
+            rows = zip(_block(self.neuron_index, start, stop),
+                       _block(self.counts, start, stop),
+                       self.labels[start:stop],
+                       _block(self.geometries, start, stop),
+                       _block(self.locations, start, stop))
+            for neuron, count, label, geometry, location in rows:
+                yield _NEURON_GROUP_JSON % (
+                    neuron_ids[neuron], count, _encode_str(label),
+                    _encode_float(geometry[0]), _encode_float(geometry[1]),
+                    _encode_float(geometry[2]), _encode_float(location[0]),
+                    _encode_float(location[1]), _encode_float(location[2])
+                )
+
+
+class ConnectionColumns(_Columns):
+    """ Column-wise block of connections, see Connection.from_arrays """
+
+    def __init__(self, presynaptic, postsynaptic, probabilities, synapse,
+                 recurrent=False):
+        self.presynaptic = _str_column('presynaptic', presynaptic)
+        self.size = len(self.presynaptic)
+        self.postsynaptic = _str_column('postsynaptic', postsynaptic,
+                                        self.size)
+        self.probabilities = _probability_column('probabilities',
+                                                 probabilities, self.size)
+        self.synapses, self.synapse_index = _ref_column(
+            'synapse', synapse, Connection.schema().types['synapse'],
+            self.size
+        )
+        self.recurrent = _bool_column('recurrent', recurrent, self.size)
+
+    def row(self, idx):
+        """ Builds a regular Connection for a single row """
+        synapse = self.synapses[_block(self.synapse_index, idx, idx + 1)[0]]
+        return Connection(
+            presynaptic=self.presynaptic[idx],
+            postsynaptic=self.postsynaptic[idx],
+            probability=_block(self.probabilities, idx, idx + 1)[0],
+            synapse=synapse,
+            recurrent=_block(self.recurrent, idx, idx + 1)[0]
+        )
+
+    def iter_dicts(self):
+        synapse_ids = [x._id for x in self.synapses]
+        for start, stop in self._blocks():
+            rows = zip(self.presynaptic[start:stop],
+                       self.postsynaptic[start:stop],
+                       _block(self.probabilities, start, stop),
+                       _block(self.synapse_index, start, stop),
+                       _block(self.recurrent, start, stop))
+            for pre, post, probability, synapse, recurrent in rows:
+                yield {
+                    'presynaptic': pre,
+                    'postsynaptic': post,
+                    'probability': probability,
+                    'synapse': synapse_ids[synapse],
+                    'recurrent': recurrent
+                }
+
+    def iterencode(self):
+        """ Yields the JSON encoding of every row, formatted straight from
+        the columns """
+        synapse_ids = [_encode_str(x._id) for x in self.synapses]
+        for start, stop in self._blocks():
+            rows = zip(self.presynaptic[start:stop],
+                       self.postsynaptic[start:stop],
+                       _block(self.probabilities, start, stop),
+                       _block(self.synapse_index, start, stop),
+                       _block(self.recurrent, start, stop))
+            for pre, post, probability, synapse, recurrent in rows:
+                yield _CONNECTION_JSON % (
+                    _encode_str(pre), _encode_str(post),
+                    _encode_float(probability), synapse_ids[synapse],
+                    'true' if recurrent else 'false'
+                )
+
+
+_NEURON_GROUP_JSON = ('{"neuron": %s, "count": %d, "label": %s, '
+                      '"geometry": {"width": %s, "height": %s, "depth": %s}, '
+                      '"location": {"x": %s, "y": %s, "z": %s}}')
+
+_CONNECTION_JSON = ('{"presynaptic": %s, "postsynaptic": %s, '
+                    '"probability": %s, "synapse": %s, "recurrent": %s}')
+
+_encode_str = encode_basestring_ascii
+_encode_float = float.__repr__
+
+
+def _block(column, start, stop):
+    # python values for a slice of a column, broadcasting single values
+    if isinstance(column, (int, bool)):
+        return [column] * (stop - start)
+    column = column[start:stop]
+    return column.tolist() if hasattr(column, 'tolist') else column
+
+
+def _check_size(name, size, expected):
+    if expected is not None and size != expected:
+        raise EntityError("%s has %d rows, expected %d" %
+                          (name, size, expected))
+
+
+def _str_column(name, values, size=None):
+    values = list(values)
+    _check_size(name, len(values), size)
+    for idx, value in enumerate(values):
+        if type(value) is not str:
+            raise TypeError("invalid type of %s at index %d (%s), "
+                            "acceptable types include %s" %
+                            (name, idx, type(value), [str]))
+    return values
+
+
+def _int_column(name, values, size):
+    if numpy is not None:
+        array = numpy.asarray(values)
+        if array.ndim != 1 or (array.size and array.dtype.kind not in 'iu'):
+            raise TypeError("%s must be a one dimensional column of ints" %
+                            name)
+        _check_size(name, len(array), size)
+        return array.astype(numpy.int64)
+    values = list(values)
+    _check_size(name, len(values), size)
+    for idx, value in enumerate(values):
+        if type(value) is not int:
+            raise TypeError("invalid type of %s at index %d (%s), "
+                            "acceptable types include %s" %
+                            (name, idx, type(value), [int]))
+    return values
+
+
+def _probability_column(name, values, size):
+    if numpy is not None:
+        array = numpy.asarray(values)
+        if array.ndim != 1 or (array.size and array.dtype.kind != 'f'):
+            raise TypeError("%s must be a one dimensional column of floats" %
+                            name)
+        _check_size(name, len(array), size)
+        array = array.astype(numpy.float64)
+        invalid = numpy.flatnonzero((array > 1) | ~(array > 0))
+        if len(invalid):
+            raise EntityError("%s at index %d must be greater than 0 and "
+                              "less than or equal to one" %
+                              (name, invalid[0]))
+        return array
+    values = list(values)
+    _check_size(name, len(values), size)
+    for idx, value in enumerate(values):
+        if type(value) is not float:
+            raise TypeError("invalid type of %s at index %d (%s), "
+                            "acceptable types include %s" %
+                            (name, idx, type(value), [float]))
+        if value > 1 or not value > 0:
+            raise EntityError("%s at index %d must be greater than 0 and "
+                              "less than or equal to one" % (name, idx))
+    return values
+
+
+def _bool_column(name, values, size):
+    # a single flag applies to every row
+    if type(values) is bool:
+        return values
+    if numpy is not None:
+        array = numpy.asarray(values)
+        if array.ndim != 1 or (array.size and array.dtype.kind != 'b'):
+            raise TypeError("%s must be a bool or a one dimensional column "
+                            "of bools" % name)
+        _check_size(name, len(array), size)
+        return array
+    values = list(values)
+    _check_size(name, len(values), size)
+    for idx, value in enumerate(values):
+        if type(value) is not bool:
+            raise TypeError("invalid type of %s at index %d (%s), "
+                            "acceptable types include %s" %
+                            (name, idx, type(value), [bool]))
+    return values
+
+
+def _xyz_column(name, values, size):
+    # geometries and locations default to the origin like their classes do
+    if values is None:
+        if numpy is not None:
+            return numpy.zeros((size, 3))
+        return [(0.0, 0.0, 0.0)] * size
+    if numpy is not None:
+        array = numpy.asarray(values)
+        if (array.ndim != 2 or array.shape[1] != 3 or
+                (array.size and array.dtype.kind not in 'iuf')):
+            raise TypeError("%s must be an (n, 3) array of numbers" % name)
+        _check_size(name, len(array), size)
+        return array.astype(numpy.float64)
+    values = [tuple(float(x) for x in value) for value in values]
+    _check_size(name, len(values), size)
+    for idx, value in enumerate(values):
+        if len(value) != 3:
+            raise TypeError("%s at index %d must have 3 values" % (name, idx))
+    return values
+
+
+def _ref_column(name, values, types, size):
+    """ Splits a reference column into its distinct entities and the index
+    of each row's entity among them """
+    # a single entity is shared by every row
+    if type(values) in types:
+        return [values], 0
+    if not hasattr(values, '__iter__'):
+        raise TypeError("invalid type of %s (%s), acceptable types include "
+                        "%s or a sequence of them" %
+                        (name, type(values), list(types)))
+    entities = []
+    positions = {}
+    index = []
+    for idx, value in enumerate(values):
+        if type(value) not in types:
+            raise TypeError("invalid type of %s at index %d (%s), "
+                            "acceptable types include %s" %
+                            (name, idx, type(value), list(types)))
+        if id(value) not in positions:
+            positions[id(value)] = len(entities)
+            entities.append(value)
+        index.append(positions[id(value)])
+    _check_size(name, len(index), size)
+    if numpy is not None:
+        index = numpy.asarray(index, dtype=numpy.int64)
+    return entities, index
+
+
+# parameter values that are serialized through their own to_dict
+_NESTED_TYPES = frozenset([Normal, Uniform, NeuronGroup, Alias, Location,
+                           Geometry, Connection])
@@ -0,0 +1,400 @@
+""" Readers for report output, streamed (Report.METHOD_SOCKET) or written to
+files (Report.METHOD_FILE).
+
+After a run the daemon serves each socket report as a TCP stream. A stream
+starts with a header of the magic bytes 'NCSR', the protocol version and the
+number of values per frame (the width), each a little endian uint32 after the
+magic. Every frame after that is a little endian uint32 time step followed by
+width float32 values, one per reported neuron or synapse.
+
+A ReportReceiver decodes the frames as they arrive into a preallocated
+RingBuffer. Reads only happen when the buffer has room, so a consumer that
+falls behind slows the daemon down through TCP flow control instead of
+growing client memory, unless overwrite=True asks for the oldest frames to be
+dropped instead.
+
+Value report files hold the same header and frames, so a ReportFile can map
+them straight into numpy arrays. Spike report files use the magic 'NCSS' and
+hold (uint32 step, uint32 index) records, both sorted by step.
+"""
+import os
+import socket
+import struct
+import threading
+
+import numpy
+
+from .pyncs import SimulationError
+
+MAGIC = b'NCSR'
+SPIKE_MAGIC = b'NCSS'
+VERSION = 1
+HEADER = struct.Struct('<4sII')
+SPIKE_DTYPE = numpy.dtype([('step', '<u4'), ('index', '<u4')])
+
+
+def frame_dtype(width):
+    return numpy.dtype([('step', '<u4'), ('values', '<f4', width)])
+
+
+class RingBuffer(object):
+    """ Fixed capacity store of (step, values) frames """
+
+    def __init__(self, width, capacity, dtype=numpy.float32):
+        self.width = width
+        self.capacity = capacity
+        self.steps = numpy.zeros(capacity, dtype=numpy.int64)
+        self.values = numpy.zeros((capacity, width), dtype=dtype)
+        # running totals of frames written and consumed, the slot of frame
+        # n is n % capacity
+        self.head = 0
+        self.tail = 0
+        # frames overwritten before they were read
+        self.dropped = 0
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def free(self):
+        return self.capacity - len(self)
+
+    def extend(self, steps, values):
+        """ Appends frames, overwriting the oldest ones if there's no room """
+        count = len(steps)
+        if count > self.capacity:
+            skipped = count - self.capacity
+            steps, values = steps[skipped:], values[skipped:]
+            self.head += skipped
+            count = self.capacity
+        overflow = len(self) + count - self.capacity
+        if overflow > 0:
+            self.tail += overflow
+            self.dropped += overflow
+        start = self.head % self.capacity
+        first = min(count, self.capacity - start)
+        self.steps[start:start + first] = steps[:first]
+        self.values[start:start + first] = values[:first]
+        self.steps[:count - first] = steps[first:]
+        self.values[:count - first] = values[first:]
+        self.head += count
+
+    def read(self, max_frames=None):
+        """ Removes and returns copies of the oldest unread frames """
+        count = len(self)
+        if max_frames is not None:
+            count = min(count, max_frames)
+        batch = self._slice(self.tail, count)
+        self.tail += count
+        return batch
+
+    def latest(self, count):
+        """ Returns copies of the newest frames without consuming them """
+        count = min(count, self.capacity, self.head)
+        return self._slice(self.head - count, count)
+
+    def _slice(self, start, count):
+        index = numpy.arange(start, start + count) % self.capacity
+        return self.steps[index], self.values[index]
+
+
+class ReportReceiver(object):
+
+    def __init__(self, host, port, capacity=4096, overwrite=False,
+                 timeout=None, recv_size=64 * 1024):
+        self.overwrite = overwrite
+        self.closed = False
+        self.sock = socket.create_connection((host, port), timeout)
+        magic, version, width = HEADER.unpack(self._recv_exact(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            self.sock.close()
+            raise SimulationError("unsupported report stream from %s:%s" %
+                                  (host, port))
+        self.width = width
+        self.dtype = frame_dtype(width)
+        self.buffer = RingBuffer(width, capacity)
+        # socket reads land here, a partial frame is kept at the front until
+        # the rest of it arrives
+        frame_size = self.dtype.itemsize
+        self._recv_buf = bytearray(max(recv_size // frame_size, 1) *
+                                   frame_size)
+        self._view = memoryview(self._recv_buf)
+        self._pending = 0
+        self._thread = None
+        self._stopping = False
+        self._cond = threading.Condition()
+
+    def _recv_exact(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise SimulationError("report stream ended in its header")
+            data += chunk
+        return data
+
+    def _recv(self, limit):
+        # never read more than limit frames' worth, whatever stays in the
+        # socket is what pushes back on the daemon
+        frame_size = self.dtype.itemsize
+        size = min(limit * frame_size, len(self._recv_buf)) - self._pending
+        received = self.sock.recv_into(self._view[self._pending:], size)
+        if not received:
+            self.closed = True
+        self._pending += received
+
+    def _decode(self):
+        frame_size = self.dtype.itemsize
+        count = self._pending // frame_size
+        if count:
+            frames = numpy.frombuffer(self._recv_buf, self.dtype, count)
+            self.buffer.extend(frames['step'], frames['values'])
+            used = count * frame_size
+            self._recv_buf[:self._pending - used] = \
+                self._recv_buf[used:self._pending]
+            self._pending -= used
+        return count
+
+    def _limit(self):
+        return self.buffer.capacity if self.overwrite else self.buffer.free()
+
+    def receive(self):
+        """ Reads once from the socket, returns the number of frames that
+        were added to the buffer """
+        limit = self._limit()
+        if self.closed or not limit:
+            return 0
+        self._recv(limit)
+        return self._decode()
+
+    def read(self, max_frames=None, timeout=None):
+        """ Returns (steps, values) for the oldest unread frames, waiting for
+        at least one. Both arrays are empty once the stream has ended and
+        every frame was read. """
+        if self._thread is None:
+            while not len(self.buffer) and not self.closed:
+                self.receive()
+            return self.buffer.read(max_frames)
+        with self._cond:
+            while not len(self.buffer) and not self.closed:
+                # a timed out wait hands back whatever there is, which may
+                # be nothing
+                if not self._cond.wait(timeout) and timeout is not None:
+                    break
+            batch = self.buffer.read(max_frames)
+            # let the reader thread know there's room again
+            self._cond.notify_all()
+            return batch
+
+    def __iter__(self):
+        while True:
+            steps, values = self.read()
+            if not len(steps):
+                return
+            yield steps, values
+
+    def run(self, callback):
+        """ Calls callback(steps, values) for every batch of frames until the
+        stream ends, returns the number of frames seen """
+        total = 0
+        for steps, values in self:
+            callback(steps, values)
+            total += len(steps)
+        return total
+
+    def start(self):
+        """ Receives on a background thread so read() only waits for data """
+        self._thread = threading.Thread(target=self._pump)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _pump(self):
+        try:
+            while not self.closed:
+                with self._cond:
+                    while not self._limit() and not self._stopping:
+                        self._cond.wait()
+                    if self._stopping:
+                        return
+                    limit = self._limit()
+                self._recv(limit)
+                with self._cond:
+                    self._decode()
+                    self._cond.notify_all()
+        except (socket.error, ValueError):
+            # the socket was closed under us
+            pass
+        finally:
+            with self._cond:
+                self.closed = True
+                self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        if self._thread is not None:
+            self._thread.join()
+        self.sock.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_reports(response, host, **kwargs):
+    """ Connects to the socket reports listed in a run response, which the
+    daemon gives as {'report_sockets': {report _id: {'port': ...}}} with an
+    optional 'host' per report. Returns report _id -> ReportReceiver. """
+    receivers = {}
+    try:
+        for report_id, endpoint in response.get('report_sockets',
+                                                {}).items():
+            receivers[report_id] = ReportReceiver(
+                endpoint.get('host', host), endpoint['port'], **kwargs)
+    except Exception:
+        for receiver in receivers.values():
+            receiver.close()
+        raise
+    return receivers
+
+
+class ReportFile(object):
+    """ Read only, memory mapped view of a report file. Nothing is read until
+    it's used and slicing by time only touches the pages it needs. """
+
+    def __init__(self, path, dt=0.001):
+        self.path = path
+        # length of a time step in seconds
+        self.dt = dt
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise SimulationError("%s is not a report file" % path)
+        magic, version, self.width = HEADER.unpack(header)
+        if magic not in (MAGIC, SPIKE_MAGIC) or version != VERSION:
+            raise SimulationError("%s is not a report file" % path)
+        self.is_spikes = magic == SPIKE_MAGIC
+        dtype = SPIKE_DTYPE if self.is_spikes else frame_dtype(self.width)
+        # a file that's still being written may end in a partial record
+        count = (os.path.getsize(path) - HEADER.size) // dtype.itemsize
+        if count:
+            self.records = numpy.memmap(path, dtype, mode='r',
+                                        offset=HEADER.size, shape=(count,))
+        else:
+            # mmap refuses empty ranges
+            self.records = numpy.zeros(0, dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def steps(self):
+        return self.records['step']
+
+    @property
+    def times(self):
+        return self.steps * self.dt
+
+    @property
+    def values(self):
+        """ (frames, width) values, one row per time step """
+        if self.is_spikes:
+            raise SimulationError("%s holds spikes, not values" % self.path)
+        return self.records['values']
+
+    @property
+    def spike_steps(self):
+        return self._spike_field('step')
+
+    @property
+    def spike_times(self):
+        return self.spike_steps * self.dt
+
+    @property
+    def spike_neurons(self):
+        """ Index into the report's targets of each spike """
+        return self._spike_field('index')
+
+    def _spike_field(self, name):
+        if not self.is_spikes:
+            raise SimulationError("%s holds values, not spikes" % self.path)
+        return self.records[name]
+
+    def window(self, time_start=None, time_end=None):
+        """ Returns a view of the records from time_start up to, but not
+        including, time_end, found by binary search over the mapped steps """
+        view = ReportFile.__new__(ReportFile)
+        view.__dict__.update(self.__dict__)
+        start = 0
+        end = len(self.records)
+        steps = self.steps
+        if time_start is not None:
+            start = _bisect(steps, _step(time_start, self.dt))
+        if time_end is not None:
+            end = _bisect(steps, _step(time_end, self.dt))
+        view.records = self.records[start:max(start, end)]
+        return view
+
+    def close(self):
+        """ Lets go of the mapping. It's unmapped once every window taken
+        from the file is closed too, a view of it would keep it alive. """
+        self.records = numpy.zeros(0, self.records.dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _step(time, dt):
+    # times that land within rounding error of a step boundary belong to it
+    return int(numpy.ceil(time / dt - 1e-9))
+
+
+def _bisect(column, value):
+    # numpy.searchsorted would copy a strided memmap column, which reads the
+    # whole file, this only touches log2(n) records
+    low, high = 0, len(column)
+    while low < high:
+        mid = (low + high) // 2
+        if column[mid] < value:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+
+def open_report_file(report, path, dt=0.001):
+    """ Opens the output of a Report.METHOD_FILE report, limited to the
+    report's time window """
+    if report.report_method != 'file':
+        raise SimulationError("report %s isn't written to a file" %
+                              report._id)
+    report_file = ReportFile(path, dt)
+    return report_file.window(report.time_start, report.time_end)
+
+
+def write_report_file(path, steps, values=None, indices=None, width=None):
+    """ Writes a report file, frames of values or, given indices, spikes.
+    Used by tools and tests standing in for the daemon. """
+    if indices is not None:
+        records = numpy.zeros(len(steps), SPIKE_DTYPE)
+        records['index'] = indices
+        header = HEADER.pack(SPIKE_MAGIC, VERSION, width or 0)
+    else:
+        values = numpy.asarray(values)
+        records = numpy.zeros(len(steps), frame_dtype(values.shape[1]))
+        records['values'] = values
+        header = HEADER.pack(MAGIC, VERSION, values.shape[1])
+    records['step'] = steps
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(records.tobytes())
@@ -0,0 +1,180 @@
+""" Local sampling of distribution-valued parameters.
+
+Normal and Uniform parameters are only descriptions until the daemon draws a
+value for every neuron or synapse. materialize draws them here, so what a
+model realizes can be inspected, reproduced and reused before it's run.
+
+Values are drawn in blocks of BLOCK_SIZE, each from its own generator seeded
+with a hash of the seed, the key of its population, the parameter and the
+block's index. The same seed gives the same values however they're read,
+whole, in chunks or a slice at a time, and reading a slice only draws the
+blocks it covers, so a large model is never held in memory at once.
+
+A population's key is the _id of its neuron or synapse plus where it's
+placed: the label path of its neuron group, or the path of its group and the
+connection's position in it. A rebuilt model gives the same values as long
+as it keeps its ids, eg. content addressed or passed explicitly.
+"""
+import hashlib
+
+import numpy
+
+from .pyncs import Normal, Uniform, SimulationError
+from .estimate import _connections, _neuron_groups
+from .labels import LabelIndex
+
+# values drawn by one generator, changing it changes every value drawn
+BLOCK_SIZE = 1 << 16
+
+# values handed out at a time by Parameter.chunks
+CHUNK_SIZE = 1 << 20
+
+NEURON = 'neuron'
+SYNAPSE = 'synapse'
+
+
+def _normal(rng, value, size):
+    return rng.normal(value['mean'], value['stdev'], size)
+
+
+def _uniform(rng, value, size):
+    return rng.uniform(value['min'], value['max'], size)
+
+
+_DRAWS = {
+    'normal': _normal,
+    'uniform': _uniform
+}
+
+
+def _rng(seed, *key):
+    digest = hashlib.sha256('/'.join(str(x) for x in (seed,) + key)
+                            .encode('utf-8')).digest()
+    return numpy.random.RandomState(numpy.frombuffer(digest, '<u4'))
+
+
+def _key(entity_id, path, index=None):
+    key = '%s@%s' % (entity_id, ':'.join(path))
+    if index is not None:
+        key += '#%d' % index
+    return key
+
+
+class Parameter(object):
+    """ Values of one distribution-valued parameter for count instances,
+    drawn as they're read. value is a Normal, a Uniform or the dict either
+    serializes to. """
+
+    def __init__(self, name, value, count, key, seed=0):
+        if hasattr(value, 'to_dict'):
+            value = value.to_dict()
+        if value.get('type') not in _DRAWS:
+            raise SimulationError("unsupported distribution %s" %
+                                  value.get('type'))
+        self.name = name
+        self.value = value
+        self.count = count
+        self.key = key
+        self.seed = seed
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.count)
+            if step == 1:
+                return self._range(start, stop)
+            positions = numpy.arange(start, stop, step)
+            if not len(positions):
+                return numpy.zeros(0)
+            low = positions.min()
+            return self._range(low, positions.max() + 1)[positions - low]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("parameter index out of range")
+        return float(self._range(index, index + 1)[0])
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """ Yields the values in arrays of up to chunk_size """
+        for start in range(0, self.count, chunk_size):
+            yield self._range(start, min(start + chunk_size, self.count))
+
+    def array(self):
+        """ Returns every value at once """
+        return self._range(0, self.count)
+
+    def _range(self, start, stop):
+        if start >= stop:
+            return numpy.zeros(0)
+        first = start // BLOCK_SIZE
+        blocks = [self._block(x)
+                  for x in range(first, -(-stop // BLOCK_SIZE))]
+        values = blocks[0] if len(blocks) == 1 else numpy.concatenate(blocks)
+        offset = first * BLOCK_SIZE
+        return values[start - offset:stop - offset]
+
+    def _block(self, index):
+        size = min(BLOCK_SIZE, self.count - index * BLOCK_SIZE)
+        rng = _rng(self.seed, self.key, self.name, index)
+        return _DRAWS[self.value['type']](rng, self.value, size)
+
+
+class Population(object):
+    """ The instances of one neuron group or connection placed in the model,
+    with a Parameter for each distribution-valued parameter of its neuron or
+    synapse """
+
+    def __init__(self, kind, path, index, entity, count, seed=0):
+        self.kind = kind
+        # label path of the neuron group, or of the connection's group
+        self.path = path
+        # position of the connection in its group, None for neurons
+        self.index = index
+        # the neuron or synapse
+        self.entity = entity
+        self.count = count
+        self.key = _key(entity._id, path, index)
+        self.parameters = {}
+        for name in entity.schema().parameters:
+            value = getattr(entity, name, None)
+            if isinstance(value, (Normal, Uniform)):
+                self.parameters[name] = Parameter(name, value, count,
+                                                  self.key, seed)
+
+    def __repr__(self):
+        return '<Population %s %s x%d>' % (self.kind, self.key, self.count)
+
+
+def materialize(simulation, seed=0):
+    """ Returns a Population for every neuron group and connection of the
+    simulation, in the order they're placed. A group used by several
+    subgroups has populations of its own for each. Synapse counts are drawn
+    too, from the number of pairs a connection's labels join, unless it
+    lists its edges explicitly. Labels resolve the way the engine resolves
+    them, see labels.LabelIndex. """
+    top = simulation.top_group
+    labels = LabelIndex(top)
+    top_path = ()
+    if getattr(top, 'entity_name', None):
+        top_path = (top.entity_name,)
+    populations = []
+    stack = [(top, top_path)]
+    while stack:
+        group, path = stack.pop()
+        for label, count, neuron in _neuron_groups(group):
+            populations.append(Population(NEURON, path + (label,), None,
+                                          neuron, count, seed))
+        for index, (pre, post, probability, synapse, recurrent, edges) in \
+                enumerate(_connections(group)):
+            if edges is None:
+                pairs = labels.pairs(pre, post, group, recurrent)
+                rng = _rng(seed, _key(synapse._id, path, index), 'count')
+                edges = int(rng.binomial(pairs, probability))
+            populations.append(Population(SYNAPSE, path, index, synapse,
+                                          edges, seed))
+        # reversed so subgroups come out in the order they're listed
+        for subgroup in reversed(group.subgroups):
+            stack.append((subgroup.group, path + (subgroup.label,)))
+    return populations
@@ -0,0 +1,331 @@
+""" Spreads simulations over a pool of NCS daemons from one client.
+
+Every daemon gets a worker thread that takes the next queued simulation as
+soon as its daemon is idle, so the whole pool stays busy without any central
+dispatch loop. A run that fails on one daemon, because it couldn't be
+reached or answered with a server error, goes back to the front of the
+queue for another, and the daemon that failed sits out a cooldown. Once a
+daemon has accepted a run it's never sent anywhere else, as that could run
+it twice: if waiting for it to finish fails, its outcome is unknown and the
+job fails with the daemon's response to the run. A simulation that's at
+fault itself, eg. with a label that doesn't resolve or one the daemon turns
+down, fails at once wherever it's run.
+"""
+import threading
+import time
+from collections import deque
+
+import requests
+
+from .polling import wait_for_completion
+from .pyncs import Simulator, SimulationError, EntityError
+
+
+class Job(object):
+    """ A queued simulation and, once it's done, its result """
+
+    def __init__(self, simulation, kwargs, method='run'):
+        # a Simulation, or a transfer format document for run_transfer_format
+        self.simulation = simulation
+        self.kwargs = kwargs
+        # the Simulator method the simulation is given to
+        self.method = method
+        self.attempts = 0
+        # nodes this job has already failed on
+        self.failed_nodes = set()
+        # node the job finished on
+        self.node = None
+        # the daemon's response to the run, once a daemon has accepted it
+        self.response = None
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """ Returns the daemon's run response once the run has finished, or
+        raises the error from its last attempt """
+        if not self._done.wait(timeout):
+            raise SimulationError("simulation still queued or running")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _finish(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        self._done.set()
+
+
+class _Node(object):
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.name = '%s:%s' % (simulator.host, simulator.port)
+        self.runs = 0
+        self.failures = 0
+        self.last_error = None
+        # seconds spent running jobs, plus the start of the current one
+        self.busy_time = 0.0
+        self.busy_since = None
+        # last status seen and when, reused for status_ttl seconds
+        self.status = None
+        self.checked_at = 0.0
+        self.unhealthy_until = 0.0
+
+    def get_status(self, ttl):
+        now = time.time()
+        if self.status is None or now - self.checked_at > ttl:
+            self.status = self.simulator.get_status()
+            self.checked_at = now
+        return self.status
+
+    def set_status(self, status):
+        self.status = status
+        self.checked_at = time.time()
+
+    def wait_idle(self, seconds):
+        """ Waits up to seconds for a busy daemon to become idle, long
+        polling if it supports it """
+        start = time.time()
+        self.set_status(self.simulator.get_status(wait=seconds))
+        left = seconds - (time.time() - start)
+        if self.status != Simulator.STATUS_IDLE and left > 0:
+            time.sleep(left)
+
+    def busy(self, now):
+        if self.busy_since is None:
+            return self.busy_time
+        return self.busy_time + now - self.busy_since
+
+
+class Scheduler(object):
+
+    def __init__(self, simulators, status_ttl=1.0, max_attempts=3,
+                 cooldown=30.0, timeout=None):
+        self.nodes = [_Node(x) for x in simulators]
+        # how long a get_status result is trusted for
+        self.status_ttl = status_ttl
+        # runs per job before its error is handed back
+        self.max_attempts = max_attempts
+        # seconds a node that failed a run is left alone
+        self.cooldown = cooldown
+        # longest a single run may take, None waits forever
+        self.timeout = timeout
+        self.started = time.time()
+        self.completed = 0
+        self.failed = 0
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._threads = []
+        for node in self.nodes:
+            thread = threading.Thread(target=self._work, args=(node,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @classmethod
+    def from_endpoints(cls, endpoints, username, password, token_cache=None,
+                       **kwargs):
+        """ Builds a scheduler for (host, port) endpoints that share one set
+        of credentials """
+        simulators = [Simulator(host, port, username, password,
+                                token_cache=token_cache)
+                      for host, port in endpoints]
+        return cls(simulators, **kwargs)
+
+    def submit(self, simulation, **kwargs):
+        """ Queues a simulation, kwargs are passed to Simulator.run """
+        return self._submit(Job(simulation, kwargs))
+
+    def submit_transfer_format(self, transfer_format, **kwargs):
+        """ Queues a simulation that's already in the transfer format,
+        kwargs are passed to Simulator.run_transfer_format """
+        return self._submit(Job(transfer_format, kwargs,
+                                'run_transfer_format'))
+
+    def run_transfer_format(self, transfer_format, **kwargs):
+        """ Runs a transfer format on the first free daemon and returns its
+        response once the run has finished, so a scheduler can stand in for
+        a Simulator, eg. as the runner of a sweep """
+        return self.submit_transfer_format(transfer_format,
+                                           **kwargs).result()
+
+    def _submit(self, job):
+        with self._cond:
+            if self._closing:
+                raise SimulationError("scheduler is closed")
+            self._jobs.append(job)
+            self._cond.notify_all()
+        return job
+
+    def map(self, simulations, **kwargs):
+        """ Runs every simulation and returns their responses in order """
+        jobs = [self.submit(x, **kwargs) for x in simulations]
+        return [x.result() for x in jobs]
+
+    @property
+    def queue_depth(self):
+        return len(self._jobs)
+
+    def stats(self):
+        now = time.time()
+        elapsed = max(now - self.started, 1e-9)
+        nodes = {}
+        for node in self.nodes:
+            nodes[node.name] = {
+                'runs': node.runs,
+                'failures': node.failures,
+                'status': node.status,
+                'healthy': node.unhealthy_until <= now,
+                'utilization': node.busy(now) / elapsed
+            }
+        return {
+            'queue_depth': self.queue_depth,
+            'running': sum(1 for x in self.nodes if x.busy_since is not None),
+            'completed': self.completed,
+            'failed': self.failed,
+            'throughput': self.completed / elapsed,
+            'nodes': nodes
+        }
+
+    def close(self, wait=True):
+        """ Stops taking jobs, the workers exit once the queue is empty """
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _take(self, node):
+        while True:
+            with self._cond:
+                while not self._takeable(node):
+                    if self._closing and not self._jobs:
+                        return None
+                    # sleep out the cooldown, or until a job comes in
+                    timeout = node.unhealthy_until - time.time()
+                    self._cond.wait(timeout if timeout > 0 else None)
+            # a job is only taken once the daemon is idle, while it's busy
+            # with someone else's run the job stays queued for the others
+            try:
+                status = node.get_status(self.status_ttl)
+                if status != Simulator.STATUS_IDLE:
+                    node.wait_idle(self.status_ttl)
+                    continue
+            except Exception as e:
+                self._unhealthy(node, e)
+                continue
+            with self._cond:
+                job = self._takeable(node)
+                if job is not None:
+                    self._jobs.remove(job)
+                    return job
+
+    def _takeable(self, node):
+        """ Returns the first queued job the node may take, if any """
+        if node.unhealthy_until > time.time():
+            return None
+        for job in self._jobs:
+            if node not in job.failed_nodes:
+                return job
+        return None
+
+    def _work(self, node):
+        while True:
+            job = self._take(node)
+            if job is None:
+                return
+            job.attempts += 1
+            try:
+                node.busy_since = time.time()
+                node.set_status(Simulator.STATUS_RUNNING)
+                job.response = getattr(node.simulator, job.method)(
+                    job.simulation, **job.kwargs)
+                node.set_status(wait_for_completion(node.simulator,
+                                                    self.timeout))
+            except Exception as e:
+                if job.response is not None:
+                    self._unknown(node, job, e)
+                elif _daemon_fault(e):
+                    self._failed(node, job, e)
+                else:
+                    # no daemon would take it, don't retry it or hold it
+                    # against this one
+                    node.status = None
+                    with self._cond:
+                        self.failed += 1
+                        job._finish(error=e)
+                        self._cond.notify_all()
+                continue
+            finally:
+                if node.busy_since is not None:
+                    node.busy_time += time.time() - node.busy_since
+                    node.busy_since = None
+            node.runs += 1
+            job.node = node.name
+            with self._cond:
+                self.completed += 1
+                # a closing scheduler may only have been waiting on this job
+                self._cond.notify_all()
+            job._finish(job.response)
+
+    def _unhealthy(self, node, error):
+        node.failures += 1
+        node.last_error = error
+        # don't trust anything we knew about the node
+        node.status = None
+        node.unhealthy_until = time.time() + self.cooldown
+        with self._cond:
+            self._cond.notify_all()
+
+    def _failed(self, node, job, error):
+        self._unhealthy(node, error)
+        job.failed_nodes.add(node)
+        with self._cond:
+            if (job.attempts >= self.max_attempts or
+                    len(job.failed_nodes) >= len(self.nodes)):
+                self.failed += 1
+                job._finish(error=error)
+            else:
+                # retried ahead of anything queued after it
+                self._jobs.appendleft(job)
+            self._cond.notify_all()
+
+
+    def _unknown(self, node, job, error):
+        # the daemon has the run, sending it again could run it twice
+        self._unhealthy(node, error)
+        job.node = node.name
+        with self._cond:
+            self.failed += 1
+            job._finish(job.response, SimulationError(
+                "run accepted by %s, its outcome is unknown: %s" %
+                (node.name, error), getattr(error, 'status', None)))
+            self._cond.notify_all()
+
+
+def _daemon_fault(error):
+    """ Whether an error says the daemon is in trouble rather than that the
+    simulation is at fault """
+    # connection errors and timeouts, some of which are also ValueErrors
+    if isinstance(error, requests.exceptions.RequestException):
+        return True
+    # a spec that doesn't build or validate fails the same everywhere
+    if isinstance(error, (EntityError, ValueError, TypeError)):
+        return False
+    # the daemon turned the simulation down, only 5xx is its own fault
+    if isinstance(error, SimulationError) and error.status is not None:
+        return error.status >= 500
+    # eg. runs that never finish
+    return True
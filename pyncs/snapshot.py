@@ -0,0 +1,487 @@
+""" On-disk snapshots of models, see save and load.
+
+A snapshot holds a Simulation or a Group with every entity's _id, and any
+entity used in several places is saved once and comes back shared. The file
+is made of separately compressed sections behind a small header:
+
+    MAGIC, then version (uint16), compression (uint8), a pad byte and the
+    header's length (uint32), all little endian
+    header: JSON listing every group's _id and section, the entity table's
+    sections and what the snapshot holds
+    sections: one per group, and the entity table in chunks of about
+    CHUNK_SIZE entries. The table holds stimuli, reports and whatever is
+    used in more than one place, each after the entities it refers to.
+    Anything else is stored inline where it's used.
+
+A section is the JSON of its values followed by the raw bytes of any numpy
+arrays among them. Objects are tagged JSON objects, rebuilt as json decodes
+them so loading costs little more than json itself. Entities are stored as
+their pickled state and restored without going through __setattr__'s
+validation, which they passed when they were built. Nothing but entities
+and their values is ever created from a snapshot.
+
+Loading only reads the header. A group is an empty shell until one of its
+attributes is first used, then its section is decoded along with the
+entities it refers to, so opening even a very large model is quick and only
+the parts that are used are paid for.
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import pyncs
+from .pyncs import Group, Simulation, _Entity, _Value, _Columns
+
+MAGIC = b'PYNCSSNP'
+VERSION = 1
+
+# entity table entries per section, a chunk may run over while the
+# entities an entry refers to are added
+CHUNK_SIZE = 4096
+
+_COMPRESSION = {None: 0, 'zlib': 1}
+
+_PREAMBLE = struct.Struct('<HBxI')
+_LENGTH = struct.Struct('<I')
+
+# array offsets within a section are multiples of this
+_ALIGNMENT = 8
+
+# the lists of a group that hold entities it owns
+_GROUP_LISTS = [attr for key, attr in Group.SPECIFICATION_LISTS]
+
+if sys.version_info[0] >= 3:
+    _text_types = (str,)
+    _scalar_types = (type(None), bool, int, float, str)
+else:
+    _text_types = (str, unicode)  # noqa: F821
+    _scalar_types = (type(None), bool, int, long, float, str)  # noqa: F821
+
+
+def _classes(base):
+    return dict((name, cls) for name, cls in vars(pyncs).items()
+                if isinstance(cls, type) and issubclass(cls, base))
+
+
+# the only classes a snapshot can create instances of
+_ENTITIES = _classes(_Entity)
+_VALUES = _classes(_Value)
+_COLUMNS = _classes(_Columns)
+
+
+def _fields(obj):
+    """ Returns the attributes of a column block, slotted or not """
+    if hasattr(obj, '__dict__'):
+        return dict(obj.__dict__)
+    fields = {}
+    for cls in type(obj).__mro__:
+        for slot in cls.__dict__.get('__slots__', ()):
+            if hasattr(obj, slot):
+                fields[slot] = getattr(obj, slot)
+    return fields
+
+
+class _Section(object):
+    """ Encodes values into one section """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.arrays = []
+        self.size = 0
+
+    def encode(self, value):
+        kind = type(value)
+        if kind in _scalar_types:
+            return value
+        # scalars are checked for inline, most values are
+        if kind is list:
+            return [x if type(x) in _scalar_types else self.encode(x)
+                    for x in value]
+        if kind is dict:
+            # only dicts that could be mistaken for a tagged value are
+            # tagged themselves
+            if '#' in value or not all(type(k) in _text_types
+                                       for k in value):
+                return {'#': 'd', 'v': [[k, self.encode(v)]
+                                        for k, v in value.items()]}
+            return dict([(k, v if type(v) in _scalar_types
+                          else self.encode(v)) for k, v in value.items()])
+        if isinstance(value, Group):
+            return {'#': 'g', 'i': self.writer.group(value)}
+        if isinstance(value, _Entity):
+            if id(value) in self.writer.owned:
+                return {'#': 'o', 'c': kind.__name__,
+                        's': self.encode(value.__getstate__())}
+            return {'#': 'e', 'i': self.writer.entity(value)}
+        if isinstance(value, _Value):
+            return {'#': 'v', 'c': kind.__name__,
+                    's': self.encode(value.__getstate__())}
+        if isinstance(value, _Columns):
+            return {'#': 'c', 'c': kind.__name__,
+                    's': self.encode(_fields(value))}
+        if kind is tuple:
+            return {'#': 't', 'v': [self.encode(x) for x in value]}
+        if numpy is not None and isinstance(value, numpy.ndarray):
+            return self._array(value)
+        if kind in _text_types:
+            return value
+        if hasattr(value, 'item'):
+            # numpy scalars
+            return value.item()
+        raise TypeError("%r can't be saved in a snapshot" % (value,))
+
+    def _array(self, array):
+        array = numpy.ascontiguousarray(
+            array, dtype=array.dtype.newbyteorder('<'))
+        offset = self.size
+        self.arrays.append(array)
+        self.size += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+        return {'#': 'a', 't': array.dtype.str, 'o': offset,
+                's': list(array.shape)}
+
+    def dumps(self, document):
+        data = json.dumps(document, separators=(',', ':')).encode('utf-8')
+        parts = [_LENGTH.pack(len(data)), data]
+        padding = -(_LENGTH.size + len(data)) % _ALIGNMENT
+        parts.append(b'\0' * padding)
+        for array in self.arrays:
+            parts.append(array.tobytes())
+            parts.append(b'\0' * (-array.nbytes % _ALIGNMENT))
+        return b''.join(parts)
+
+
+class _Writer(object):
+
+    def __init__(self, compression):
+        if compression not in _COMPRESSION:
+            raise ValueError("unsupported compression %s" % compression)
+        self.compression = compression
+        self.groups = []
+        self.group_index = {}
+        self.entity_index = {}
+        # entities used in a single place are stored inline there
+        self.owned = set()
+        # the entity table, as (first index, section) per chunk
+        self.chunks = []
+        self.chunk = _Section(self)
+        self.rows = []
+        self.depth = 0
+
+    def group(self, group):
+        if id(group) not in self.group_index:
+            self.group_index[id(group)] = len(self.groups)
+            self.groups.append(group)
+        return self.group_index[id(group)]
+
+    def entity(self, entity):
+        index = self.entity_index.get(id(entity))
+        if index is not None:
+            return index
+        # the entities one refers to are added first, so a row only ever
+        # refers back to earlier ones
+        self.depth += 1
+        state = self.chunk.encode(entity.__getstate__())
+        self.depth -= 1
+        index = self.entity_index[id(entity)] = len(self.entity_index)
+        self.rows.append({'#': 'r', 'i': index, 'c': type(entity).__name__,
+                          's': state})
+        # a chunk is only cut between entities, not while encoding one
+        if self.depth == 0 and len(self.rows) >= CHUNK_SIZE:
+            self._flush()
+        return index
+
+    def _flush(self):
+        if self.rows:
+            self.chunks.append((self.rows[0]['i'],
+                                self.chunk.dumps(self.rows)))
+            self.chunk = _Section(self)
+            self.rows = []
+
+    def write(self, root, out):
+        uses = {}
+        for group in _walk(root):
+            self.group(group)
+            for attr in _GROUP_LISTS:
+                for item in getattr(group, attr):
+                    uses[id(item)] = uses.get(id(item), 0) + 1
+        # report targets may be neuron groups, which are then shared
+        if isinstance(root, Simulation):
+            for report in root.reports:
+                for target in report.report_target:
+                    uses[id(target)] = uses.get(id(target), 0) + 1
+        self.owned = set(x for x, count in uses.items() if count == 1)
+        section = _Section(self)
+        if isinstance(root, Simulation):
+            contents = {'kind': 'simulation',
+                        'top_group': section.encode(root.top_group),
+                        'stimuli': section.encode(list(root.stimuli)),
+                        'reports': section.encode(list(root.reports))}
+        else:
+            contents = {'kind': 'group', 'group': section.encode(root)}
+        sections = [section.dumps(contents)]
+        groups = []
+        for group in self.groups:
+            groups.append(group._id)
+            section = _Section(self)
+            sections.append(section.dumps(
+                section.encode(group.__getstate__())))
+        self._flush()
+        firsts = [x for x, _ in self.chunks]
+        sections.extend(x for _, x in self.chunks)
+        if self.compression == 'zlib':
+            sections = [zlib.compress(x) for x in sections]
+        offsets = []
+        offset = 0
+        for section in sections:
+            offsets.append([offset, len(section)])
+            offset += len(section)
+        header = json.dumps({
+            'contents': offsets[0],
+            'groups': [[group_id] + offsets[1 + idx]
+                       for idx, group_id in enumerate(groups)],
+            'entities': [[first] + offsets[1 + len(groups) + idx]
+                         for idx, first in enumerate(firsts)]
+        }, separators=(',', ':')).encode('utf-8')
+        if self.compression == 'zlib':
+            header = zlib.compress(header)
+        out.write(MAGIC)
+        out.write(_PREAMBLE.pack(VERSION, _COMPRESSION[self.compression],
+                                 len(header)))
+        out.write(header)
+        for section in sections:
+            out.write(section)
+
+
+def _walk(root):
+    """ Yields every group reachable from a Simulation or Group once """
+    top = root.top_group if isinstance(root, Simulation) else root
+    seen = set()
+    stack = [top]
+    while stack:
+        group = stack.pop()
+        if id(group) in seen:
+            continue
+        seen.add(id(group))
+        yield group
+        stack.extend(reversed([x.group for x in group.subgroups]))
+
+
+class _Reader(object):
+    """ Decodes the sections of a snapshot from data, bytes or a memory
+    mapped file, as they're needed """
+
+    def __init__(self, data):
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a pyncs snapshot")
+        start = len(MAGIC)
+        if len(data) < start + _PREAMBLE.size:
+            raise ValueError("truncated snapshot")
+        version, compression, size = _PREAMBLE.unpack_from(data, start)
+        if version != VERSION:
+            raise ValueError("unsupported snapshot version %d" % version)
+        if compression not in (0, 1):
+            raise ValueError("unsupported snapshot compression %d" %
+                             compression)
+        self.data = data
+        self.compressed = compression == 1
+        start += _PREAMBLE.size
+        if len(data) < start + size:
+            raise ValueError("truncated snapshot")
+        try:
+            header = json.loads(self._bytes(start, size).decode('utf-8'))
+        except (zlib.error, ValueError):
+            raise ValueError("corrupt snapshot header")
+        self.base = start + size
+        self.contents = header['contents']
+        self.group_sections = header['groups']
+        self.entity_sections = header['entities']
+        # sections are written back to back, the last one ends the file
+        end = max([offset + length for offset, length in
+                   [self.contents] + [x[1:] for x in self.group_sections] +
+                   [x[1:] for x in self.entity_sections]])
+        if len(data) < self.base + end:
+            raise ValueError("truncated snapshot")
+        self.firsts = [x[0] for x in self.entity_sections]
+        self.groups = {}
+        self.entities = {}
+
+    def _bytes(self, start, size):
+        data = self.data[start:start + size]
+        if self.compressed:
+            data = zlib.decompress(data)
+        return data
+
+    def section(self, offset, size):
+        """ Decodes a section """
+        data = self._bytes(self.base + offset, size)
+        length = _LENGTH.unpack_from(data)[0]
+        start = _LENGTH.size + length
+        start += -start % _ALIGNMENT
+        decoder = _Decoder(self, _Arrays(data, start))
+        return json.loads(data[_LENGTH.size:_LENGTH.size + length]
+                          .decode('utf-8'), object_hook=decoder.hook)
+
+    def root(self):
+        contents = self.section(*self.contents)
+        if contents['kind'] == 'group':
+            return contents['group']
+        return Simulation(contents['top_group'], contents['stimuli'],
+                          contents['reports'])
+
+    def group(self, index):
+        group = self.groups.get(index)
+        if group is None:
+            group_id, offset, size = self.group_sections[index]
+            group = Group.__new__(Group)
+            group.__dict__['_id'] = _str(group_id)
+            # everything else is decoded when first asked for
+            group.__dict__['_pending'] = (self, offset, size)
+            self.groups[index] = group
+        return group
+
+    def load_group(self, group, offset, size):
+        group.__setstate__(self.section(offset, size))
+
+    def entity(self, index):
+        entity = self.entities.get(index)
+        if entity is None:
+            # decoding a chunk restores every entity in it, rows only
+            # refer to earlier ones so those are always available
+            chunk = bisect.bisect_right(self.firsts, index) - 1
+            self.section(*self.entity_sections[chunk][1:])
+            entity = self.entities[index]
+        return entity
+
+
+class _Arrays(object):
+
+    def __init__(self, data, start):
+        self.data = data
+        self.start = start
+
+    def get(self, dtype, offset, shape):
+        if numpy is None:
+            raise ValueError("this snapshot holds arrays, which need numpy")
+        dtype = numpy.dtype(str(dtype))
+        count = 1
+        for size in shape:
+            count *= size
+        array = numpy.frombuffer(self.data, dtype, count,
+                                 self.start + offset)
+        # frombuffer views are read only, entities own their arrays
+        return array.reshape(shape).copy()
+
+
+class _Decoder(object):
+    """ Turns the tagged values of a section back into objects as json
+    decodes them, innermost first """
+
+    def __init__(self, reader, arrays):
+        self.reader = reader
+        self.arrays = arrays
+
+    def hook(self, value):
+        value = _keys(value)
+        tag = value.get('#')
+        if tag is None:
+            return value
+        if tag == 'e':
+            return self.reader.entity(value['i'])
+        if tag == 'o':
+            return _restore(value['c'], value['s'])
+        if tag == 'r':
+            entity = _restore(value['c'], value['s'])
+            self.reader.entities[value['i']] = entity
+            return entity
+        if tag == 'g':
+            return self.reader.group(value['i'])
+        if tag == 'v':
+            cls = _VALUES[value['c']]
+            obj = cls.__new__(cls)
+            obj.__setstate__(value['s'])
+            return obj
+        if tag == 'c':
+            cls = _COLUMNS[value['c']]
+            obj = cls.__new__(cls)
+            obj.__dict__.update(value['s'])
+            return obj
+        if tag == 'd':
+            return dict((_str(k), v) for k, v in value['v'])
+        if tag == 't':
+            return tuple(value['v'])
+        if tag == 'a':
+            return self.arrays.get(value['t'], value['o'], value['s'])
+        raise ValueError("unknown snapshot value %s" % tag)
+
+
+def _restore(name, state):
+    """ Rebuilds an entity from its state without validating it """
+    cls = _ENTITIES[name]
+    entity = cls.__new__(cls)
+    if hasattr(cls, '__setstate__'):
+        entity.__setstate__(state)
+    else:
+        entity.__dict__.update(state)
+    return entity
+
+
+if sys.version_info[0] >= 3:
+    def _str(value):
+        return value
+
+    def _keys(value):
+        return value
+else:
+    def _str(value):
+        # json gives back unicode, the schemas check for str
+        if type(value) is unicode:  # noqa: F821
+            return value.encode('utf-8')
+        if type(value) is list:
+            return [_str(x) for x in value]
+        return value
+
+    def _keys(value):
+        return dict((_str(k), _str(v)) for k, v in value.items())
+
+
+def save(obj, path, compression='zlib'):
+    """ Saves a Simulation or a Group to path, a file name or a binary file
+    object. compression is 'zlib' or None. """
+    writer = _Writer(compression)
+    if hasattr(path, 'write'):
+        writer.write(obj, path)
+        return
+    # write to a temporary file first so a crash never truncates a snapshot
+    # that was already there
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        writer.write(obj, f)
+    if os.path.exists(path) and os.name == 'nt':
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def load(path):
+    """ Loads the Simulation or Group saved to path, a file name or a binary
+    file object. Groups are decoded as they're first used. A file name is
+    memory mapped rather than read, so only the header and the sections
+    that are used are read from disk, the mapping is released once no
+    group is left to decode. """
+    if hasattr(path, 'read'):
+        return _Reader(path.read()).root()
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            data = f.read()
+    return _Reader(data).root()
@@ -0,0 +1,114 @@
+import json
+import zlib
+
+# roughly how many bytes of JSON are gathered before a chunk is emitted
+CHUNK_SIZE = 64 * 1024
+
+# zlib window bits selecting the container for each content encoding
+_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS
+}
+
+_encode = json.JSONEncoder().encode
+
+
+def iterencode(top_group, entity_dicts, chunk_size=CHUNK_SIZE, cached=None):
+    """ Yields the transfer format for the entity dicts as JSON byte chunks.
+
+    The output decodes to the same document as
+    json.dumps(Simulator._process_entity_dicts(top_group, entity_dicts)), but
+    only one entity (or one nested item of a group) is converted to a dict
+    at a time. """
+    buf = []
+    size = 0
+    for piece in _iter_transfer_format(top_group, entity_dicts, cached):
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buf).encode('utf-8')
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf).encode('utf-8')
+
+
+def compress(chunks, content_encoding, level=6):
+    """ Compresses an iterable of byte chunks with 'gzip' or 'deflate' """
+    if content_encoding not in _WBITS:
+        raise ValueError("unsupported content encoding %s, acceptable "
+                         "encodings include %s" %
+                         (content_encoding, sorted(_WBITS)))
+    compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                  _WBITS[content_encoding])
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        # the compressor buffers internally, skip empty writes
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def dump(top_group, entity_dicts, fp, content_encoding=None,
+         chunk_size=CHUNK_SIZE, cached=None):
+    """ Writes the transfer format to a binary file object chunk by chunk """
+    chunks = iterencode(top_group, entity_dicts, chunk_size, cached)
+    if content_encoding is not None:
+        chunks = compress(chunks, content_encoding)
+    for chunk in chunks:
+        fp.write(chunk)
+
+
+def _iter_transfer_format(top_group, entity_dicts, cached):
+    yield '{"top_group": ' + _encode(top_group._id)
+    for entity_type, entities in entity_dicts.items():
+        yield ', ' + _encode(entity_type) + ': ['
+        for idx, entity in enumerate(entities.values()):
+            if idx:
+                yield ', '
+            for piece in _iter_entity(entity):
+                yield piece
+        yield ']'
+    if cached is not None:
+        yield ', "cached": ' + _encode(cached)
+    yield '}'
+
+
+def _iter_entity(entity):
+    # groups are the only entities whose dict grows with the model, so their
+    # nested lists are encoded one item at a time
+    spec_lists = getattr(entity, 'SPECIFICATION_LISTS', None)
+    if spec_lists is None:
+        yield _encode(entity.to_dict())
+        return
+    yield '{'
+    for key, value in _metadata(entity):
+        yield _encode(key) + ': ' + _encode(value) + ', '
+    yield '"specification": {"geometry": '
+    yield _encode(entity.geometry.to_dict())
+    for key, attr in spec_lists:
+        yield ', ' + _encode(key) + ': ['
+        for idx, item in enumerate(_iter_items(getattr(entity, attr))):
+            if idx:
+                yield ', '
+            yield item
+        yield ']'
+    yield '}}'
+
+
+def _iter_items(items):
+    for item in items:
+        # column blocks format their rows straight from their arrays
+        if hasattr(item, 'iterencode'):
+            for row in item.iterencode():
+                yield row
+        else:
+            yield _encode(item.to_dict())
+
+
+def _metadata(entity):
+    for param in entity.schema().metadata:
+        try:
+            yield param, getattr(entity, param)
+        except AttributeError:
+            continue
@@ -0,0 +1,278 @@
+""" Parameter sweeps that run many variants of one simulation.
+
+A Sweep varies parameters of the neurons, synapses, channels, stimuli and
+reports of a base simulation, over grids whose every combination is run
+and over lists of design points such as random samples. The base simulation
+is serialized once per run, or per call to variants(), so edits made to it
+in between are picked up. A variant is then only a patch of the parameters
+it changes. Its transfer format is a shallow copy
+of the shared document with the patched entities swapped in, and its JSON
+reuses the encoding of everything it doesn't change, so building a variant
+costs time in proportion to the patch rather than the model.
+
+Variants are built lazily and handed to a runner, anything with a
+run_transfer_format method such as a Simulator, a LocalSimulator or a
+Scheduler, with a bounded number in flight at a time. A daemon runs one
+simulation at a time and only acknowledges a submission, so a Simulator is
+given one variant at a time, each waited on until its run has finished.
+Spread a sweep over several daemons with a Scheduler.
+"""
+import itertools
+import json
+import threading
+from collections import OrderedDict
+
+import numpy
+
+from .pyncs import Simulator
+
+_encode = json.JSONEncoder().encode
+
+
+class _Axis(object):
+
+    def __init__(self, targets, names, rows):
+        # (entity, param) pairs set together, and what each is reported as
+        self.targets = targets
+        self.names = names
+        # one tuple of values per point, in target order
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class _Base(object):
+    """ The base simulation, serialized for a batch of variants """
+
+    def __init__(self, simulation, axes):
+        entity_dicts = Simulator._generate_entity_dicts(
+            simulation.top_group, simulation.stimuli, simulation.reports)
+        entity_dicts = Simulator._refresh_content_ids(entity_dicts)
+        self.document = Simulator._process_entity_dicts(simulation.top_group,
+                                                        entity_dicts)
+        positions = {}
+        for entity_type, entities in entity_dicts.items():
+            if entity_type == 'groups':
+                continue
+            for idx, entity_id in enumerate(entities):
+                positions[entity_id] = (entity_type, idx)
+        for axis in axes:
+            for entity, param in axis.targets:
+                if entity._id not in positions:
+                    raise ValueError("%s of %s can't be swept, only the "
+                                     "parameters of the simulation's "
+                                     "neurons, synapses, channels, stimuli "
+                                     "and reports can" % (param, entity._id))
+        self.encoded = OrderedDict(
+            (entity_type, [_encode(x) for x in self.document[entity_type]])
+            for entity_type in entity_dicts
+        )
+        self.positions = positions
+        self.attachments = Simulator._collect_attachments(entity_dicts)
+
+    def changes(self, patch):
+        """ Returns entity type -> {index: patched entity dict} """
+        changes = {}
+        for entity_id, params in patch.items():
+            entity_type, index = self.positions[entity_id]
+            entity = dict(self.document[entity_type][index])
+            spec = entity['specification'] = dict(entity['specification'])
+            spec.update(params)
+            changes.setdefault(entity_type, {})[index] = entity
+        return changes
+
+
+class Variant(object):
+    """ One point of a sweep """
+
+    def __init__(self, sweep, base, coordinates, values, patch):
+        self.sweep = sweep
+        # the serialized simulation the patch applies to
+        self.base = base
+        # index along every axis of the sweep, in the order they were added
+        self.coordinates = coordinates
+        # target name -> value
+        self.values = values
+        # entity _id -> {parameter: value as it appears in the spec}
+        self.patch = patch
+
+    def transfer_format(self):
+        """ Returns the variant's transfer format, which shares everything
+        it doesn't change with the base document, so it mustn't be
+        modified """
+        base = self.base.document
+        document = dict(base)
+        for entity_type, changes in self.base.changes(self.patch).items():
+            items = document[entity_type] = list(base[entity_type])
+            for index, entity in changes.items():
+                items[index] = entity
+        return document
+
+    def iterencode(self):
+        """ Yields the JSON encoding of transfer_format() in byte chunks,
+        re-encoding only the patched entities """
+        base = self.base
+        changes = base.changes(self.patch)
+        yield ('{"top_group": %s' % _encode(base.document['top_group'])
+               ).encode('utf-8')
+        for entity_type, encoded in base.encoded.items():
+            if entity_type in changes:
+                encoded = list(encoded)
+                for index, entity in changes[entity_type].items():
+                    encoded[index] = _encode(entity)
+            yield (', %s: [%s]' % (_encode(entity_type), ', '.join(encoded))
+                   ).encode('utf-8')
+        yield b'}'
+
+
+class Sweep(object):
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.axes = []
+        self._names = set()
+
+    def grid(self, entity, param, values, name=None):
+        """ Adds an axis setting param of entity to each of values in turn.
+        Every combination of values along the axes is run. """
+        values = _values(values)
+        return self._add([(entity, param)], [name or param],
+                         [(x,) for x in values])
+
+    def points(self, targets, values, names=None):
+        """ Adds an axis of design points. targets is a list of (entity,
+        param) pairs and values an (n, len(targets)) array with one row per
+        point, eg. from a random or Latin hypercube design. """
+        rows = [tuple(row) for row in _values(values)]
+        for row in rows:
+            if len(row) != len(targets):
+                raise ValueError("every point needs a value for each of the "
+                                 "%d targets" % len(targets))
+        return self._add(list(targets), names or [x[1] for x in targets],
+                         rows)
+
+    def random(self, targets, low, high, size, seed=None, names=None):
+        """ Adds an axis of size points drawn uniformly between low and high,
+        given per target or once for all of them """
+        rng = numpy.random.RandomState(seed)
+        values = rng.uniform(low, high, (size, len(targets)))
+        return self.points(targets, values, names)
+
+    @property
+    def shape(self):
+        return tuple(len(x) for x in self.axes)
+
+    def __len__(self):
+        size = 1
+        for axis in self.axes:
+            size *= len(axis)
+        return size
+
+    def variants(self):
+        """ Returns an iterator over every variant, the last axis varying
+        fastest, of the simulation as it is when this is called """
+        return self._variants(_Base(self.simulation, self.axes))
+
+    def _variants(self, base):
+        for coordinates in itertools.product(
+                *[range(len(x)) for x in self.axes]):
+            values = OrderedDict()
+            patch = {}
+            for axis, idx in zip(self.axes, coordinates):
+                row = axis.rows[idx]
+                for (entity, param), name, value in zip(axis.targets,
+                                                        axis.names, row):
+                    values[name] = value
+                    if hasattr(value, 'to_dict'):
+                        value = value.to_dict()
+                    patch.setdefault(entity._id, {})[param] = value
+            yield Variant(self, base, coordinates, values, patch)
+
+    def run(self, runner, concurrency=1, callback=None,
+            return_exceptions=False, timeout=None, **kwargs):
+        """ Runs every variant through runner.run_transfer_format, at most
+        concurrency at a time, and returns a dict of coordinates -> result.
+        kwargs are passed on to run_transfer_format. callback is called with
+        each variant and its result as they come in, from the worker
+        threads. With return_exceptions the exception a variant raised is
+        kept as its result, otherwise the first one stops the sweep and is
+        raised once the variants in flight are done. A Simulator runs one
+        variant at a time whatever concurrency is, and a variant's result
+        is the daemon's response once its run has finished, or the
+        SimulationError of a run still going after timeout seconds. """
+        # a daemon answers as soon as a run starts and turns down another
+        # until it's done
+        wait = isinstance(runner, Simulator)
+        if wait:
+            concurrency = 1
+        base = _Base(self.simulation, self.axes)
+        if base.attachments:
+            kwargs['attachments'] = base.attachments
+        variants = self._variants(base)
+        lock = threading.Lock()
+        results = {}
+        errors = []
+
+        def work():
+            while True:
+                with lock:
+                    variant = None if errors else next(variants, None)
+                if variant is None:
+                    return
+                try:
+                    if wait:
+                        # the daemon may be busy with someone else's run
+                        runner.wait_for_completion(timeout)
+                    result = runner.run_transfer_format(
+                        variant.transfer_format(),
+                        iterencode=variant.iterencode, **kwargs)
+                    if wait:
+                        runner.wait_for_completion(timeout)
+                except Exception as e:
+                    if not return_exceptions:
+                        with lock:
+                            errors.append(e)
+                        return
+                    result = e
+                with lock:
+                    results[variant.coordinates] = result
+                if callback is not None:
+                    callback(variant, result)
+        threads = [threading.Thread(target=work)
+                   for _ in range(max(1, concurrency))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def _add(self, targets, names, rows):
+        if len(names) != len(targets):
+            raise ValueError("expected a name for each of the %d targets" %
+                             len(targets))
+        for column, ((entity, param), name) in enumerate(zip(targets, names)):
+            if name in self._names:
+                raise ValueError("%s is already swept, give it another name"
+                                 % name)
+            # a swept entity keeps its _id in every variant, which would
+            # break the promise of a content addressed one
+            if entity.content_addressed:
+                raise ValueError("content addressed entities can't be swept")
+            schema = entity.schema()
+            for row in rows:
+                schema.validate(param, row[column])
+        self._names.update(names)
+        axis = _Axis(targets, names, rows)
+        self.axes.append(axis)
+        return axis
+
+
+def _values(values):
+    # plain python values, which is what the entity schemas accept
+    if hasattr(values, 'tolist'):
+        return values.tolist()
+    return [x.tolist() if hasattr(x, 'tolist') else x for x in values]
@@ -0,0 +1,80 @@
+""" Reports the memory used per entity for the high-cardinality types.
+
+Run with python -m pyncs.tests.bench_memory [count] """
+import gc
+import sys
+
+from pyncs.pyncs import (IzhNeuron, FlatSynapse, NeuronGroup, Connection,
+                         Geometry, Location)
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def _deep_size(obj, seen):
+    # fallback for interpreters without tracemalloc, counts everything the
+    # entity holds that isn't shared with another entity
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _deep_size(key, seen) + _deep_size(value, seen)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            size += _deep_size(value, seen)
+    if hasattr(obj, '__dict__'):
+        size += _deep_size(obj.__dict__, seen)
+    for cls in type(obj).__mro__:
+        for slot in cls.__dict__.get('__slots__', ()):
+            if slot != '__dict__' and hasattr(obj, slot):
+                size += _deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def bytes_per_entity(factory, count):
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        entities = [factory(idx) for idx in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        # don't charge the list holding the entities to them
+        return float(after - before - sys.getsizeof(entities)) / count
+    entities = [factory(idx) for idx in range(count)]
+    # shared objects (neurons, synapses, interned strings) are excluded
+    seen = set([id(neuron), id(synapse), id(label)])
+    return float(sum(_deep_size(x, seen) for x in entities)) / count
+
+
+neuron = IzhNeuron(a=0.02, b=0.2, c=-65.0, d=8.0, u=-13.0, v=-65.0,
+                   threshold=30.0)
+synapse = FlatSynapse(delay=1.0, current=10.0)
+label = 'group'
+
+FACTORIES = [
+    ('NeuronGroup', lambda idx: NeuronGroup(neuron=neuron, count=100,
+                                            label=label,
+                                            geometry=Geometry(),
+                                            location=Location())),
+    ('Connection', lambda idx: Connection(presynaptic=label,
+                                          postsynaptic=label,
+                                          probability=0.5,
+                                          synapse=synapse)),
+    ('IzhNeuron', lambda idx: IzhNeuron(a=0.02, b=0.2, c=-65.0, d=8.0,
+                                        u=-13.0, v=-65.0, threshold=30.0))
+]
+
+
+def main(count=100000):
+    for name, factory in FACTORIES:
+        print('%-12s %8.1f bytes per entity' %
+              (name, bytes_per_entity(factory, count)))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,175 @@
+""" End to end client benchmarks against the mock daemon.
+
+Builds synthetic models of increasing size and times each stage of a
+submission separately: building the entities, _generate_entity_dicts,
+_process_entity_dicts, JSON encoding (whole and streamed) and decoding,
+encoding and decoding the binary wire format, the upload round trip through
+Simulator.run and a delta upload that leaves out what the daemon already
+holds. Results are printed and, with --output, written as JSON so runs can
+be compared across releases.
+
+Run with python -m pyncs.tests.benchmark [--sizes 100 1000 ...]
+[--repeat N] [--latency SECONDS] [--output results.json] """
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from pyncs import streaming, wire
+from pyncs.manifest import Manifest
+from pyncs.pyncs import (IzhNeuron, FlatSynapse, NeuronGroup, Connection,
+                         Group, SubGroup, Geometry, Location, Simulation,
+                         Simulator, RectCurrentStimulus, Report)
+from pyncs.tests.mock_daemon import MockDaemon
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+SIZES = [10 ** x for x in range(2, 7)]
+# neuron groups per synthetic group, each with its own neuron, synapse and
+# connection, so a group holds about 4 * GROUP_WIDTH entities
+GROUP_WIDTH = 25
+
+
+def synthetic_model(entities):
+    """ Builds a Simulation of roughly the given number of entities """
+    subgroups = []
+    for group_idx in range(max(1, entities // (4 * GROUP_WIDTH))):
+        neuron_groups = []
+        connections = []
+        for idx in range(GROUP_WIDTH):
+            # distinct parameters so no two entities are identical
+            neuron = IzhNeuron(a=0.02 + 1e-6 * idx, b=0.2, c=-65.0, d=8.0,
+                               u=-13.0, v=-65.0, threshold=30.0)
+            synapse = FlatSynapse(delay=1.0 + idx, current=10.0)
+            neuron_groups.append(NeuronGroup(neuron=neuron, count=100,
+                                             label='n%d' % idx,
+                                             geometry=Geometry(),
+                                             location=Location()))
+            connections.append(Connection(
+                presynaptic='n%d' % idx,
+                postsynaptic='n%d' % ((idx + 1) % GROUP_WIDTH),
+                probability=0.1, synapse=synapse))
+        group = Group(subgroups=[], neuron_groups=neuron_groups,
+                      neuron_aliases=[], synapse_aliases=[],
+                      connections=connections)
+        subgroups.append(SubGroup(group=group, label='g%d' % group_idx))
+    top = Group(entity_name='top', subgroups=subgroups, neuron_groups=[],
+                neuron_aliases=[], synapse_aliases=[], connections=[])
+    stimulus = RectCurrentStimulus(amplitude=10.0, width=2, frequency=10,
+                                   probability=0.5, time_start=0,
+                                   time_end=1, destinations=['g0:n0'])
+    report = Report(report_method=Report.METHOD_FILE,
+                    report_type=Report.TYPE_NEURON, report_target=['g0:n1'],
+                    probability=0.1, time_start=0.0, time_end=1.0)
+    return Simulation(top, [stimulus], [report])
+
+
+def _time(func, *args):
+    start = _timer()
+    result = func(*args)
+    return _timer() - start, result
+
+
+def bench(entities, simulator):
+    result = {'entities': entities}
+    result['construct'], simulation = _time(synthetic_model, entities)
+    result['generate_entity_dicts'], entity_dicts = _time(
+        simulator._generate_entity_dicts, simulation.top_group,
+        simulation.stimuli, simulation.reports)
+    result['process_entity_dicts'], transfer_format = _time(
+        simulator._process_entity_dicts, simulation.top_group, entity_dicts)
+    result['json_dumps'], payload = _time(json.dumps, transfer_format)
+    result['payload_bytes'] = len(payload)
+    result['json_loads'], _ = _time(json.loads, payload)
+    result['wire_dumps'], payload = _time(wire.dumps, transfer_format)
+    result['wire_bytes'] = len(payload)
+    result['wire_loads'], _ = _time(wire.loads, payload)
+    result['sent_entities'] = sum(len(x) for x in entity_dicts.values())
+    del transfer_format, payload
+    result['streaming_encode'], _ = _time(
+        lambda: sum(len(x) for x in streaming.iterencode(
+            simulation.top_group, entity_dicts)))
+    result['upload_round_trip'], _ = _time(simulator.run, simulation)
+    result.update(bench_delta(entities, simulator))
+    return result
+
+
+def bench_delta(entities, simulator):
+    """ Times resubmitting a model whose neurons and synapses are content
+    addressed and already on the daemon, so only their ids are sent """
+    result = {}
+    delta = Simulator(simulator.host, simulator.port, simulator.username,
+                      simulator.password, transport=simulator.transport,
+                      manifest=Manifest(),
+                      content_addressed=(IzhNeuron, FlatSynapse))
+    simulation = synthetic_model(entities)
+    # the first upload sends everything and fills in the manifest
+    delta.run(simulation)
+    result['delta_round_trip'], _ = _time(delta.run, simulation)
+    result['cached_entities'] = len(delta.manifest)
+    return result
+
+
+def _git_revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes=SIZES, repeat=1, latency=0.0):
+    """ Returns the benchmark document, keeping the fastest of repeat runs
+    of each stage """
+    results = []
+    with MockDaemon(latency=latency) as daemon:
+        simulator = Simulator(daemon.host, daemon.port, 'bench', 'bench')
+        # keep the login out of the first round trip
+        simulator.authenticate()
+        for entities in sizes:
+            runs = [bench(entities, simulator) for _ in range(repeat)]
+            best = runs[0]
+            for key in best:
+                if isinstance(best[key], float):
+                    best[key] = min(x[key] for x in runs)
+            results.append(best)
+            print('%8d entities %s' % (entities, ' '.join(
+                '%s=%.4f' % (key, value) for key, value in sorted(best.items())
+                if isinstance(value, float))))
+        simulator.close()
+    return {
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'revision': _git_revision(),
+        # the msgpack C extension decodes wire payloads when it's installed
+        'wire_decoder': 'python' if wire.msgpack is None else 'msgpack',
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'repeat': repeat,
+        'latency': latency,
+        'results': results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the mock daemon adds to each response')
+    parser.add_argument('--output', help='file to write JSON results to')
+    args = parser.parse_args(argv)
+    document = run(args.sizes, args.repeat, args.latency)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+""" Fixtures shared by the tests """
+import pytest
+
+from pyncs.pyncs import IzhNeuron, FlatSynapse, Group, Simulator
+
+
+@pytest.fixture
+def izh():
+    """ Makes Izhikevich neurons, regular spiking unless told otherwise """
+    def make(**params):
+        values = dict(a=0.02, b=0.2, c=-65.0, d=8.0, u=-13.0, v=-65.0,
+                      threshold=30.0)
+        values.update(params)
+        return IzhNeuron(**values)
+    return make
+
+
+@pytest.fixture
+def flat():
+    """ Makes flat synapses """
+    def make(**params):
+        values = dict(delay=1.0, current=5.0)
+        values.update(params)
+        return FlatSynapse(**values)
+    return make
+
+
+@pytest.fixture
+def group():
+    """ Makes groups, with empty lists for whatever isn't given """
+    def make(neuron_groups=(), subgroups=(), connections=(),
+             neuron_aliases=(), synapse_aliases=(), **kwargs):
+        return Group(neuron_groups=list(neuron_groups),
+                     subgroups=list(subgroups),
+                     connections=list(connections),
+                     neuron_aliases=list(neuron_aliases),
+                     synapse_aliases=list(synapse_aliases), **kwargs)
+    return make
+
+
+@pytest.fixture
+def transfer_format():
+    """ Builds the document a Simulator sends for a simulation """
+    def build(simulation):
+        top = simulation.top_group
+        return Simulator._process_entity_dicts(
+            top, Simulator._refresh_content_ids(
+                Simulator._generate_entity_dicts(top, simulation.stimuli,
+                                                 simulation.reports)))
+    return build
@@ -0,0 +1,360 @@
+""" Self contained stand-in for an NCS daemon.
+
+Implements POST /ncs/api/login, POST /ncs/api/sim and GET /ncs/api/sim well
+enough for the client to be exercised end to end without a real server.
+Uploads are decoded (chunked, gzip and deflate included) and parsed, and a
+run stays 'running' for run_time seconds. latency is added to every
+response. Payloads in the binary wire format are accepted unless binary is
+False, in which case they're refused with a 415 like an older daemon, and
+the same goes for multipart uploads with attachments and multipart. Every
+attachment a spec refers to has to arrive with it, and like a real daemon
+it keeps the _id of every entity it's sent, so a spec listing ids as
+'cached' is refused unless they were all sent before. Requests larger than
+max_body bytes are refused with a 413, and unless chunked is False specs
+can be sent in chunks instead, see the upload module.
+
+Run with python -m pyncs.tests.mock_daemon [port] to serve in the
+foreground. """
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+import zlib
+
+from pyncs import attachments, wire
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS
+}
+
+
+_CHUNK_PATH = re.compile(r'^/ncs/api/upload/([0-9a-f]+)/(\d+)$')
+_COMMIT_PATH = re.compile(r'^/ncs/api/upload/([0-9a-f]+)/commit$')
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockDaemon(object):
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, run_time=0.0,
+                 username=None, password=None, token_ttl=None, binary=True,
+                 multipart=True, max_body=None, chunked=True):
+        # seconds added to every response
+        self.latency = latency
+        # seconds a submitted run stays 'running'
+        self.run_time = run_time
+        # credentials to accept, None accepts any
+        self.username = username
+        self.password = password
+        # seconds a token is valid for, None never expires
+        self.token_ttl = token_ttl
+        self.binary = binary
+        self.multipart = multipart
+        # largest request body accepted, None accepts any
+        self.max_body = max_body
+        self.chunked = chunked
+        # sha256 of a spec being uploaded in chunks -> _Upload
+        self.uploads = {}
+        self.tokens = {}
+        self.runs_until = 0.0
+        # what the daemon has been sent, for tests to inspect
+        self.requests = []
+        self.simulations = []
+        # attachment name -> the arrays it held
+        self.attachments = {}
+        # _id of every entity received, which later specs may leave out
+        self.entity_ids = set()
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+        self.server = _Server((host, port), _handler(self))
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def status(self):
+        return 'running' if time.time() < self.runs_until else 'idle'
+
+    def login(self, credentials):
+        if ((self.username is not None and
+             credentials.get('username') != self.username) or
+                (self.password is not None and
+                 credentials.get('password') != self.password)):
+            return {}
+        with self.lock:
+            token = '%032x' % len(self.tokens)
+            self.tokens[token] = (None if self.token_ttl is None
+                                  else time.time() + self.token_ttl)
+        return {'token': token}
+
+    def valid(self, token):
+        if token not in self.tokens:
+            return False
+        expires = self.tokens[token]
+        return expires is None or expires > time.time()
+
+    def submit(self, simulation, attached=None):
+        # entities left out have to be ones the daemon already holds
+        unknown = [x for x in simulation.get('cached') or ()
+                   if x not in self.entity_ids]
+        if unknown:
+            return 400, {'message': 'unknown cached entities %s' %
+                                    ', '.join(unknown[:5]),
+                         'unknown': unknown}
+        # every explicit connection has to come with its arrays
+        arrays = {}
+        for group in simulation.get('groups', []):
+            for connection in group['specification']['connections']:
+                if 'edges' not in connection:
+                    continue
+                reference = connection['edges']
+                name = reference['attachment']
+                if name not in (attached or {}):
+                    return 400, {'message': 'attachment %s is missing' % name}
+                try:
+                    arrays[name] = attachments.arrays(reference,
+                                                      attached[name])
+                except ValueError as e:
+                    return 400, {'message': str(e)}
+        with self.lock:
+            if self.status == 'running':
+                return 409, {'message': 'a simulation is already running'}
+            self.simulations.append(simulation)
+            self.attachments.update(arrays)
+            self.entity_ids.update(
+                x['_id'] for key, value in simulation.items()
+                if key != 'cached' and isinstance(value, list)
+                for x in value)
+            self.runs_until = time.time() + self.run_time
+        counts = dict((key, len(value)) for key, value in simulation.items()
+                      if isinstance(value, list))
+        return 200, {'status': 'running', 'entities': counts}
+
+    def start_upload(self, manifest):
+        upload_id = manifest['sha256']
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+            # the same spec cut up differently can't reuse any chunks
+            if (upload is None or manifest.get('restart') or
+                    upload.manifest['chunks'] != manifest['chunks']):
+                upload = self.uploads[upload_id] = _Upload(manifest)
+            received = sorted(upload.chunks)
+        return 200, {'upload': upload_id, 'received': received}
+
+    def put_chunk(self, upload_id, index, data):
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return 404, {'message': 'unknown upload %s' % upload_id}
+        hashes = upload.manifest['chunks']
+        if index >= len(hashes):
+            return 400, {'message': 'chunk %d out of range' % index}
+        if hashlib.sha256(data).hexdigest() != hashes[index]:
+            return 400, {'message': "chunk %d doesn't match its hash" %
+                                    index}
+        with self.lock:
+            upload.chunks[index] = data
+        return 200, {'received': index}
+
+    def commit_upload(self, upload_id):
+        """ Returns the content type, content encoding and body of a
+        complete upload, or an error response """
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return 404, {'message': 'unknown upload %s' % upload_id}
+        manifest = upload.manifest
+        missing = [idx for idx in range(len(manifest['chunks']))
+                   if idx not in upload.chunks]
+        if missing:
+            return 409, {'message': 'upload is missing %d chunks' %
+                                    len(missing), 'missing': missing}
+        body = b''.join(upload.chunks[idx] for idx in
+                        range(len(manifest['chunks'])))
+        if hashlib.sha256(body).hexdigest() != manifest['sha256']:
+            return 400, {'message': "upload doesn't match its hash"}
+        with self.lock:
+            self.uploads.pop(upload_id, None)
+        return (manifest.get('content_type') or '',
+                manifest.get('content_encoding'), body)
+
+
+class _Upload(object):
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        # index -> bytes of every chunk received so far
+        self.chunks = {}
+
+
+def _handler(daemon):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # headers and body go out in separate writes, without this the
+        # client's delayed ACKs add 40ms to every response
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            daemon.requests.append(('GET', url.path))
+            if url.path != '/ncs/api/sim':
+                return self._send(404, {'message': 'not found'})
+            if not daemon.valid(self.headers.get('token')):
+                return self._send(401, {'message': 'invalid token'})
+            # long poll when asked to
+            wait = float(parse_qs(url.query).get('wait', ['0'])[0])
+            deadline = time.time() + wait
+            while daemon.status == 'running' and time.time() < deadline:
+                time.sleep(min(0.005, deadline - time.time()))
+            self._send(200, {'status': daemon.status})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            daemon.requests.append(('POST', url.path))
+            body = self._body()
+            if body is None:
+                return
+            if url.path == '/ncs/api/login':
+                return self._send(200, daemon.login(json.loads(
+                    body.decode('utf-8'))))
+            if url.path == '/ncs/api/upload' and daemon.chunked:
+                if not daemon.valid(self.headers.get('token')):
+                    return self._send(401, {'message': 'invalid token'})
+                try:
+                    manifest = json.loads(body.decode('utf-8'))
+                except ValueError as e:
+                    return self._send(400, {'message': str(e)})
+                return self._send(*daemon.start_upload(manifest))
+            commit = _COMMIT_PATH.match(url.path)
+            if commit is not None and daemon.chunked:
+                if not daemon.valid(self.headers.get('token')):
+                    return self._send(401, {'message': 'invalid token'})
+                result = daemon.commit_upload(commit.group(1))
+                if len(result) == 2:
+                    return self._send(*result)
+                content_type, encoding, body = result
+                if encoding in _WBITS:
+                    body = zlib.decompress(body, _WBITS[encoding])
+                return self._submit(content_type, body)
+            if url.path != '/ncs/api/sim':
+                return self._send(404, {'message': 'not found'})
+            if not daemon.valid(self.headers.get('token')):
+                return self._send(401, {'message': 'invalid token'})
+            self._submit(self.headers.get('Content-Type', ''), body)
+
+        def do_PUT(self):
+            url = urlparse(self.path)
+            daemon.requests.append(('PUT', url.path))
+            body = self._body(decode=False)
+            if body is None:
+                return
+            chunk = _CHUNK_PATH.match(url.path)
+            if chunk is None or not daemon.chunked:
+                return self._send(404, {'message': 'not found'})
+            if not daemon.valid(self.headers.get('token')):
+                return self._send(401, {'message': 'invalid token'})
+            self._send(*daemon.put_chunk(chunk.group(1),
+                                         int(chunk.group(2)), body))
+
+        def _submit(self, content_type, body):
+            unsupported = {'message': 'unsupported content type %s' %
+                                      content_type}
+            attached = None
+            try:
+                if content_type.startswith(attachments.CONTENT_TYPE):
+                    if not daemon.multipart:
+                        return self._send(415, unsupported)
+                    content_type, body, attached = attachments.decode(
+                        body, content_type)
+                if content_type == wire.CONTENT_TYPE and daemon.binary:
+                    simulation = wire.loads(body)
+                elif content_type == 'application/json':
+                    simulation = json.loads(body.decode('utf-8'))
+                else:
+                    return self._send(415, unsupported)
+            except ValueError as e:
+                return self._send(400, {'message': str(e)})
+            self._send(*daemon.submit(simulation, attached))
+
+        def _body(self, decode=True):
+            """ Reads the request body, or answers with a 413 and returns
+            None if it's larger than max_body """
+            if self.headers.get('Transfer-Encoding') == 'chunked':
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    if not size:
+                        self.rfile.readline()
+                        break
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                body = b''.join(chunks)
+            else:
+                body = self.rfile.read(
+                    int(self.headers.get('Content-Length', 0)))
+            with daemon.lock:
+                daemon.bytes_received += len(body)
+            if daemon.max_body is not None and len(body) > daemon.max_body:
+                self._send(413, {'message': 'request body too large'})
+                return None
+            encoding = self.headers.get('Content-Encoding')
+            if decode and encoding in _WBITS:
+                body = zlib.decompress(body, _WBITS[encoding])
+            return body
+
+        def _send(self, code, payload):
+            if daemon.latency:
+                time.sleep(daemon.latency)
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def main(port=8000):
+    daemon = MockDaemon(port=port)
+    print('mock daemon listening on %s:%s' % (daemon.host, daemon.port))
+    try:
+        daemon.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
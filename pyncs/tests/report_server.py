@@ -0,0 +1,97 @@
+""" Local stand-in for a daemon's socket report stream.
+
+Run with python -m pyncs.tests.report_server [steps] [width] to check a
+ReportReceiver against it and report the decode throughput. """
+import random
+import socket
+import sys
+import threading
+import time
+
+import numpy
+
+from pyncs.reports import (HEADER, MAGIC, VERSION, ReportReceiver,
+                           frame_dtype)
+
+
+class ReportServer(object):
+    """ Serves the same frames to every connection on an ephemeral localhost
+    port. Writes are split at random offsets so receivers see frames cut in
+    half, the way a real network delivers them. """
+
+    def __init__(self, steps, values, max_write=8192, seed=None):
+        self.frames = (HEADER.pack(MAGIC, VERSION, values.shape[1]) +
+                       _frames(steps, values))
+        self.max_write = max_write
+        self.random = random.Random(seed)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.host, self.port = self.sock.getsockname()
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            thread = threading.Thread(target=self._send, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _send(self, conn):
+        data = memoryview(self.frames)
+        try:
+            while len(data):
+                size = self.random.randint(1, self.max_write)
+                conn.sendall(data[:size])
+                data = data[size:]
+        except socket.error:
+            # the receiver hung up early
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _frames(steps, values):
+    frames = numpy.zeros(len(steps), dtype=frame_dtype(values.shape[1]))
+    frames['step'] = steps
+    frames['values'] = values
+    return frames.tobytes()
+
+
+def main(steps=20000, width=1000):
+    values = numpy.random.RandomState(0).rand(steps, width).astype('f4')
+    with ReportServer(numpy.arange(steps), values,
+                      max_write=1 << 16) as server:
+        with ReportReceiver(server.host, server.port) as receiver:
+            start = time.time()
+            total = numpy.zeros(width)
+            count = 0
+            for batch_steps, batch_values in receiver:
+                total += batch_values.sum(axis=0)
+                count += len(batch_steps)
+            elapsed = time.time() - start
+    assert count == steps and numpy.allclose(total, values.sum(axis=0),
+                                             rtol=1e-4)
+    print('%d frames of %d values in %.3fs, %.1f MB/s' %
+          (count, width, elapsed, count * (width + 1) * 4 / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
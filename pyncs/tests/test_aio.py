@@ -0,0 +1,83 @@
+""" The asyncio client """
+import asyncio
+import time
+
+import pytest
+
+from pyncs.aio import AsyncSimulator, wait_for_all
+from pyncs.polling import Backoff
+from pyncs.pyncs import SimulationError
+from pyncs.tests.benchmark import synthetic_model
+from pyncs.tests.mock_daemon import MockDaemon
+
+
+def client(daemon, **kwargs):
+    return AsyncSimulator(daemon.host, daemon.port, 'u', 'p', **kwargs)
+
+
+def test_runs_a_simulation():
+    async def main(daemon):
+        async with client(daemon) as simulator:
+            result = await simulator.run(synthetic_model(100))
+            return result, await simulator.get_status()
+    with MockDaemon(run_time=5) as daemon:
+        result, status = asyncio.run(main(daemon))
+        assert len(daemon.simulations) == 1
+    assert result['status'] == status == AsyncSimulator.STATUS_RUNNING
+
+
+def test_run_many_keeps_errors_as_results():
+    async def main(daemon):
+        async with client(daemon) as simulator:
+            # the daemon runs one simulation at a time and turns the
+            # others down
+            return await simulator.run_many(
+                [synthetic_model(100) for _ in range(3)],
+                return_exceptions=True)
+    with MockDaemon(run_time=5) as daemon:
+        results = asyncio.run(main(daemon))
+    errors = [x for x in results if isinstance(x, SimulationError)]
+    assert len(errors) == 2 and len(results) == 3
+
+
+def test_waits_for_completion():
+    async def main(daemons):
+        simulators = [client(x) for x in daemons]
+        for simulator in simulators:
+            await simulator.run(synthetic_model(100))
+        started = time.time()
+        await wait_for_all(simulators, timeout=5)
+        elapsed = time.time() - started
+        for simulator in simulators:
+            await simulator.close()
+        return elapsed
+    with MockDaemon(run_time=0.3) as a, MockDaemon(run_time=0.3) as b:
+        elapsed = asyncio.run(main([a, b]))
+        assert a.status == b.status == 'idle'
+    # waited on together rather than one after the other
+    assert 0.1 < elapsed < 0.6 + 0.5
+
+
+def test_waiting_times_out():
+    async def main(daemon):
+        async with client(daemon) as simulator:
+            await simulator.run(synthetic_model(100))
+            await simulator.wait_for_completion(
+                timeout=0.2, backoff=Backoff(initial=0.05, maximum=0.05))
+    with MockDaemon(run_time=5) as daemon:
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(main(daemon))
+
+
+def test_waiting_can_be_cancelled():
+    async def main(daemon):
+        async with client(daemon) as simulator:
+            await simulator.run(synthetic_model(100))
+            task = asyncio.ensure_future(simulator.wait_for_completion(
+                backoff=Backoff(initial=0.05, maximum=0.05)))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+    with MockDaemon(run_time=5) as daemon:
+        asyncio.run(main(daemon))
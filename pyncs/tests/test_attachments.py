@@ -0,0 +1,126 @@
+""" Explicit connectivity and the attachments it's uploaded in """
+import numpy
+import pytest
+
+from pyncs import attachments
+from pyncs.pyncs import (NeuronGroup, Connection, SparseConnection, Alias,
+                         Simulation, Simulator, EntityError)
+from pyncs.tests.mock_daemon import MockDaemon
+
+
+@pytest.fixture
+def sparse(flat):
+    """ Makes a connection from a to b out of (pre, post) edges """
+    def make(pre=(0, 2, 0, 3), post=(1, 4, 0, 2), **kwargs):
+        return Connection.from_edges('a', 'b', flat(), pre, post, **kwargs)
+    return make
+
+
+@pytest.fixture
+def simulation(izh, group):
+    """ Places a connection between neuron groups a, of 4, and b, of 5 """
+    def make(connection):
+        top = group(neuron_groups=[NeuronGroup(neuron=izh(), count=4,
+                                               label='a'),
+                                   NeuronGroup(neuron=izh(), count=5,
+                                               label='b')],
+                    neuron_aliases=[Alias(alias='ab', labels=['a', 'b'],
+                                          aliases=[])],
+                    connections=[connection])
+        return Simulation(top, [], [])
+    return make
+
+
+def test_edges_become_rows_of_postsynaptic_indices(sparse):
+    connection = sparse(weights=[0.1, 0.2, 0.3, 0.4])
+    assert connection.indptr.tolist() == [0, 2, 2, 3, 4]
+    # edges keep their order within a row
+    assert connection.indices.tolist() == [1, 0, 4, 2]
+    assert connection.weights.tolist() == [0.1, 0.3, 0.2, 0.4]
+    assert connection.delays is None and connection.edges == 4
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(indptr=[0, 2], indices=[1]),
+    dict(indptr=[1, 2], indices=[1]),
+    dict(indptr=[0, 2, 1], indices=[1, 2]),
+    dict(indptr=[0, 1], indices=[-1]),
+    dict(indptr=[0, 1], indices=[1], weights=[0.5, 0.5]),
+    dict(indptr=[0.0, 1.0], indices=[1]),
+])
+def test_inconsistent_arrays_are_refused(flat, kwargs):
+    with pytest.raises((EntityError, TypeError)):
+        SparseConnection(presynaptic='a', postsynaptic='b', synapse=flat(),
+                         **kwargs)
+
+
+def test_arrays_round_trip_through_an_attachment(sparse):
+    # big endian and unaligned sizes come back little endian and aligned
+    connection = sparse(weights=numpy.array([1, 2, 3, 4], dtype='>f8'),
+                        delays=numpy.array([1, 2, 3, 4], dtype='<i2'))
+    attachment = connection.attachment()
+    data = b''.join(bytes(x) for x in attachment.chunks())
+    assert len(data) == attachment.size
+    assert all(x['offset'] % attachments.ALIGNMENT == 0
+               for x in attachment.layout.values())
+    decoded = attachments.arrays(attachment.describe(), data)
+    for name in ('indptr', 'indices', 'weights', 'delays'):
+        assert numpy.array_equal(decoded[name], getattr(connection, name))
+    assert decoded['weights'].dtype.str == '<f8'
+    with pytest.raises(ValueError):
+        attachments.arrays(attachment.describe(), data[:-8])
+
+
+def test_a_multipart_body_splits_back_into_its_parts(sparse):
+    parts = [sparse().attachment(), sparse(pre=[1], post=[3]).attachment()]
+    boundary = attachments.derived_boundary([b'{"a": 1}'], parts)
+    content_type = attachments.content_type('application/json', boundary)
+    body = b''.join(bytes(x) for x in attachments.encode(
+        [b'{"a": ', b'1}'], 'application/json', parts, boundary))
+    payload_type, payload, attached = attachments.decode(body, content_type)
+    assert payload_type == 'application/json' and payload == b'{"a": 1}'
+    assert sorted(attached) == sorted(x.name for x in parts)
+    for part in parts:
+        assert attached[part.name] == b''.join(bytes(x)
+                                               for x in part.chunks())
+    with pytest.raises(ValueError):
+        attachments.decode(body[:len(body) // 2], content_type)
+
+
+@pytest.mark.parametrize('edges', [
+    # row 4 is past the 4 neurons of a
+    dict(pre=[4], post=[0]),
+    # neuron 5 is past the 5 neurons of b
+    dict(pre=[0], post=[5]),
+])
+def test_edges_are_checked_against_the_neuron_groups(sparse, simulation,
+                                                     edges):
+    with MockDaemon() as daemon:
+        simulator = Simulator(daemon.host, daemon.port, 'u', 'p')
+        with pytest.raises(EntityError):
+            simulator.run(simulation(sparse(**edges)))
+        assert daemon.simulations == []
+
+
+def test_edges_join_two_neuron_groups(flat, simulation):
+    connection = Connection.from_edges('ab', 'b', flat(), [0], [0])
+    with pytest.raises(EntityError):
+        Simulator._generate_entity_dicts(simulation(connection).top_group,
+                                         [], [])
+
+
+@pytest.mark.parametrize('wire_format', ['json', 'binary'])
+def test_the_daemon_receives_the_arrays(sparse, simulation, wire_format):
+    connection = sparse(weights=[0.1, 0.2, 0.3, 0.4])
+    with MockDaemon() as daemon:
+        Simulator(daemon.host, daemon.port, 'u', 'p',
+                  wire_format=wire_format).run(simulation(connection))
+        sent, = daemon.simulations
+        received = daemon.attachments[connection._id]
+    spec, = [x['specification'] for x in sent['groups']]
+    edges = spec['connections'][0]['edges']
+    assert edges['format'] == 'csr' and edges['count'] == 4
+    assert edges['attachment'] == connection._id
+    for name in ('indptr', 'indices', 'weights'):
+        assert numpy.array_equal(received[name], getattr(connection, name))
+    assert 'delays' not in received
@@ -0,0 +1,101 @@
+""" Content addressed ids and delta uploads """
+import pytest
+
+from pyncs.manifest import Manifest
+from pyncs.pyncs import (IzhNeuron, FlatSynapse, NeuronGroup, Connection,
+                         Simulation, Simulator, SimulationError)
+from pyncs.tests.mock_daemon import MockDaemon
+
+
+# what the simulators under test derive ids from
+ADDRESSED = (IzhNeuron, FlatSynapse)
+
+
+def simulator(daemon, manifest):
+    return Simulator(daemon.host, daemon.port, 'u', 'p', manifest=manifest,
+                     content_addressed=ADDRESSED)
+
+
+@pytest.fixture
+def model(group, flat):
+    """ Makes a simulation of one neuron group connected to itself """
+    def make(neuron):
+        return Simulation(group(
+            neuron_groups=[NeuronGroup(neuron=neuron, count=10, label='a')],
+            connections=[Connection(presynaptic='a', postsynaptic='a',
+                                    probability=0.5, synapse=flat())]),
+            [], [])
+    return make
+
+
+def test_identical_entities_share_a_content_id(izh):
+    assert izh().content_id() == izh().content_id()
+    assert izh().content_id() != izh(a=0.03).content_id()
+
+
+def test_ids_are_random_by_default(izh):
+    assert izh()._id != izh()._id
+
+
+def test_refresh_id_follows_edits(izh):
+    neuron = izh()
+    neuron.a = 0.03
+    neuron.refresh_id()
+    assert neuron._id == izh(a=0.03).content_id()
+
+
+def test_group_id_covers_referenced_ids(izh, model):
+    neuron = izh()
+    neuron.refresh_id()
+    simulation = model(neuron)
+    before = simulation.top_group.content_id()
+    neuron.a = 0.03
+    neuron.refresh_id()
+    assert simulation.top_group.content_id() != before
+
+
+def test_simulators_address_only_what_theyre_told(izh, model):
+    neurons = [izh(), izh()]
+    with MockDaemon() as daemon:
+        Simulator(daemon.host, daemon.port, 'u', 'p').run(model(neurons[0]))
+        simulator(daemon, None).run(model(neurons[1]))
+        plain, addressed = [x['neurons'][0]['_id']
+                            for x in daemon.simulations]
+    assert addressed == neurons[1]._id == izh().content_id()
+    assert plain == neurons[0]._id != addressed
+    assert not IzhNeuron.content_addressed
+
+
+def test_delta_upload_leaves_out_cached_entities(izh, model):
+    simulation = model(izh())
+    with MockDaemon() as daemon:
+        manifest = Manifest()
+        delta = simulator(daemon, manifest)
+        delta.run(simulation)
+        assert len(manifest) == 2
+        delta.run(simulation)
+        sent = daemon.simulations[-1]
+        assert sorted(sent['cached']) == sorted(manifest)
+        assert sent['neurons'] == [] and sent['synapses'] == []
+
+
+def test_daemon_refuses_unknown_cached_ids(izh, model):
+    simulation = model(izh())
+    manifest = Manifest()
+    with MockDaemon() as daemon:
+        simulator(daemon, manifest).run(simulation)
+    # a restarted daemon has forgotten everything it was sent
+    with MockDaemon() as daemon:
+        with pytest.raises(SimulationError):
+            simulator(daemon, manifest).run(simulation)
+
+
+def test_a_saved_manifest_replaces_the_last_one(tmpdir):
+    path = str(tmpdir.join('manifest'))
+    manifest = Manifest(path)
+    manifest.update(['a', 'b'])
+    manifest.save()
+    manifest.add('c')
+    manifest.save()
+    assert sorted(Manifest(path)) == ['a', 'b', 'c']
+    assert not tmpdir.join('manifest.tmp').exists()
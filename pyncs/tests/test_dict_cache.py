@@ -0,0 +1,152 @@
+""" Cached to_dict results and what invalidates them """
+import copy
+
+import pytest
+
+from pyncs.pyncs import (IzhNeuron, NeuronGroup, Connection, SubGroup, Alias,
+                         Group, Normal, Geometry)
+
+
+@pytest.fixture
+def neuron(izh):
+    return izh(v=Normal(-65.0, 3.0))
+
+
+@pytest.fixture
+def top(group, flat, neuron):
+    return group(
+        neuron_groups=[NeuronGroup(neuron=neuron, count=10, label='a')],
+        connections=[Connection(presynaptic='a', postsynaptic='a',
+                                probability=0.5, synapse=flat())])
+
+
+def spec(entity):
+    return entity.to_dict()['specification']
+
+
+def test_unchanged_entities_return_the_cached_dict(neuron, top):
+    assert neuron.to_dict() is neuron.to_dict()
+    assert top.to_dict() is top.to_dict()
+
+
+def test_setting_an_attribute_rebuilds_the_dict(neuron):
+    before = neuron.to_dict()
+    neuron.a = 0.03
+    assert neuron.to_dict() is not before
+    assert spec(neuron)['a'] == 0.03
+
+
+def test_editing_a_nested_value_rebuilds_the_dict(neuron, top):
+    top.to_dict()
+    neuron.v.mean = -60.0
+    top.geometry.width = 2.0
+    assert spec(neuron)['v']['mean'] == -60.0
+    assert spec(top)['geometry']['width'] == 2.0
+
+
+def test_editing_an_item_rebuilds_its_group(top):
+    top.to_dict()
+    top.neuron_groups[0].count = 20
+    assert spec(top)['neuron_groups'][0]['count'] == 20
+
+
+def test_lists_edited_in_place_rebuild_their_group(neuron, top):
+    top.to_dict()
+    top.neuron_groups.append(NeuronGroup(neuron=neuron, count=5, label='b'))
+    top.neuron_aliases.append(Alias(alias='ab', labels=['a', 'b'],
+                                    aliases=[]))
+    assert [x['label'] for x in spec(top)['neuron_groups']] == ['a', 'b']
+    assert spec(top)['neuron_aliases'][0]['alias'] == 'ab'
+
+
+def test_a_new_id_rebuilds_the_dicts_referring_to_it(neuron, top):
+    top.to_dict()
+    neuron._id = 'ab' * 32
+    assert spec(top)['neuron_groups'][0]['neuron'] == 'ab' * 32
+
+
+def test_replacing_a_value_rebuilds_the_dict(top):
+    top.to_dict()
+    top.geometry = Geometry(width=3.0, height=1.0, depth=1.0)
+    assert spec(top)['geometry']['width'] == 3.0
+
+
+def test_items_replaced_or_removed_in_place_rebuild_their_group(neuron,
+                                                                top):
+    top.to_dict()
+    top.neuron_groups[0] = NeuronGroup(neuron=neuron, count=5, label='b')
+    del top.connections[0]
+    assert [x['label'] for x in spec(top)['neuron_groups']] == ['b']
+    assert spec(top)['connections'] == []
+
+
+def test_lists_taken_from_another_group_are_copied(top, group):
+    other = group(neuron_groups=top.neuron_groups)
+    other.neuron_groups.pop()
+    assert len(top.neuron_groups) == 1
+    top.neuron_groups = other.neuron_groups
+    assert top.neuron_groups is not other.neuron_groups
+
+
+@pytest.fixture
+def model(group, izh, top):
+    """ top and a second group placed side by side in a third """
+    other = group(neuron_groups=[NeuronGroup(neuron=izh(), count=10,
+                                             label='a')])
+    outer = group(subgroups=[SubGroup(group=top, label='t'),
+                             SubGroup(group=other, label='o')])
+    return outer, top, other
+
+
+def cached(*entities):
+    return [x.to_dict() for x in entities]
+
+
+def test_an_edit_only_rebuilds_the_groups_holding_it(model):
+    outer, top, other = model
+    before = cached(outer, top, other)
+    top.neuron_groups[0].count = 20
+    top.neuron_groups[0].location.x = 1.0
+    assert all(x is y for x, y in zip(cached(outer, other), before[::2]))
+    assert spec(top)['neuron_groups'][0]['count'] == 20
+
+
+def test_a_nested_value_only_rebuilds_its_entity(neuron, model):
+    outer, top, other = model
+    before = cached(outer, top, other)
+    neuron.v.mean = -60.0
+    assert all(x is y for x, y in zip(cached(outer, top, other), before))
+    assert spec(neuron)['v']['mean'] == -60.0
+
+
+def test_a_new_id_only_rebuilds_the_groups_referring_to_it(neuron, model):
+    outer, top, other = model
+    before = cached(outer, top, other)
+    neuron._id = 'ab' * 32
+    assert all(x is y for x, y in zip(cached(outer, other), before[::2]))
+    assert spec(top)['neuron_groups'][0]['neuron'] == 'ab' * 32
+    other._id = 'cd' * 32
+    assert spec(outer)['subgroups'][1]['group'] == 'cd' * 32
+
+
+@pytest.mark.parametrize('restore', ['copy', 'snapshot'])
+def test_restored_groups_track_their_edits(top, restore, tmpdir):
+    if restore == 'copy':
+        restored = copy.deepcopy(top)
+    else:
+        path = str(tmpdir.join('top.snapshot'))
+        top.save(path)
+        restored = Group.load(path)
+    restored.to_dict()
+    restored.neuron_groups[0].count = 20
+    restored.neuron_groups[0].neuron.v.mean = -60.0
+    restored.connections.pop()
+    assert spec(restored)['neuron_groups'][0]['count'] == 20
+    assert spec(restored)['connections'] == []
+    assert spec(restored.neuron_groups[0].neuron)['v']['mean'] == -60.0
+
+
+def test_caching_can_be_turned_off(neuron, monkeypatch):
+    monkeypatch.setattr(IzhNeuron, 'cache_dicts', False)
+    assert neuron.to_dict() is not neuron.to_dict()
+    assert neuron.to_dict() == neuron.to_dict()
@@ -0,0 +1,59 @@
+""" The local reference engine """
+import numpy
+import pytest
+
+from pyncs.engine import LocalSimulator
+from pyncs.pyncs import (NeuronGroup, Connection, Simulation, Report,
+                         RectCurrentStimulus, Normal, Uniform, EntityError)
+
+
+@pytest.fixture
+def simulation(izh, flat, group):
+    neuron = izh(a=Normal(0.02, 0.002), v=Normal(-65.0, 3.0))
+    synapse = flat(delay=Uniform(1.0, 4.0), current=Normal(10.0, 2.0))
+    top = group(neuron_groups=[NeuronGroup(neuron=neuron, count=50,
+                                           label='a'),
+                               NeuronGroup(neuron=neuron, count=50,
+                                           label='b')],
+                connections=[Connection(presynaptic='a', postsynaptic='b',
+                                        probability=0.2, synapse=synapse)])
+    stimulus = RectCurrentStimulus(amplitude=Normal(20.0, 2.0), width=2,
+                                   frequency=50, probability=0.5,
+                                   time_start=0.0, time_end=0.1,
+                                   destinations=['a'])
+    report = Report(report_method='file', report_type='neuron',
+                    report_target=['a', 'b'], probability=1.0,
+                    time_start=0.0, time_end=0.1)
+    return Simulation(top, [stimulus], [report])
+
+
+def voltages(result):
+    report, = result['reports'].values()
+    return report['voltages']
+
+
+def test_a_seeded_run_is_reproducible(simulation):
+    first = LocalSimulator(seed=3).run(simulation)
+    second = LocalSimulator(seed=3).run(simulation)
+    assert first['spikes'] == second['spikes'] > 0
+    assert first['synapses'] == second['synapses']
+    assert numpy.array_equal(voltages(first), voltages(second))
+
+
+def test_seeds_give_different_runs(simulation):
+    first = LocalSimulator(seed=3).run(simulation)
+    second = LocalSimulator(seed=4).run(simulation)
+    assert not numpy.array_equal(voltages(first), voltages(second))
+
+
+def test_reports_stop_with_a_short_run(simulation):
+    result = LocalSimulator(seed=3).run(simulation, duration=0.04)
+    report, = result['reports'].values()
+    assert report['voltages'].shape == (40, 100)
+    assert len(report['times']) == 40
+
+
+def test_unresolved_labels_are_refused(simulation):
+    simulation.stimuli[0].destinations = ['nope']
+    with pytest.raises(EntityError):
+        LocalSimulator().run(simulation)
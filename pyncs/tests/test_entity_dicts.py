@@ -0,0 +1,72 @@
+""" Collecting the entities a simulation refers to """
+import sys
+
+from pyncs.pyncs import (NCSNeuron, LIFVoltageGatedChannel, NeuronGroup,
+                         Connection, SubGroup, Simulator)
+
+
+def collect(top):
+    return Simulator._generate_entity_dicts(top, [], [])
+
+
+def test_a_shared_subgroup_is_emitted_once(izh, group):
+    neuron = izh()
+    shared = group(neuron_groups=[NeuronGroup(neuron=neuron, count=10,
+                                              label='a')])
+    left = group(subgroups=[SubGroup(group=shared, label='x')])
+    right = group(subgroups=[SubGroup(group=shared, label='y')])
+    top = group(subgroups=[SubGroup(group=left, label='l'),
+                           SubGroup(group=right, label='r'),
+                           SubGroup(group=shared, label='s')])
+    entity_dicts = collect(top)
+    assert list(entity_dicts['neurons']) == [neuron._id]
+    groups = list(entity_dicts['groups'])
+    assert sorted(groups) == sorted(x._id for x in (shared, left, right, top))
+
+
+def test_groups_come_after_the_groups_they_hold(izh, flat, group):
+    inner = group(neuron_groups=[NeuronGroup(neuron=izh(), count=10,
+                                             label='a')],
+                  connections=[Connection(presynaptic='a', postsynaptic='a',
+                                          probability=0.1, synapse=flat())])
+    middle = group(subgroups=[SubGroup(group=inner, label='i')])
+    top = group(subgroups=[SubGroup(group=middle, label='m'),
+                           SubGroup(group=inner, label='j')])
+    entity_dicts = collect(top)
+    groups = list(entity_dicts['groups'])
+    assert groups.index(inner._id) < groups.index(middle._id)
+    assert groups[-1] == top._id
+    assert len(entity_dicts['synapses']) == 1
+
+
+def test_hierarchies_deeper_than_the_recursion_limit(izh, group):
+    depth = sys.getrecursionlimit() + 100
+    neuron = izh()
+    top = group(neuron_groups=[NeuronGroup(neuron=neuron, count=1,
+                                           label='a')])
+    for _ in range(depth):
+        top = group(subgroups=[SubGroup(group=top, label='g')])
+    entity_dicts = collect(top)
+    assert len(entity_dicts['groups']) == depth + 1
+    assert list(entity_dicts['groups'])[-1] == top._id
+    assert list(entity_dicts['neurons']) == [neuron._id]
+
+
+def test_ncs_channels_are_sent_on_their_own(group):
+    channel = LIFVoltageGatedChannel(
+        v_half=-40.0, r=0.1, activation_slope=0.5, deactivation_slope=0.5,
+        equilibrium_slope=0.5, conductance=1.0, reversal_potential=-80.0,
+        m_initial=0.0, m_power=1.0)
+    neurons = [NCSNeuron(threshold=-50.0, spikeshape=1.0,
+                         resting_potential=-60.0, calcium=0.0,
+                         calcium_spike_increment=0.1,
+                         tau_calcium=0.05, leak_reversal_potential=-60.0,
+                         leak_conductance=0.01, tau_membrane=0.02,
+                         r_membrane=200.0, channels=[channel])
+               for _ in range(2)]
+    top = group(neuron_groups=[NeuronGroup(neuron=x, count=5, label=label)
+                               for x, label in zip(neurons, 'ab')])
+    entity_dicts = collect(top)
+    assert list(entity_dicts['channels']) == [channel._id]
+    spec = entity_dicts['neurons'][neurons[0]._id].to_dict()['specification']
+    assert spec['channels'] == [channel._id]
@@ -0,0 +1,62 @@
+""" Pre-flight estimates and the limits checked against them """
+import pytest
+
+from pyncs import estimate
+from pyncs.pyncs import (NeuronGroup, Connection, SubGroup, Alias, Report,
+                         Simulation, Simulator, SimulationError, EntityError)
+from pyncs.tests.mock_daemon import MockDaemon
+
+
+@pytest.fixture
+def model(izh, flat, group):
+    """ Makes a model whose subgroup connects labels of the top group """
+    def make(presynaptic='big', postsynaptic='big', recurrent=False):
+        inner = group(
+            neuron_groups=[NeuronGroup(neuron=izh(), count=10, label='a')],
+            connections=[Connection(presynaptic=presynaptic,
+                                    postsynaptic=postsynaptic,
+                                    probability=1.0, synapse=flat(),
+                                    recurrent=recurrent)])
+        top = group(entity_name='top',
+                    neuron_groups=[NeuronGroup(neuron=izh(), count=100000,
+                                               label='big')],
+                    subgroups=[SubGroup(group=inner, label='s')])
+        return Simulation(top, [], [])
+    return make
+
+
+def test_connections_to_absolute_labels_are_counted(model):
+    assert estimate.estimate(model()).synapses == 100000 * 99999
+    assert estimate.estimate(model(recurrent=True)).synapses == 100000 ** 2
+    assert estimate.estimate(model('a', 'top:big')).synapses == 10 * 100000
+    assert estimate.estimate(model('a', 's:a')).synapses == 10 * 10
+
+
+def test_limits_refuse_connections_to_absolute_labels(model):
+    with MockDaemon() as daemon:
+        simulator = Simulator(daemon.host, daemon.port, 'u', 'p',
+                              limits={'synapses': 1e6})
+        with pytest.raises(SimulationError) as e:
+            simulator.run(model())
+        assert 'synapses' in str(e.value)
+        assert daemon.simulations == []
+
+
+def test_unresolved_labels_are_refused(model):
+    with pytest.raises(EntityError):
+        estimate.estimate(model('a', 'nope'))
+
+
+def test_reports_count_each_neuron_group_once(model):
+    simulation = model('a', 'a')
+    top = simulation.top_group
+    top.neuron_aliases.append(Alias(alias='all', labels=['big', 's'],
+                                    aliases=[]))
+    report = Report(report_method=Report.METHOD_FILE,
+                    report_type=Report.TYPE_NEURON,
+                    report_target=['all', 'big', top.neuron_groups[0]],
+                    probability=0.5, time_start=0.0, time_end=1.0)
+    simulation.reports.append(report)
+    result = estimate.estimate(simulation, dt=0.01)
+    assert result.reports[report._id] == \
+        100010 * 0.5 * 100 * estimate.VALUE_BYTES
@@ -0,0 +1,113 @@
+""" Label and alias resolution """
+import numpy
+import pytest
+
+from pyncs.engine import _Network
+from pyncs.labels import LabelIndex
+from pyncs.pyncs import (NeuronGroup, SubGroup, Alias, EntityError,
+                         SimulationError, Simulation)
+
+
+@pytest.fixture
+def inner(izh, group):
+    """ Makes a group of neuron groups a and b with the given aliases """
+    def make(neuron_aliases=(), synapse_aliases=()):
+        return group(neuron_groups=[NeuronGroup(neuron=izh(), count=10,
+                                                label='a'),
+                                    NeuronGroup(neuron=izh(), count=20,
+                                                label='b')],
+                     neuron_aliases=neuron_aliases,
+                     synapse_aliases=synapse_aliases)
+    return make
+
+
+@pytest.fixture
+def model(izh, group, inner):
+    """ Two placements of a group with aliases below a top group """
+    placed = inner([Alias(alias='al', labels=['a', 'b'], aliases=[]),
+                    Alias(alias='first', labels=['a'], aliases=[]),
+                    Alias(alias='both', labels=[],
+                          aliases=['first', 'al'])])
+    return placed, group(entity_name='top',
+                         subgroups=[SubGroup(group=placed, label='s1'),
+                                    SubGroup(group=placed, label='s2')],
+                         neuron_groups=[NeuronGroup(neuron=izh(), count=5,
+                                                    label='c')])
+
+
+def test_labels_resolve_to_neuron_groups(model):
+    group, top = model
+    index = LabelIndex(top)
+    assert index.resolve('c') == frozenset([(top._id, ('c',))])
+    assert index.resolve('s1:a') == frozenset([(top._id, ('s1', 'a'))])
+    assert index.resolve('top:s1:a') == index.resolve('s1:a')
+    assert index.resolve('s2') == frozenset([(top._id, ('s2', 'a')),
+                                             (top._id, ('s2', 'b'))])
+    assert index.count('top') == 65
+
+
+def test_aliases_resolve_within_their_group(model):
+    group, top = model
+    index = LabelIndex(top)
+    assert index.resolve('al', group) == frozenset([(group._id, ('a',)),
+                                                    (group._id, ('b',))])
+    assert index.resolve('both', group) == index.resolve('al', group)
+    assert index.resolve('s1:al') == frozenset([(top._id, ('s1', 'a')),
+                                                (top._id, ('s1', 'b'))])
+    assert index.count('s1:al') == 30
+
+
+def test_relative_labels_fall_back_to_absolute_ones(model):
+    group, top = model
+    assert LabelIndex(top).resolve('s2:b', group) == \
+        frozenset([(top._id, ('s2', 'b'))])
+
+
+def test_unknown_labels_fail(model):
+    group, top = model
+    index = LabelIndex(top)
+    for label in ('nope', 's1:nope', 's3:a', 'c:a'):
+        with pytest.raises(EntityError):
+            index.resolve(label)
+
+
+def test_alias_cycles_fail(inner):
+    group = inner([Alias(alias='x', labels=[], aliases=['y']),
+                   Alias(alias='y', labels=['a'], aliases=['x'])])
+    with pytest.raises(EntityError):
+        LabelIndex(group).resolve('x')
+
+
+def test_synapse_alias_cycles_are_reported(inner):
+    group = inner(synapse_aliases=[
+        Alias(alias='x', labels=[], aliases=['y']),
+        Alias(alias='y', labels=[], aliases=['x']),
+        Alias(alias='z', labels=[], aliases=['w']),
+        Alias(alias='ok', labels=[], aliases=[])])
+    problems = LabelIndex(group).check()
+    assert len(problems) == 3
+    assert any('unknown alias w' in x for x in problems)
+
+
+def test_groups_containing_themselves_fail(inner):
+    group = inner()
+    group.subgroups.append(SubGroup(group=group, label='me'))
+    with pytest.raises(EntityError):
+        LabelIndex(group).resolve('me')
+
+
+def test_the_engine_resolves_like_the_index(model, transfer_format):
+    group, top = model
+    net = _Network(transfer_format(Simulation(top, [], [])), 0.001,
+                   numpy.random.RandomState(0))
+    paths = [x['path'] for x in net.populations]
+    for label in ('c', 's1:al', 'top:s2:both', 's2'):
+        resolved = [paths[x] for x in net.resolve(label)]
+        expected = [('top',) + path for root, path in
+                    LabelIndex(top).resolve(label)]
+        assert sorted(resolved) == sorted(expected)
+    scope, = [x for x in net.scopes if x.path == ('top', 's1')]
+    assert [paths[x] for x in net.resolve('first', scope)] == \
+        [('top', 's1', 'a')]
+    with pytest.raises(SimulationError):
+        net.resolve('s1:nope')
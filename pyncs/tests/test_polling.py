@@ -0,0 +1,99 @@
+""" Polling daemons until their runs finish """
+import random
+import time
+
+import pytest
+
+from pyncs.polling import Backoff, wait_for_completion, wait_for_all
+from pyncs.pyncs import Simulator, SimulationError
+from pyncs.tests.benchmark import synthetic_model
+from pyncs.tests.mock_daemon import MockDaemon
+
+
+class Fixed(object):
+    """ Stands in for random.Random, always draws value """
+
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+class Polled(object):
+    """ A simulator that reports running to its first polls requests """
+
+    host = 'localhost'
+
+    def __init__(self, polls, port=0):
+        self.polls = polls
+        self.port = port
+        self.waits = []
+
+    def get_status(self, wait=None):
+        self.waits.append(wait)
+        if len(self.waits) > self.polls:
+            return Simulator.STATUS_IDLE
+        return Simulator.STATUS_RUNNING
+
+
+def test_intervals_grow_up_to_the_maximum():
+    backoff = Backoff(initial=0.1, maximum=1.0, jitter=0, rng=Fixed(0.5))
+    delays = [backoff.next() for _ in range(6)]
+    assert delays == pytest.approx([0.1, 0.2, 0.4, 0.8, 1.0, 1.0])
+    backoff.reset()
+    assert backoff.next() == pytest.approx(0.1)
+
+
+def test_jitter_only_shortens_intervals():
+    assert Backoff(initial=1.0, jitter=0.5,
+                   rng=Fixed(0.0)).next() == pytest.approx(1.0)
+    assert Backoff(initial=1.0, jitter=0.5,
+                   rng=Fixed(0.999)).next() == pytest.approx(0.5005)
+    backoff = Backoff(initial=1.0, maximum=8.0, factor=2.0, jitter=0.25,
+                      rng=random.Random(3))
+    for expected in [1.0, 2.0, 4.0, 8.0, 8.0, 8.0]:
+        assert 0.75 * expected <= backoff.next() <= expected
+
+
+def test_polls_long_poll_for_the_interval():
+    simulator = Polled(3)
+    backoff = Backoff(initial=0.001, jitter=0, rng=Fixed(0.0))
+    assert wait_for_completion(simulator, backoff=backoff) == \
+        Simulator.STATUS_IDLE
+    assert simulator.waits == pytest.approx([0.001, 0.002, 0.004, 0.008])
+
+
+def test_waiting_gives_up_at_the_timeout():
+    simulator = Polled(10 ** 6)
+    started = time.time()
+    with pytest.raises(SimulationError) as e:
+        wait_for_completion(simulator, timeout=0.2,
+                            backoff=Backoff(initial=0.01, maximum=0.05))
+    elapsed = time.time() - started
+    assert 0.2 <= elapsed < 1.0
+    assert 'running' in str(e.value)
+    # no poll asks the daemon to hold it past the deadline
+    assert all(x <= 0.2 for x in simulator.waits)
+
+
+def test_waiting_on_a_daemon():
+    with MockDaemon(run_time=0.2) as daemon:
+        simulator = Simulator(daemon.host, daemon.port, 'u', 'p')
+        simulator.run(synthetic_model(100))
+        with pytest.raises(SimulationError):
+            wait_for_completion(simulator, timeout=0.05)
+        assert wait_for_completion(simulator, timeout=5) == \
+            Simulator.STATUS_IDLE
+
+
+def test_waiting_on_several_names_the_ones_still_running():
+    finished = []
+    simulators = [Polled(1, port=1), Polled(10 ** 6, port=2)]
+    with pytest.raises(SimulationError) as e:
+        wait_for_all(simulators, timeout=0.2,
+                     backoff=lambda: Backoff(initial=0.01, maximum=0.05),
+                     callback=finished.append)
+    assert finished == simulators[:1]
+    assert 'localhost:2' in str(e.value)
+    assert 'localhost:1' not in str(e.value)
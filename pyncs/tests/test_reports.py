@@ -0,0 +1,142 @@
+""" Reading report output """
+import os
+
+import numpy
+import pytest
+
+from pyncs import reports
+from pyncs.pyncs import SimulationError
+from pyncs.tests.report_server import ReportServer
+
+
+@pytest.fixture
+def path(tmpdir):
+    """ A report file of 100 frames, one every other step """
+    path = str(tmpdir.join('report.bin'))
+    values = numpy.arange(300, dtype=numpy.float32).reshape(100, 3)
+    reports.write_report_file(path, numpy.arange(0, 200, 2), values)
+    return path
+
+
+def frames(start, count, width=2):
+    steps = numpy.arange(start, start + count)
+    return steps, numpy.repeat(steps, width).reshape(count, width)
+
+
+def test_the_ring_buffer_wraps_around():
+    buffer = reports.RingBuffer(2, 4)
+    buffer.extend(*frames(0, 3))
+    assert buffer.read(2)[0].tolist() == [0, 1]
+    buffer.extend(*frames(3, 3))
+    assert len(buffer) == 4 and buffer.free() == 0
+    assert buffer.latest(2)[0].tolist() == [4, 5]
+    steps, values = buffer.read()
+    assert steps.tolist() == [2, 3, 4, 5]
+    assert values[:, 1].tolist() == [2, 3, 4, 5]
+    assert buffer.dropped == 0 and len(buffer) == 0
+
+
+def test_the_ring_buffer_drops_the_oldest_frames():
+    buffer = reports.RingBuffer(2, 4)
+    buffer.extend(*frames(0, 3))
+    buffer.extend(*frames(3, 3))
+    assert buffer.dropped == 2
+    # more frames at once than it holds
+    buffer.extend(*frames(6, 10))
+    assert buffer.dropped == 12
+    steps, values = buffer.read()
+    assert steps.tolist() == [12, 13, 14, 15]
+    assert values[:, 0].tolist() == [12, 13, 14, 15]
+
+
+@pytest.fixture
+def server():
+    """ Serves 1000 frames of 3 values in writes cut at random offsets """
+    steps = numpy.arange(1000)
+    values = numpy.random.RandomState(0).rand(1000, 3).astype('f4')
+    with ReportServer(steps, values, max_write=50, seed=1) as server:
+        server.values = values
+        yield server
+
+
+@pytest.mark.parametrize('threaded', [False, True])
+def test_frames_cut_anywhere_arrive_whole_and_in_order(server, threaded):
+    # a buffer much smaller than the stream, the receiver only reads what
+    # it has room for
+    with reports.ReportReceiver(server.host, server.port, capacity=16,
+                                recv_size=40, timeout=5) as receiver:
+        if threaded:
+            receiver.start()
+        batches = list(receiver)
+        assert receiver.buffer.dropped == 0
+    steps = numpy.concatenate([x for x, _ in batches])
+    assert steps.tolist() == list(range(1000))
+    assert numpy.array_equal(numpy.concatenate([x for _, x in batches]),
+                             server.values)
+
+
+def test_an_overwriting_receiver_keeps_the_newest_frames(server):
+    with reports.ReportReceiver(server.host, server.port, capacity=16,
+                                overwrite=True, timeout=5) as receiver:
+        while not receiver.closed:
+            receiver.receive()
+        assert receiver.buffer.dropped == 1000 - 16
+        steps, values = receiver.read()
+    assert steps.tolist() == list(range(1000 - 16, 1000))
+    assert numpy.array_equal(values, server.values[-16:])
+
+
+@pytest.mark.parametrize('stream', [b'XXXX' + b'\0' * 8, b'NCSR\1'])
+def test_bad_streams_are_refused(server, stream):
+    server.frames = stream
+    with pytest.raises(SimulationError):
+        reports.ReportReceiver(server.host, server.port, timeout=5)
+
+
+def mapped(path):
+    """ Whether the file is mapped into this process, None if that can't be
+    told here """
+    if not os.path.exists('/proc/self/maps'):
+        return None
+    with open('/proc/self/maps') as f:
+        return os.path.realpath(path) in f.read()
+
+
+def test_frames_are_read_back(path):
+    with reports.ReportFile(path, dt=0.5) as report:
+        assert len(report) == 100
+        assert numpy.array_equal(report.times, numpy.arange(0, 100, 1.0))
+        assert report.values[10].tolist() == [30.0, 31.0, 32.0]
+        with pytest.raises(SimulationError):
+            report.spike_steps
+
+
+def test_windows_cover_their_time_range(path):
+    report = reports.ReportFile(path, dt=0.5)
+    window = report.window(10.0, 20.0)
+    assert window.times[0] == 10.0 and window.times[-1] == 19.0
+    assert len(report.window(1000.0)) == 0
+
+
+def test_spikes_are_read_back(tmpdir):
+    path = str(tmpdir.join('spikes.bin'))
+    reports.write_report_file(path, [1, 1, 4], indices=[0, 2, 1], width=3)
+    with reports.ReportFile(path) as report:
+        assert report.spike_steps.tolist() == [1, 1, 4]
+        assert report.spike_neurons.tolist() == [0, 2, 1]
+
+
+def test_close_releases_the_mapping(path):
+    report = reports.ReportFile(path)
+    window = report.window(0.01, 0.05)
+    report.values.sum()
+    if mapped(path) is None:
+        pytest.skip("can't list this process' mappings")
+    report.close()
+    # the window still reads from the file until it's closed as well
+    assert window.values.sum() > 0 and mapped(path)
+    window.close()
+    assert not mapped(path)
+    # nothing holds on to the file
+    os.remove(path)
+    assert len(report) == 0 and len(window) == 0
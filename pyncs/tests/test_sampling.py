@@ -0,0 +1,140 @@
+""" Local sampling of distribution-valued parameters """
+import numpy
+import pytest
+
+from pyncs import sampling
+from pyncs.engine import _Network
+from pyncs.pyncs import (NeuronGroup, SubGroup, Connection, Simulation,
+                         Normal, Uniform, SimulationError)
+
+
+@pytest.fixture
+def simulation(izh, flat, group):
+    neuron = izh(a=Normal(0.02, 0.005), b=Uniform(0.15, 0.25),
+                 v=Normal(-65.0, 3.0))
+    synapse = flat(delay=Uniform(1.0, 4.0), current=Normal(10.0, 2.0))
+    placed = group(neuron_groups=[NeuronGroup(neuron=neuron, count=300,
+                                              label='a'),
+                                  NeuronGroup(neuron=neuron, count=400,
+                                              label='b')],
+                   connections=[Connection(presynaptic='a', postsynaptic='b',
+                                           probability=0.05,
+                                           synapse=synapse)])
+    top = group(entity_name='top',
+                subgroups=[SubGroup(group=placed, label='s'),
+                           SubGroup(group=placed, label='t')])
+    return Simulation(top, [], [])
+
+
+def population(populations, kind, path):
+    found, = [x for x in populations if x.kind == kind and x.path == path]
+    return found
+
+
+@pytest.fixture
+def network(simulation, transfer_format):
+    """ Makes the engine's network of the simulation for a seed """
+    def make(seed):
+        return _Network(transfer_format(simulation), 0.001,
+                        numpy.random.RandomState(seed), None, seed)
+    return make
+
+
+def test_a_parameter_reads_the_same_however_its_read():
+    parameter = sampling.Parameter('a', Normal(0.0, 1.0), 200000, 'key', 7)
+    whole = parameter.array()
+    assert len(whole) == 200000
+    assert numpy.array_equal(
+        numpy.concatenate(list(parameter.chunks(70001))), whole)
+    assert numpy.array_equal(parameter[65530:65540], whole[65530:65540])
+    assert numpy.array_equal(parameter[::7], whole[::7])
+    assert parameter[-1] == whole[-1]
+
+
+def test_seeds_and_keys_change_the_values():
+    values = sampling.Parameter('a', Uniform(0.0, 1.0), 100, 'key', 7)
+    for other in (sampling.Parameter('a', Uniform(0.0, 1.0), 100, 'key', 8),
+                  sampling.Parameter('a', Uniform(0.0, 1.0), 100, 'k', 7)):
+        assert not numpy.array_equal(values.array(), other.array())
+
+
+def test_unsupported_distributions_are_refused():
+    with pytest.raises(SimulationError):
+        sampling.Parameter('a', {'type': 'poisson'}, 10, 'key')
+
+
+def test_materialize_is_reproducible(simulation):
+    first = sampling.materialize(simulation, seed=3)
+    second = sampling.materialize(simulation, seed=3)
+    assert [x.key for x in first] == [x.key for x in second]
+    assert [x.count for x in first] == [x.count for x in second]
+    for a, b in zip(first, second):
+        for name, parameter in a.parameters.items():
+            assert numpy.array_equal(parameter.array(),
+                                     b.parameters[name].array())
+
+
+def test_each_placement_gets_its_own_values(simulation):
+    populations = sampling.materialize(simulation, seed=3)
+    s = population(populations, sampling.NEURON, ('top', 's', 'a'))
+    t = population(populations, sampling.NEURON, ('top', 't', 'a'))
+    assert not numpy.array_equal(s.parameters['a'].array(),
+                                 t.parameters['a'].array())
+
+
+def test_the_engine_realizes_materialized_neurons(simulation, network):
+    populations = sampling.materialize(simulation, seed=3)
+    net = network(3)
+    for placed in net.populations:
+        expected = population(populations, sampling.NEURON, placed['path'])
+        window = slice(placed['start'], placed['start'] + placed['count'])
+        assert numpy.array_equal(net.a[window],
+                                 expected.parameters['a'].array())
+        assert numpy.array_equal(net.v[window],
+                                 expected.parameters['v'].array())
+
+
+def test_the_engine_realizes_materialized_synapses(simulation, network):
+    expected = population(sampling.materialize(simulation, seed=3),
+                          sampling.SYNAPSE, ('top', 's'))
+    net = network(3)
+    # the synapses of subgroup s, from its a to its b
+    start = dict((x['path'], x['start']) for x in net.populations)
+    pre = numpy.repeat(numpy.arange(net.size), numpy.diff(net.indptr))
+    mine = ((pre >= start[('top', 's', 'a')]) &
+            (pre < start[('top', 's', 'a')] + 300))
+    count = int(mine.sum())
+    # the engine draws its own synapse count, the i-th synapse gets the
+    # i-th value of the population
+    current = sampling.Parameter('current',
+                                 expected.parameters['current'].value,
+                                 count, expected.key, 3).array()
+    assert numpy.allclose(numpy.sort(net.currents[mine]),
+                          numpy.sort(current))
+
+
+def test_connections_to_absolute_labels_get_their_synapses(
+        izh, flat, group, transfer_format):
+    inner = group(neuron_groups=[NeuronGroup(neuron=izh(), count=10,
+                                             label='a')],
+                  connections=[Connection(presynaptic='a',
+                                          postsynaptic='top:big',
+                                          probability=0.5, synapse=flat())])
+    top = group(entity_name='top',
+                neuron_groups=[NeuronGroup(neuron=izh(), count=200,
+                                           label='big')],
+                subgroups=[SubGroup(group=inner, label='s'),
+                           SubGroup(group=inner, label='t')])
+    simulation = Simulation(top, [], [])
+    net = _Network(transfer_format(simulation), 0.001,
+                   numpy.random.RandomState(3), None, 3)
+    pre = numpy.repeat(numpy.arange(net.size), numpy.diff(net.indptr))
+    start = dict((x['path'], x['start']) for x in net.populations)
+    for label in ('s', 't'):
+        synapses = population(sampling.materialize(simulation, seed=3),
+                              sampling.SYNAPSE, ('top', label))
+        first = start[('top', label, 'a')]
+        built = int(((pre >= first) & (pre < first + 10)).sum())
+        # both are drawn from the 2000 pairs the labels join
+        assert abs(synapses.count - 1000) < 150
+        assert abs(built - 1000) < 150
@@ -0,0 +1,78 @@
+""" Spreading runs over several daemons """
+import time
+
+import pytest
+
+from pyncs.pyncs import Simulator, SimulationError, EntityError
+from pyncs.scheduler import Scheduler
+from pyncs.tests.benchmark import synthetic_model
+from pyncs.tests.mock_daemon import MockDaemon
+
+
+def simulator(daemon):
+    return Simulator(daemon.host, daemon.port, 'u', 'p')
+
+
+def test_runs_fail_over_from_a_failing_daemon():
+    simulation = synthetic_model(100)
+    with MockDaemon() as broken, MockDaemon(run_time=0.05) as daemon:
+        broken.submit = lambda *args: (500, {'message': 'out of memory'})
+        # the working daemon is busy at first, so the broken one is tried
+        daemon.runs_until = time.time() + 0.5
+        with Scheduler([simulator(broken), simulator(daemon)],
+                       status_ttl=0.1) as pool:
+            jobs = [pool.submit(simulation) for _ in range(3)]
+            results = [x.result(10) for x in jobs]
+            stats = pool.stats()
+    assert [x['status'] for x in results] == ['running'] * 3
+    assert len(daemon.simulations) == 3
+    assert set(x.node for x in jobs) == set(['%s:%s' % (daemon.host,
+                                                         daemon.port)])
+    failing = stats['nodes']['%s:%s' % (broken.host, broken.port)]
+    assert failing['failures'] == 1 and not failing['healthy']
+    assert stats['completed'] == 3 and stats['failed'] == 0
+
+
+def test_busy_daemons_are_passed_over():
+    simulation = synthetic_model(100)
+    with MockDaemon(run_time=0.05) as busy, \
+            MockDaemon(run_time=0.05) as idle:
+        busy.runs_until = time.time() + 5
+        with Scheduler([simulator(busy), simulator(idle)],
+                       status_ttl=0.2) as pool:
+            started = time.time()
+            pool.map([simulation] * 2)
+            elapsed = time.time() - started
+    assert elapsed < 2
+    assert busy.simulations == [] and len(idle.simulations) == 2
+
+
+def test_a_bad_simulation_fails_without_a_cooldown():
+    bad = synthetic_model(100)
+    bad.reports[0].report_target = ['nope']
+    with MockDaemon() as daemon:
+        with Scheduler([simulator(daemon)], status_ttl=0.2) as pool:
+            with pytest.raises(EntityError):
+                pool.submit(bad).result(5)
+            pool.map([synthetic_model(100)])
+            stats = pool.stats()
+    node, = stats['nodes'].values()
+    assert node['healthy'] and node['failures'] == 0
+    assert stats['failed'] == 1 and stats['completed'] == 1
+
+
+def test_an_accepted_run_is_never_sent_again():
+    simulation = synthetic_model(100)
+    with MockDaemon(run_time=5) as slow, MockDaemon(run_time=5) as other:
+        # waiting on the run times out once the daemon has accepted it
+        with Scheduler([simulator(slow), simulator(other)],
+                       status_ttl=0.1, timeout=0.3) as pool:
+            job = pool.submit(simulation)
+            with pytest.raises(SimulationError) as e:
+                job.result(5)
+            stats = pool.stats()
+        runs = slow.simulations + other.simulations
+    assert len(runs) == 1
+    assert 'unknown' in str(e.value) and job.node in str(e.value)
+    assert job.response['status'] == 'running' and job.attempts == 1
+    assert stats['failed'] == 1 and stats['completed'] == 0
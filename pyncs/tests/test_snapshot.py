@@ -0,0 +1,109 @@
+""" Saving models to snapshots and loading them back """
+import io
+import struct
+
+import numpy
+import pytest
+
+from pyncs import snapshot
+from pyncs.pyncs import (NeuronGroup, Connection, SubGroup, Group,
+                         Simulation, Normal)
+from pyncs.tests.benchmark import synthetic_model
+
+
+@pytest.fixture
+def model(izh, flat, group):
+    """ A shared neuron, synapse and group, and a connection with arrays """
+    neuron = izh(v=Normal(-65.0, 3.0))
+    synapse = flat()
+    shared = group(neuron_groups=[NeuronGroup(neuron=neuron, count=10,
+                                              label='a')],
+                   connections=[Connection(presynaptic='a', postsynaptic='a',
+                                           probability=0.5, synapse=synapse)])
+    edges = Connection.from_edges('b', 'b', synapse, [0, 1, 1], [2, 0, 1],
+                                  weights=[0.5, 1.0, 1.5])
+    top = group(entity_name='top',
+                neuron_groups=[NeuronGroup(neuron=neuron, count=3,
+                                           label='b')],
+                connections=[edges],
+                subgroups=[SubGroup(group=shared, label='s'),
+                           SubGroup(group=shared, label='t')])
+    return Simulation(top, [], [])
+
+
+def reload(obj, tmpdir, compression='zlib'):
+    path = str(tmpdir.join('model.snapshot'))
+    snapshot.save(obj, path, compression)
+    return snapshot.load(path)
+
+
+@pytest.mark.parametrize('compression', ['zlib', None])
+def test_a_simulation_round_trips(transfer_format, tmpdir, compression):
+    simulation = synthetic_model(400)
+    loaded = reload(simulation, tmpdir, compression)
+    assert transfer_format(loaded) == transfer_format(simulation)
+
+
+def test_arrays_round_trip(model, tmpdir):
+    edges = reload(model, tmpdir).top_group.connections[0]
+    assert numpy.array_equal(edges.indptr, [0, 1, 3])
+    assert numpy.array_equal(edges.indices, [2, 0, 1])
+    assert numpy.array_equal(edges.weights, [0.5, 1.0, 1.5])
+    assert edges.delays is None
+
+
+def test_shared_entities_stay_shared(model, tmpdir):
+    top = reload(model, tmpdir).top_group
+    s, t = [x.group for x in top.subgroups]
+    assert s is t
+    neuron = top.neuron_groups[0].neuron
+    assert s.neuron_groups[0].neuron is neuron
+    assert neuron.v.mean == -65.0
+    assert s.connections[0].synapse is top.connections[0].synapse
+
+
+def test_groups_are_decoded_when_first_used(model, tmpdir):
+    top = reload(model, tmpdir).top_group
+    shared = top.subgroups[0].group
+    assert '_pending' in shared.__dict__
+    assert shared.neuron_groups[0].label == 'a'
+    assert '_pending' not in shared.__dict__
+
+
+def test_a_group_round_trips_from_a_file_object(model, transfer_format):
+    out = io.BytesIO()
+    snapshot.save(model.top_group, out)
+    top = snapshot.load(io.BytesIO(out.getvalue()))
+    assert isinstance(top, Group)
+    assert transfer_format(Simulation(top, [], [])) == \
+        transfer_format(model)
+
+
+def snapshot_bytes(model):
+    out = io.BytesIO()
+    snapshot.save(model, out)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize('damage', ['magic', 'version', 'header', 'end',
+                                    'empty'])
+def test_bad_snapshots_are_refused(model, tmpdir, damage):
+    data = snapshot_bytes(model)
+    start = len(snapshot.MAGIC)
+    if damage == 'magic':
+        data = b'NOTASNAP' + data[start:]
+    elif damage == 'version':
+        data = (data[:start] + struct.pack('<H', snapshot.VERSION + 1) +
+                data[start + 2:])
+    elif damage == 'header':
+        data = data[:start + 20]
+    elif damage == 'end':
+        data = data[:-10]
+    else:
+        data = b''
+    path = tmpdir.join('bad.snapshot')
+    path.write_binary(data)
+    with pytest.raises(ValueError):
+        snapshot.load(str(path))
+    with pytest.raises(ValueError):
+        snapshot.load(io.BytesIO(data))
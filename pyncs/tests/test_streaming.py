@@ -0,0 +1,66 @@
+""" Streamed and compressed payloads """
+import io
+import json
+import zlib
+
+import pytest
+
+from pyncs import streaming
+from pyncs.pyncs import (NeuronGroup, Connection, SubGroup, Simulation,
+                         Simulator)
+from pyncs.tests.benchmark import synthetic_model
+from pyncs.tests.mock_daemon import MockDaemon
+
+
+@pytest.fixture
+def simulation(izh, flat, group):
+    """ The synthetic model with a column-wise block in its top group """
+    simulation = synthetic_model(300)
+    top = simulation.top_group
+    top.neuron_groups.append(NeuronGroup.from_arrays(
+        izh(), [10, 20, 30], ['x', 'y', 'z']))
+    top.connections.append(Connection.from_arrays(
+        ['x', 'y'], ['y', 'z'], [0.1, 0.25], flat()))
+    top.subgroups.append(SubGroup(group=group(), label='empty'))
+    return simulation
+
+
+def stream(simulation, **kwargs):
+    top = simulation.top_group
+    entity_dicts = Simulator._refresh_content_ids(
+        Simulator._generate_entity_dicts(top, simulation.stimuli,
+                                         simulation.reports))
+    out = io.BytesIO()
+    streaming.dump(top, entity_dicts, out, **kwargs)
+    return out.getvalue()
+
+
+def test_streamed_output_equals_json_dumps(simulation, transfer_format):
+    expected = json.dumps(transfer_format(simulation))
+    for chunk_size in (1, 100, streaming.CHUNK_SIZE):
+        data = stream(simulation, chunk_size=chunk_size)
+        assert json.loads(data.decode('utf-8')) == json.loads(expected)
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'deflate'])
+def test_compressed_output_equals_json_dumps(simulation, transfer_format,
+                                             encoding):
+    data = stream(simulation, content_encoding=encoding)
+    wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+    decoded = json.loads(zlib.decompress(data, wbits).decode('utf-8'))
+    assert decoded == json.loads(json.dumps(transfer_format(simulation)))
+
+
+def test_unknown_encodings_are_refused():
+    with pytest.raises(ValueError):
+        list(streaming.compress([b'{}'], 'br'))
+
+
+@pytest.mark.parametrize('encoding', [None, 'gzip'])
+def test_the_daemon_receives_the_same_document(simulation, transfer_format,
+                                               encoding):
+    with MockDaemon() as daemon:
+        Simulator(daemon.host, daemon.port, 'u', 'p').run(
+            simulation, stream=True, content_encoding=encoding)
+        received = daemon.simulations[-1]
+    assert received == json.loads(json.dumps(transfer_format(simulation)))
@@ -0,0 +1,122 @@
+""" Parameter sweeps """
+import json
+import time
+
+import pytest
+
+from pyncs.engine import LocalSimulator
+from pyncs.pyncs import Simulator, SimulationError
+from pyncs.scheduler import Scheduler
+from pyncs.sweep import Sweep
+from pyncs.tests.benchmark import synthetic_model
+from pyncs.tests.mock_daemon import MockDaemon
+
+
+def sweep():
+    simulation = synthetic_model(100)
+    neuron = simulation.top_group.subgroups[0].group.neuron_groups[0].neuron
+    result = Sweep(simulation)
+    result.grid(neuron, 'a', [0.01, 0.02, 0.03])
+    result.grid(simulation.stimuli[0], 'amplitude', [5.0, 10.0])
+    return result
+
+
+def sent_values(daemon):
+    return sorted((x['neurons'][0]['specification']['a'],
+                   x['stimuli'][0]['specification']['amplitude'])
+                  for x in daemon.simulations)
+
+
+def test_variants_cover_the_grid():
+    variants = list(sweep().variants())
+    assert len(variants) == 6
+    assert len(set(x.coordinates for x in variants)) == 6
+    for variant in variants:
+        document = variant.transfer_format()
+        encoded = json.loads(b''.join(variant.iterencode()).decode('utf-8'))
+        assert encoded == json.loads(json.dumps(document))
+
+
+def test_variants_share_what_they_dont_change():
+    first, second = list(sweep().variants())[:2]
+    assert first.transfer_format()['groups'] is \
+        second.transfer_format()['groups']
+
+
+def specification(variant):
+    return variant.transfer_format()['neurons'][0]['specification']
+
+
+def test_edits_between_runs_are_picked_up():
+    swept = sweep()
+    neuron = swept.axes[0].targets[0][0]
+    before = next(swept.variants())
+    neuron.b = 0.25
+    after = next(swept.variants())
+    assert specification(after)['b'] == 0.25
+    # variants already made keep the simulation they were made from
+    assert specification(before)['b'] != 0.25
+    encoded = json.loads(b''.join(before.iterencode()).decode('utf-8'))
+    assert encoded['neurons'][0]['specification']['b'] != 0.25
+    with MockDaemon() as daemon:
+        swept.run(Simulator(daemon.host, daemon.port, 'u', 'p'))
+    assert all(x['neurons'][0]['specification']['b'] == 0.25
+               for x in daemon.simulations)
+
+
+def test_a_simulator_runs_one_variant_at_a_time():
+    with MockDaemon(run_time=0.1) as daemon:
+        simulator = Simulator(daemon.host, daemon.port, 'u', 'p')
+        started = time.time()
+        results = sweep().run(simulator, concurrency=3)
+        elapsed = time.time() - started
+        assert daemon.status == 'idle'
+    # every run was waited on, rather than turned down while another ran
+    assert len(results) == 6 and elapsed >= 0.6
+    assert all(x['status'] == 'running' for x in results.values())
+    assert sent_values(daemon) == sorted((a, b) for a in (0.01, 0.02, 0.03)
+                                         for b in (5.0, 10.0))
+
+
+def test_a_scheduler_spreads_variants():
+    with MockDaemon(run_time=0.05) as first, \
+            MockDaemon(run_time=0.05) as second:
+        with Scheduler([Simulator(x.host, x.port, 'u', 'p')
+                        for x in (first, second)]) as pool:
+            seen = []
+            results = sweep().run(pool, concurrency=2,
+                                  callback=lambda v, r: seen.append(v))
+    assert len(results) == len(seen) == 6
+    assert len(first.simulations) + len(second.simulations) == 6
+
+
+def test_the_local_engine_runs_variants():
+    results = sweep().run(LocalSimulator(seed=1), concurrency=2)
+    assert len(results) == 6
+    assert all(x['neurons'] for x in results.values())
+
+
+class Failing(object):
+
+    def run_transfer_format(self, transfer_format, **kwargs):
+        raise SimulationError("no")
+
+
+def test_errors_stop_the_sweep():
+    with pytest.raises(SimulationError):
+        sweep().run(Failing())
+
+
+def test_errors_can_be_kept_as_results():
+    results = sweep().run(Failing(), return_exceptions=True)
+    assert len(results) == 6
+    assert all(isinstance(x, SimulationError) for x in results.values())
+
+
+def test_bad_axes_are_refused():
+    simulation = synthetic_model(100)
+    neuron = simulation.top_group.subgroups[0].group.neuron_groups[0].neuron
+    with pytest.raises(TypeError):
+        Sweep(simulation).grid(neuron, 'a', ['x'])
+    with pytest.raises(TypeError):
+        Sweep(simulation).grid(neuron, 'nope', [1.0])
@@ -0,0 +1,70 @@
+""" Logging in, caching tokens and renewing them once they expire """
+import time
+
+import pytest
+
+from pyncs.pyncs import Simulator, AuthenticationError
+from pyncs.tests.benchmark import synthetic_model
+from pyncs.tests.mock_daemon import MockDaemon
+from pyncs.tokens import TokenCache
+
+LOGIN = ('POST', '/ncs/api/login')
+SIM_GET = ('GET', '/ncs/api/sim')
+SIM_POST = ('POST', '/ncs/api/sim')
+
+
+def count(daemon, request):
+    return daemon.requests.count(request)
+
+
+def test_a_token_expiring_mid_run_is_renewed_once():
+    with MockDaemon(token_ttl=0.2, run_time=5) as daemon:
+        simulator = Simulator(daemon.host, daemon.port, 'u', 'p')
+        simulator.run(synthetic_model(100))
+        time.sleep(0.3)
+        assert simulator.get_status() == Simulator.STATUS_RUNNING
+        assert simulator.get_status() == Simulator.STATUS_RUNNING
+    assert count(daemon, LOGIN) == 2
+    # the rejected poll and the one it was sent again as, then the next
+    assert count(daemon, SIM_GET) == 3
+
+
+def test_an_upload_with_an_expired_token_is_sent_again():
+    with MockDaemon(token_ttl=0.2) as daemon:
+        simulator = Simulator(daemon.host, daemon.port, 'u', 'p')
+        simulator.run(synthetic_model(100))
+        time.sleep(0.3)
+        simulator.run(synthetic_model(100))
+    assert count(daemon, LOGIN) == 2
+    assert count(daemon, SIM_POST) == 3
+    assert len(daemon.simulations) == 2
+
+
+def test_a_second_rejection_is_raised():
+    with MockDaemon() as daemon:
+        simulator = Simulator(daemon.host, daemon.port, 'u', 'p')
+        simulator.authenticate()
+        daemon.valid = lambda token: False
+        with pytest.raises(AuthenticationError):
+            simulator.get_status()
+        assert count(daemon, LOGIN) == 2 and count(daemon, SIM_GET) == 2
+        with pytest.raises(AuthenticationError):
+            simulator.run(synthetic_model(100))
+        assert count(daemon, LOGIN) == 3 and count(daemon, SIM_POST) == 2
+        assert daemon.simulations == []
+
+
+def test_cached_tokens_are_shared_and_replaced_when_rejected(tmpdir):
+    cache = TokenCache(str(tmpdir.join('tokens.json')))
+    with MockDaemon() as daemon:
+        for _ in range(2):
+            Simulator(daemon.host, daemon.port, 'u', 'p',
+                      token_cache=cache).get_status()
+        assert count(daemon, LOGIN) == 1
+        key = cache.key(daemon.host, daemon.port, 'u')
+        # the daemon forgets every token, eg. after a restart
+        daemon.tokens.clear()
+        Simulator(daemon.host, daemon.port, 'u', 'p',
+                  token_cache=cache).get_status()
+        assert count(daemon, LOGIN) == 2
+        assert daemon.valid(cache.get(key))
@@ -0,0 +1,121 @@
+""" Resumable chunked uploads """
+import json
+
+import numpy
+import pytest
+
+from pyncs.pyncs import (NeuronGroup, SparseConnection, Simulation,
+                         Simulator, SimulationError)
+from pyncs.tests.benchmark import synthetic_model
+from pyncs.tests.mock_daemon import MockDaemon
+from pyncs.upload import ChunkedUpload, _split
+
+
+@pytest.fixture(params=['json', 'attachments'])
+def large_model(request, izh, flat, group):
+    """ A spec large enough to take several chunks, with or without
+    attachments """
+    if request.param == 'json':
+        return synthetic_model(2000)
+    rng = numpy.random.RandomState(0)
+    indptr = numpy.arange(0, 1001 * 100, 100)
+    indices = rng.randint(0, 1000, indptr[-1])
+    connection = SparseConnection(
+        presynaptic='a', postsynaptic='a', synapse=flat(), indptr=indptr,
+        indices=indices, weights=rng.uniform(size=len(indices)))
+    top = group(neuron_groups=[NeuronGroup(neuron=izh(), count=1000,
+                                           label='a')],
+                connections=[connection])
+    return Simulation(top, [], [])
+
+
+def puts(daemon):
+    return sum(1 for method, path in daemon.requests if method == 'PUT')
+
+
+def chunks(simulation, upload):
+    """ Returns the number of chunks a spec is sent in """
+    with MockDaemon() as daemon:
+        Simulator(daemon.host, daemon.port, 'u', 'p',
+                  chunked_upload=upload).run(simulation)
+        return puts(daemon)
+
+
+def failing_chunk(daemon, index):
+    """ Makes the daemon turn one chunk down """
+    accept = daemon.put_chunk
+
+    def put_chunk(upload_id, idx, data):
+        if idx == index:
+            return 400, {'message': 'chunk %d lost' % idx}
+        return accept(upload_id, idx, data)
+    daemon.put_chunk = put_chunk
+    return accept
+
+
+def test_split_regroups_pieces():
+    assert list(_split([b'abc', b'defgh', b'', b'ij'], 4)) == \
+        [b'abcd', b'efgh', b'ij']
+    assert list(_split([], 4)) == []
+
+
+def test_a_large_spec_arrives_whole(transfer_format):
+    simulation = synthetic_model(2000)
+    seen = []
+    with MockDaemon(max_body=50000) as daemon:
+        whole = Simulator(daemon.host, daemon.port, 'u', 'p')
+        with pytest.raises(SimulationError):
+            whole.run(simulation)
+        upload = ChunkedUpload(chunk_size=20000, min_size=0,
+                               progress=lambda held, size: seen.append(held))
+        Simulator(daemon.host, daemon.port, 'u', 'p',
+                  chunked_upload=upload).run(simulation)
+        received = daemon.simulations[-1]
+    assert received == json.loads(json.dumps(transfer_format(simulation)))
+    assert seen == sorted(seen) and seen[0] == 0 and len(seen) > 2
+
+
+def test_an_interrupted_upload_resumes(large_model):
+    simulation = large_model
+    upload = ChunkedUpload(chunk_size=50000, workers=1, min_size=0)
+    total = chunks(simulation, upload)
+    assert total > 5
+    with MockDaemon() as daemon:
+        simulator = Simulator(daemon.host, daemon.port, 'u', 'p',
+                              chunked_upload=upload)
+        accept = failing_chunk(daemon, 5)
+        with pytest.raises(SimulationError):
+            simulator.run(simulation)
+        held = len(list(daemon.uploads.values())[0].chunks)
+        daemon.put_chunk = accept
+        del daemon.requests[:]
+        simulator.run(simulation)
+        assert len(daemon.simulations) == 1
+        assert puts(daemon) == total - held
+    assert held == 5
+
+
+def test_without_resume_everything_is_sent_again():
+    simulation = synthetic_model(2000)
+    upload = ChunkedUpload(chunk_size=50000, workers=1, min_size=0,
+                           resume=False)
+    total = chunks(simulation, upload)
+    with MockDaemon() as daemon:
+        simulator = Simulator(daemon.host, daemon.port, 'u', 'p',
+                              chunked_upload=upload)
+        accept = failing_chunk(daemon, 5)
+        with pytest.raises(SimulationError):
+            simulator.run(simulation)
+        daemon.put_chunk = accept
+        del daemon.requests[:]
+        simulator.run(simulation)
+        assert puts(daemon) == total
+
+
+def test_daemons_without_chunked_uploads_are_reported():
+    with MockDaemon(chunked=False) as daemon:
+        simulator = Simulator(daemon.host, daemon.port, 'u', 'p',
+                              chunked_upload=ChunkedUpload(chunk_size=1000,
+                                                           min_size=0))
+        with pytest.raises(SimulationError):
+            simulator.run(synthetic_model(100))
@@ -0,0 +1,95 @@
+""" The binary wire format """
+import json
+
+import pytest
+
+from pyncs import wire
+from pyncs.pyncs import Simulator
+from pyncs.tests.benchmark import synthetic_model
+from pyncs.tests.mock_daemon import MockDaemon
+
+
+@pytest.fixture(params=['python', 'msgpack'])
+def decoder(request, monkeypatch):
+    """ Decodes with the pure Python decoder or the msgpack C extension """
+    if request.param == 'python':
+        monkeypatch.setattr(wire, 'msgpack', None)
+    elif wire.msgpack is None:
+        pytest.skip("msgpack isn't installed")
+    return request.param
+
+
+def test_a_transfer_format_round_trips(transfer_format, decoder):
+    document = transfer_format(synthetic_model(200))
+    assert wire.loads(wire.dumps(document)) == document
+
+
+@pytest.mark.parametrize('value', [
+    0, -1, 127, 128, -33, 2 ** 40, -2 ** 63, 2 ** 64 - 1,
+    0.5, 0.1, -65.0, 1e300, float('inf'),
+    u'', u'label', u'été', u'x' * 70000,
+    None, True, False, [], {},
+    {'type': 'normal', 'mean': 0.1, 'stdev': 2.0},
+    {'type': 'uniform', 'min': 1.0, 'max': 4.0},
+    {'x': 0.0, 'y': 1.5, 'z': -2.0},
+    {'type': 'normal', 'mean': 1, 'stdev': 2},
+    {'_id': 'ab' * 32, 'refs': ['cd' * 32, 'not an id']},
+    list(range(70000)),
+])
+def test_values_round_trip(value, decoder):
+    decoded = wire.loads(wire.dumps({'value': value}))['value']
+    assert decoded == value
+    assert type(decoded) == type(json.loads(json.dumps(value)))
+
+
+def test_floats_keep_their_precision():
+    decoded = wire.loads(wire.dumps([0.1, 1.0 / 3, 0.25]))
+    assert decoded == [0.1, 1.0 / 3, 0.25]
+
+
+def test_payloads_are_smaller_than_json(transfer_format):
+    document = transfer_format(synthetic_model(2000))
+    assert len(wire.dumps(document)) < len(json.dumps(document)) / 2
+
+
+def test_keys_are_sent_once():
+    document = [{'specification': i} for i in range(1000)]
+    assert wire.dumps(document).count(b'specification') == 1
+
+
+@pytest.mark.parametrize('data', [
+    b'', b'\x93', b'not msgpack', b'\x92\xa0\x90',
+    wire.dumps({'a': 1}) + b'\x00', wire.dumps({'a': 1})[:-1],
+    # a key index past the end of the key table
+    wire.dumps({'a': 1}).replace(b'\x81\x00', b'\x81\x05'),
+    # packed floats of an unknown shape
+    b'\x93\xaencs-transfer-1\x90\xc7\x01\x01\x09'])
+def test_bad_payloads_are_refused(data, decoder):
+    with pytest.raises(ValueError):
+        wire.loads(data)
+
+
+def test_unencodable_values_are_refused():
+    with pytest.raises(TypeError):
+        wire.dumps({'value': object()})
+
+
+def test_the_daemon_receives_the_same_document(transfer_format):
+    simulation = synthetic_model(200)
+    with MockDaemon() as daemon:
+        Simulator(daemon.host, daemon.port, 'u', 'p',
+                  wire_format='binary').run(simulation)
+        binary = daemon.simulations[-1]
+        daemon.runs_until = 0
+        Simulator(daemon.host, daemon.port, 'u', 'p').run(simulation)
+        assert daemon.simulations[-1] == binary
+    assert binary == json.loads(json.dumps(transfer_format(simulation)))
+
+
+def test_auto_falls_back_to_json():
+    with MockDaemon(binary=False) as daemon:
+        simulator = Simulator(daemon.host, daemon.port, 'u', 'p',
+                              wire_format='auto')
+        simulator.run(synthetic_model(100))
+        assert simulator.binary_rejected
+        assert len(daemon.simulations) == 1
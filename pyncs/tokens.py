@@ -0,0 +1,59 @@
+import json
+import os
+import time
+
+
+class TokenCache(object):
+    """ On disk store of daemon login tokens, shared by every process that
+    points at the same file so short lived workers can skip logging in """
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        # seconds a token is trusted for when the daemon doesn't say
+        self.ttl = ttl
+
+    @staticmethod
+    def key(host, port, username):
+        return '%s@%s:%s' % (username, host, port)
+
+    def get(self, key):
+        """ Returns the cached token for key, or None if there's no token
+        or it has expired """
+        entry = self._load().get(key)
+        if entry is None or entry['expires'] <= time.time():
+            return None
+        return entry['token']
+
+    def put(self, key, token, ttl=None):
+        tokens = self._load()
+        tokens[key] = {
+            'token': token,
+            'expires': time.time() + (self.ttl if ttl is None else ttl)
+        }
+        self._save(tokens)
+
+    def discard(self, key):
+        tokens = self._load()
+        if tokens.pop(key, None) is not None:
+            self._save(tokens)
+
+    def _load(self):
+        # read on every lookup, another process may have logged in since
+        try:
+            with open(self.path) as f:
+                tokens = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        now = time.time()
+        return dict((key, entry) for key, entry in tokens.items()
+                    if entry['expires'] > now)
+
+    def _save(self, tokens):
+        # tokens are credentials, keep them private to the user, and write
+        # to a per process temporary file so concurrent workers never see a
+        # half written cache
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(tokens, f)
+        os.rename(tmp_path, self.path)
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class TransportStats(object):
+    """ Counters describing how the transport has used its connections """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.connections_opened = 0
+
+    @property
+    def connections_reused(self):
+        # every request that didn't have to open a socket got a pooled one
+        return max(self.requests - self.connections_opened, 0)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'connections_opened': self.connections_opened,
+            'connections_reused': self.connections_reused
+        }
+
+    def _increment(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+
+def _counting_pool(base, stats):
+    """ Builds a connection pool class that reports new sockets to stats """
+
+    class _CountingPool(base):
+
+        def _new_conn(self):
+            stats._increment('connections_opened')
+            return base._new_conn(self)
+
+    return _CountingPool
+
+
+class _CountingAdapter(HTTPAdapter):
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        HTTPAdapter.__init__(self, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        # swap in pools that count the sockets they open so we can tell
+        # whether keep-alive is actually being used
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self.stats),
+            'https': _counting_pool(HTTPSConnectionPool, self.stats)
+        }
+
+
+class Transport(object):
+    """ Pooled, keep-alive HTTP transport shared by a Simulator's requests """
+
+    # server side hiccups that are worth retrying for idempotent calls
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self, pool_connections=1, pool_maxsize=10, pool_block=False,
+                 timeout=(3.05, 60), max_retries=3, backoff_factor=0.1,
+                 keep_alive=True):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.keep_alive = keep_alive
+        self.stats = TransportStats()
+        self.session = requests.Session()
+        # retries are handled here rather than by urllib3 so that only the
+        # calls we know are idempotent get repeated
+        adapter = _CountingAdapter(self.stats,
+                                   pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=pool_block,
+                                   max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        # GETs are safe to repeat, anything else must opt in
+        if idempotent is None:
+            idempotent = method.upper() in ('GET', 'HEAD', 'OPTIONS')
+        kwargs.setdefault('timeout', self.timeout)
+        attempts = self.max_retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            if attempt:
+                self.stats._increment('retries')
+                time.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+            self.stats._increment('requests')
+            try:
+                r = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                # out of attempts, let the caller see the original error
+                if attempt == attempts - 1:
+                    raise
+                continue
+            if r.status_code in self.RETRY_STATUSES and attempt < attempts - 1:
+                # release the connection back to the pool before retrying
+                r.close()
+                continue
+            return r
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
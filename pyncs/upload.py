@@ -0,0 +1,154 @@
+""" Resumable chunked uploads of large simulation specs.
+
+A spec of hundreds of megabytes is more than a daemon will take in one
+request, and sending it whole means starting over whenever the connection
+drops. A ChunkedUpload sends it in numbered chunks of chunk_size bytes
+instead, each identified by its sha256:
+
+    POST /ncs/api/upload with {'size', 'sha256', 'chunk_size', 'chunks',
+    'content_type', 'content_encoding', 'restart'}, 'chunks' being the
+    sha256 of every chunk, starts an upload or picks up the one already
+    started for a spec with the same sha256. The daemon answers
+    {'upload': id, 'received': [index of every chunk it holds]}.
+    PUT /ncs/api/upload/<id>/<index> sends a chunk, which the daemon checks
+    against its hash.
+    POST /ncs/api/upload/<id>/commit puts the chunks back together and
+    submits the spec, answering as POST /ncs/api/sim does.
+
+Chunks are sent by several threads at once over the transport's pooled
+connections. Sending a chunk again is harmless, so the transport retries
+those that fail. An upload that fails anyway keeps the chunks the daemon
+acknowledged, and submitting the same spec again with resume only sends the
+rest.
+"""
+import hashlib
+import json
+import threading
+
+from .pyncs import SimulationError
+
+# bytes per chunk, small enough to get past the request size limits of a
+# daemon and to lose little when a connection drops
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class ChunkedUpload(object):
+    """ Sends a Simulator's specs in chunks, see the module docstring.
+    progress, if given, is called with the bytes the daemon holds and the
+    size of the spec each time a chunk is acknowledged, from the sending
+    threads. Specs no larger than min_size are sent in one request as
+    usual. """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, workers=4, resume=True,
+                 progress=None, min_size=CHUNK_SIZE):
+        if chunk_size < 1:
+            raise ValueError("chunk_size has to be at least 1")
+        self.chunk_size = chunk_size
+        # chunks in flight at a time, the transport's pool_maxsize should
+        # be at least this to keep a connection for each
+        self.workers = workers
+        # skip the chunks the daemon already holds from an earlier attempt,
+        # otherwise it's asked to drop them and everything is sent again
+        self.resume = resume
+        self.progress = progress
+        self.min_size = min_size
+
+    def send(self, simulator, payload, headers):
+        """ Uploads a payload through simulator and returns the daemon's
+        response to the commit. payload is an iterable of byte chunks that
+        can be iterated more than once, it's split into chunks of
+        chunk_size as it's read, hashed on the first pass and sent on the
+        second. headers are those of the equivalent single request. """
+        hashes = []
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in _split(payload, self.chunk_size):
+            digest.update(chunk)
+            hashes.append(hashlib.sha256(chunk).hexdigest())
+            size += len(chunk)
+        url = simulator.url + '/upload'
+        manifest = {
+            'size': size,
+            'sha256': digest.hexdigest(),
+            'chunk_size': self.chunk_size,
+            'chunks': hashes,
+            'content_type': headers.get('Content-Type'),
+            'content_encoding': headers.get('Content-Encoding'),
+            'restart': not self.resume
+        }
+        # the daemon picks up where it left off, so starting is idempotent
+        r = simulator._request('POST', url,
+                               body=lambda: json.dumps(manifest),
+                               headers={'Content-Type': 'application/json'},
+                               idempotent=True)
+        if r.status_code == 404:
+            raise SimulationError("the daemon doesn't support chunked "
+                                  "uploads")
+        if r.status_code != 200:
+            raise SimulationError(r.json()['message'], r.status_code)
+        res = r.json()
+        url += '/' + res['upload']
+        received = set(res['received'])
+        held = [sum(min(self.chunk_size, size - idx * self.chunk_size)
+                    for idx in received)]
+        if self.progress is not None:
+            self.progress(held[0], size)
+        chunks = ((idx, chunk) for idx, chunk in
+                  enumerate(_split(payload, self.chunk_size))
+                  if idx not in received)
+        lock = threading.Lock()
+        errors = []
+
+        def work():
+            while True:
+                with lock:
+                    item = None if errors else next(chunks, None)
+                if item is None:
+                    return
+                idx, chunk = item
+                try:
+                    r = simulator._request(
+                        'PUT', '%s/%d' % (url, idx), body=lambda: chunk,
+                        headers={'Content-Type': 'application/octet-stream'},
+                        idempotent=True)
+                    if r.status_code != 200:
+                        raise SimulationError(r.json()['message'],
+                                              r.status_code)
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+                    return
+                with lock:
+                    held[0] += len(chunk)
+                    if self.progress is not None:
+                        self.progress(held[0], size)
+        threads = [threading.Thread(target=work)
+                   for _ in range(max(1, self.workers))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return simulator._request('POST', url + '/commit')
+
+
+def _split(payload, chunk_size):
+    """ Yields payload, an iterable of byte chunks, as bytes of chunk_size
+    each, but for the last """
+    buf = []
+    size = 0
+    for piece in payload:
+        start = 0
+        while start < len(piece):
+            take = min(len(piece) - start, chunk_size - size)
+            buf.append(bytes(piece[start:start + take]))
+            size += take
+            start += take
+            if size == chunk_size:
+                yield b''.join(buf)
+                buf = []
+                size = 0
+    if buf:
+        yield b''.join(buf)
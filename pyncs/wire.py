@@ -0,0 +1,417 @@
+""" Compact binary encoding of the transfer format.
+
+The payload is standard MessagePack: an array of the format name, a table of
+every map key used and the document itself. Inside the document map keys
+are written as indices into the key table, so names like "specification" or
+"threshold" are sent once per payload rather than once per entity.
+
+Two extension types keep the common values small:
+
+- 1, packed floats: a shape byte followed by the float values of a
+  distribution, geometry or location dict, little endian float32 when every
+  value survives the round trip (bit 0x80 of the shape byte), else float64.
+- 2, entity ids: the 32 bytes of a 64 character lowercase hex _id.
+
+Floats elsewhere are written as float32 when that's exact and float64
+otherwise, so decoding always gives back the document that was encoded.
+
+Payloads are decoded by the msgpack package's C extension when it's
+installed and by a pure Python decoder otherwise. Encoding is always done
+here: msgpack can't write the key table or the extension types without a
+rewritten copy of the document, which costs more than packing directly.
+"""
+import re
+import struct
+import sys
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# msgpack before 1.0 lacks strict_map_key
+if msgpack is not None and msgpack.version < (1, 0):
+    msgpack = None
+
+CONTENT_TYPE = 'application/vnd.ncs.transfer+msgpack'
+FORMAT = 'ncs-transfer-1'
+
+_EXT_FLOATS = 1
+_EXT_ID = 2
+_FLOAT32 = 0x80
+
+# dicts that are sent as packed float arrays: shape byte -> constant items,
+# float keys in order
+_SHAPES = {
+    1: ({'type': 'normal'}, ('mean', 'stdev')),
+    2: ({'type': 'uniform'}, ('min', 'max')),
+    3: ({}, ('x', 'y', 'z')),
+    4: ({}, ('width', 'height', 'depth'))
+}
+
+_HEX_ID = re.compile('[0-9a-f]{64}$')
+
+if sys.version_info[0] >= 3:
+    _text_types = (str,)
+    _int_types = (int,)
+    _unhexlify = bytes.fromhex
+
+    def _hexlify(data):
+        return data.hex()
+else:
+    _text_types = (str, unicode)  # noqa: F821
+    _int_types = (int, long)  # noqa: F821
+
+    def _unhexlify(text):
+        return text.decode('hex')
+
+    def _hexlify(data):
+        return data.encode('hex')
+
+_pack_f32 = struct.Struct('>f').pack
+_pack_f64 = struct.Struct('>d').pack
+
+
+def _shape_of(d):
+    # membership tests first, they rule out almost every dict cheaply
+    if 'type' in d:
+        shape = _DISTRIBUTIONS.get(d['type'])
+    elif 'x' in d:
+        shape = 3
+    elif 'width' in d:
+        shape = 4
+    else:
+        return None, None
+    if shape is None:
+        return None, None
+    constants, keys = _SHAPES[shape]
+    if len(d) != len(constants) + len(keys):
+        return None, None
+    for key in keys:
+        if type(d.get(key)) is not float:
+            return None, None
+    return shape, keys
+
+
+_DISTRIBUTIONS = {'normal': 1, 'uniform': 2}
+
+_FLOAT_LAYOUTS = frozenset(frozenset(constants) | frozenset(keys)
+                           for constants, keys in _SHAPES.values())
+
+
+class _Encoder(object):
+
+    def __init__(self):
+        # map key -> its packed index in the key table
+        self.keys = {}
+        # packed bytes of every string and float value seen, ids, labels
+        # and parameter values repeat a lot
+        self.strings = {}
+        self.floats = {}
+        # shape and values -> packed float dicts, geometries and locations
+        # repeat too
+        self.float_dicts = {}
+        # keys of a map in order -> whether it may be a float dict, its
+        # header and packed keys, most maps share a few layouts
+        self.layouts = {}
+
+    def pack(self, obj, out):
+        kind = type(obj)
+        if kind in _text_types:
+            out += self.strings.get(obj) or self._string(obj)
+        elif kind is float:
+            out += self._float(obj)
+        elif kind is bool:
+            out.append(0xc3 if obj else 0xc2)
+        elif kind in _int_types:
+            out += _int(obj)
+        elif obj is None:
+            out.append(0xc0)
+        elif isinstance(obj, dict):
+            self._map(obj, out)
+        elif isinstance(obj, (list, tuple)):
+            out += _header(len(obj), 0x90, 0xdc)
+            for item in obj:
+                self.pack(item, out)
+        elif hasattr(obj, 'item'):
+            # numpy scalars
+            self.pack(obj.item(), out)
+        else:
+            raise TypeError("%r can't be encoded" % (obj,))
+
+    def _map(self, d, out):
+        layout = tuple(d)
+        packed = self.layouts.get(layout)
+        if packed is None:
+            packed = self._layout(layout)
+        floats, header, packed_keys = packed
+        if floats:
+            shape, keys = _shape_of(d)
+            if shape is not None:
+                out += self._float_dict(shape, [d[key] for key in keys])
+                return
+        out += header
+        strings = self.strings
+        floats = self.floats
+        pack = self.pack
+        for packed_key, value in zip(packed_keys, d.values()):
+            out += packed_key
+            # the common leaf types are handled here to save a call
+            kind = type(value)
+            if kind is str:
+                out += strings.get(value) or self._string(value)
+            elif kind is float:
+                out += floats.get(value) or self._float(value)
+            else:
+                pack(value, out)
+
+    def _layout(self, layout):
+        keys = self.keys
+        for key in layout:
+            if key not in keys:
+                keys[key] = _int(len(keys))
+        # only maps with the keys of a packed float dict can be one
+        packed = self.layouts[layout] = (
+            frozenset(layout) in _FLOAT_LAYOUTS,
+            _header(len(layout), 0x80, 0xde), [keys[key] for key in layout])
+        return packed
+
+    def _float_dict(self, shape, values):
+        # keyed by the packed doubles so 0.0 and -0.0 stay apart
+        key = (shape, struct.pack('<%dd' % len(values), *values))
+        packed = self.float_dicts.get(key)
+        if packed is None:
+            packed = self.float_dicts[key] = _packed_floats(shape, values)
+        return packed
+
+    def _float(self, value):
+        packed = self.floats.get(value)
+        if packed is None:
+            packed = _float(value)
+            # 0.0 and -0.0 compare equal, keep them apart
+            if value:
+                self.floats[value] = packed
+        return packed
+
+    def _string(self, text):
+        if _HEX_ID.match(text):
+            packed = struct.pack('>BBb', 0xc7, 32, _EXT_ID) + _unhexlify(text)
+        else:
+            data = text.encode('utf-8')
+            size = len(data)
+            if size < 32:
+                packed = struct.pack('B', 0xa0 | size) + data
+            elif size < 0x100:
+                packed = struct.pack('>BB', 0xd9, size) + data
+            elif size < 0x10000:
+                packed = struct.pack('>BH', 0xda, size) + data
+            else:
+                packed = struct.pack('>BI', 0xdb, size) + data
+        self.strings[text] = packed
+        return packed
+
+
+def _header(size, fix, wide):
+    # fixarray/fixmap below 16 items, array16/map16 and array32/map32 above
+    if size < 16:
+        return struct.pack('B', fix | size)
+    if size < 0x10000:
+        return struct.pack('>BH', wide, size)
+    return struct.pack('>BI', wide + 1, size)
+
+
+def _int(value):
+    if 0 <= value < 0x80:
+        return struct.pack('B', value)
+    if -32 <= value < 0:
+        return struct.pack('b', value)
+    if 0 <= value < 0x100000000:
+        return struct.pack('>BI', 0xce, value)
+    if 0 <= value < 0x10000000000000000:
+        return struct.pack('>BQ', 0xcf, value)
+    if -0x80000000 <= value < 0:
+        return struct.pack('>Bi', 0xd2, value)
+    if -0x8000000000000000 <= value < 0:
+        return struct.pack('>Bq', 0xd3, value)
+    raise OverflowError("%d doesn't fit in 64 bits" % value)
+
+
+def _float(value):
+    try:
+        packed = _pack_f32(value)
+        if struct.unpack('>f', packed)[0] == value:
+            return b'\xca' + packed
+    except OverflowError:
+        pass
+    return b'\xcb' + _pack_f64(value)
+
+
+def _packed_floats(shape, values):
+    count = len(values)
+    try:
+        data = struct.pack('<%df' % count, *values)
+        if list(struct.unpack('<%df' % count, data)) != values:
+            data = None
+    except OverflowError:
+        data = None
+    if data is None:
+        data = struct.pack('<%dd' % count, *values)
+    else:
+        shape |= _FLOAT32
+    payload = struct.pack('B', shape) + data
+    return struct.pack('>BBb', 0xc7, len(payload), _EXT_FLOATS) + payload
+
+
+def dumps(document):
+    """ Encodes a transfer format document """
+    encoder = _Encoder()
+    body = bytearray()
+    encoder.pack(document, body)
+    keys = [None] * len(encoder.keys)
+    for key, packed in encoder.keys.items():
+        keys[_Decoder(packed).decode()] = key
+    out = bytearray(_header(3, 0x90, 0xdc))
+    encoder.pack(FORMAT, out)
+    encoder.pack(keys, out)
+    out += body
+    return bytes(out)
+
+
+class _Decoder(object):
+
+    def __init__(self, data, keys=None):
+        self.data = data
+        self.pos = 0
+        self.keys = keys
+
+    def _take(self, size):
+        start = self.pos
+        self.pos += size
+        if self.pos > len(self.data):
+            raise ValueError("truncated payload")
+        return self.data[start:self.pos]
+
+    def _unpack(self, fmt, size):
+        return struct.unpack(fmt, self._take(size))[0]
+
+    def decode(self):
+        byte = self._unpack('B', 1)
+        if byte < 0x80:
+            return byte
+        if byte >= 0xe0:
+            return byte - 0x100
+        if byte < 0x90:
+            return self._map(byte & 0x0f)
+        if byte < 0xa0:
+            return self._array(byte & 0x0f)
+        if byte < 0xc0:
+            return self._take(byte & 0x1f).decode('utf-8')
+        if byte == 0xc0:
+            return None
+        if byte in (0xc2, 0xc3):
+            return byte == 0xc3
+        if byte in _FIXED:
+            fmt, size = _FIXED[byte]
+            return self._unpack(fmt, size)
+        if byte in (0xd9, 0xda, 0xdb):
+            size = self._unpack(*_SIZES[byte])
+            return self._take(size).decode('utf-8')
+        if byte in (0xdc, 0xdd):
+            return self._array(self._unpack(*_SIZES[byte]))
+        if byte in (0xde, 0xdf):
+            return self._map(self._unpack(*_SIZES[byte]))
+        if byte == 0xc7:
+            return self._ext(self._unpack('B', 1))
+        raise ValueError("unsupported type byte 0x%02x" % byte)
+
+    def _array(self, size):
+        return [self.decode() for _ in range(size)]
+
+    def _map(self, size):
+        d = {}
+        for _ in range(size):
+            key = self.decode()
+            if self.keys is not None:
+                try:
+                    key = self.keys[key]
+                except (IndexError, TypeError):
+                    raise ValueError("unknown key %r" % (key,))
+            d[key] = self.decode()
+        return d
+
+    def _ext(self, size):
+        ext_type = self._unpack('b', 1)
+        return _ext(ext_type, self._take(size))
+
+
+def _ext(ext_type, payload):
+    if ext_type == _EXT_ID:
+        return _hexlify(payload)
+    if ext_type != _EXT_FLOATS:
+        raise ValueError("unsupported extension type %d" % ext_type)
+    try:
+        shape = struct.unpack('B', payload[:1])[0]
+        constants, keys = _SHAPES[shape & ~_FLOAT32]
+        fmt = '<%d%s' % (len(keys), 'f' if shape & _FLOAT32 else 'd')
+        values = struct.unpack(fmt, payload[1:])
+    except (struct.error, KeyError):
+        raise ValueError("malformed packed floats")
+    d = dict(constants)
+    d.update(zip(keys, values))
+    return d
+
+
+_FIXED = {
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8)
+}
+
+_SIZES = {
+    0xd9: ('>B', 1), 0xda: ('>H', 2), 0xdb: ('>I', 4),
+    0xdc: ('>H', 2), 0xdd: ('>I', 4), 0xde: ('>H', 2), 0xdf: ('>I', 4)
+}
+
+
+def loads(data):
+    """ Decodes a payload produced by dumps """
+    if msgpack is not None:
+        return _unpack(data)
+    decoder = _Decoder(data)
+    if decoder._unpack('B', 1) != 0x93:
+        raise ValueError("not a transfer format payload")
+    if decoder.decode() != FORMAT:
+        raise ValueError("unsupported payload format")
+    decoder.keys = decoder.decode()
+    document = decoder.decode()
+    if decoder.pos != len(data):
+        raise ValueError("trailing data after the document")
+    return document
+
+
+def _unpack(data):
+    # the key table comes before the document, so it's known by the time
+    # the maps of the document are built
+    keys = []
+
+    def pairs(items):
+        return dict((keys[key], value) for key, value in items)
+    unpacker = msgpack.Unpacker(raw=False, strict_map_key=False,
+                                object_pairs_hook=pairs, ext_hook=_ext,
+                                max_buffer_size=max(len(data), 1))
+    unpacker.feed(data)
+    try:
+        if unpacker.read_array_header() != 3:
+            raise ValueError("not a transfer format payload")
+        if unpacker.unpack() != FORMAT:
+            raise ValueError("unsupported payload format")
+        keys.extend(unpacker.unpack())
+        document = unpacker.unpack()
+    except ValueError:
+        raise
+    except Exception as e:
+        # msgpack.OutOfData among others, and key indices out of range
+        raise ValueError("malformed payload: %r" % (e,))
+    if unpacker.tell() != len(data):
+        raise ValueError("trailing data after the document")
+    return document